@@ -0,0 +1,255 @@
+"""
+In-memory airport index: IATA code -> name, city, country and served routes.
+
+Loaded once per process from a bundled data file (data/airports.json) so
+forms can autocomplete airports and malformed codes are rejected before any
+upstream call. The bundled list can lag behind Ryanair's network, so codes
+missing from it only get a warning and are still searched. Name/city/code
+prefixes are indexed in a trie, so an autocomplete lookup is a walk down the
+typed prefix.
+
+Routes are optional in the data file. When an airport has no route list the
+index doesn't restrict its destinations. Refresh the file (with routes) from
+Ryanair's locate API with:
+    python -m airports --refresh
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+AIRPORTS_DATA_PATH = os.environ.get('AIRPORTS_DATA_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'airports.json'))
+AIRPORTS_LOCATE_URL = 'https://www.ryanair.com/api/views/locate/5/airports/en/active'
+AIRPORT_ROUTES_URL = 'https://www.ryanair.com/api/views/locate/searchWidget/routes/en/airport/{iata}'
+
+IATA_PATTERN = re.compile(r"^[A-Za-z]{3}$") # Compiled once for every route's shape checks
+
+
+def _normalize(text):
+    """Lowercases and strips accents so 'Málaga' matches 'mala'."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+class _TrieNode:
+    __slots__ = ('children', 'codes')
+
+    def __init__(self):
+        self.children = {}
+        self.codes = set() # Every airport with a searchable term starting at this prefix
+
+
+class AirportIndex:
+    def __init__(self, airports):
+        self.airports = {}
+        self._root = _TrieNode()
+        for airport in airports:
+            code = airport['iata'].upper()
+            record = {
+                'iata': code,
+                'name': airport.get('name') or code,
+                'city': airport.get('city') or '',
+                'country': (airport.get('country') or '').upper(),
+            }
+            routes = airport.get('routes')
+            record['routes'] = frozenset(r.upper() for r in routes) if routes else None
+            self.airports[code] = record
+            for term in self._terms(record):
+                self._insert(term, code)
+
+    @staticmethod
+    def _terms(record):
+        # The code, the full name/city, and each word of them ('Rome Ciampino' -> 'ciampino')
+        terms = {_normalize(record['iata'])}
+        for text in (record['name'], record['city']):
+            normalized = _normalize(text)
+            terms.add(normalized)
+            terms.update(word for word in re.split(r'[\s/\-]+', normalized) if word)
+        return terms
+
+    def _insert(self, term, code):
+        node = self._root
+        node.codes.add(code)
+        for ch in term:
+            node = node.children.setdefault(ch, _TrieNode())
+            node.codes.add(code)
+
+    def __contains__(self, code):
+        return code.upper() in self.airports
+
+    def __len__(self):
+        return len(self.airports)
+
+    def get(self, code):
+        return self.airports.get(code.upper())
+
+    def search(self, query, limit=10):
+        """Airports whose code, name or city starts with query; exact code matches first."""
+        query = _normalize(query.strip())
+        if not query:
+            return []
+        node = self._root
+        for ch in query:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        exact = query.upper()
+
+        def rank(code):
+            record = self.airports[code]
+            return (code != exact, not _normalize(code).startswith(query), record['name'])
+
+        return [self.public_record(code) for code in sorted(node.codes, key=rank)[:limit]]
+
+    def public_record(self, code):
+        record = self.airports[code]
+        return {'iata': code, 'name': record['name'], 'city': record['city'], 'country': record['country']}
+
+    def serves(self, origin_iata, destination_iata):
+        """False only when the origin's route list is known and lacks a destination the index knows."""
+        record = self.airports.get(origin_iata.upper())
+        if record is None or record['routes'] is None or destination_iata not in self:
+            return True
+        return destination_iata.upper() in record['routes']
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_index(path=None):
+    path = path or AIRPORTS_DATA_PATH
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not load airport data from {path}: {e}. IATA codes will only be shape-checked.")
+        return AirportIndex([])
+    index = AirportIndex(data.get('airports', []))
+    print(f"Airport index loaded: {len(index)} airports from {path}.")
+    return index
+
+
+def get_index():
+    """Returns the process-wide index, loading the data file on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    return _index
+
+
+def check_codes(codes):
+    """
+    Returns (malformed, unknown) lists for the given IATA codes. Codes are
+    only reported unknown when the index loaded; an empty index accepts any
+    well-formed code.
+    """
+    index = get_index()
+    malformed = [code for code in codes if not code or not IATA_PATTERN.match(code)]
+    unknown = [code for code in codes if code and IATA_PATTERN.match(code) and len(index) and code not in index]
+    return malformed, unknown
+
+
+def code_errors(codes, label='IATA'):
+    """Flash-ready messages for malformed codes (empty if all are well-formed)."""
+    malformed, _ = check_codes(codes)
+    if malformed:
+        return [f"Invalid {label} code(s): {', '.join(malformed) or '(empty)'}. Please use 3 letters only."]
+    return []
+
+
+def code_warnings(codes, label='IATA'):
+    """Flash-ready messages for well-formed codes missing from the index (searched anyway)."""
+    _, unknown = check_codes(codes)
+    if unknown:
+        return [f"{label} code(s) {', '.join(unknown)} aren't in our airport list; searching anyway. "
+                f"Check for typos if nothing is found."]
+    return []
+
+
+def serves(origin_iata, destination_iata):
+    return get_index().serves(origin_iata, destination_iata)
+
+
+# --- Data File Refresh ---
+
+def _fetch_routes(session, iata):
+    try:
+        response = session.get(AIRPORT_ROUTES_URL.format(iata=iata), timeout=20)
+        response.raise_for_status()
+        routes = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"  Warning: Could not fetch routes for {iata}: {e}")
+        return None
+    codes = []
+    for route in routes if isinstance(routes, list) else []:
+        arrival = route.get('arrivalAirport') if isinstance(route, dict) else None
+        if isinstance(arrival, dict) and arrival.get('code'):
+            codes.append(arrival['code'].upper())
+    return sorted(set(codes))
+
+
+def refresh_data_file(path=None, with_routes=True):
+    """Rebuilds the data file from Ryanair's locate API. Returns the number of airports written."""
+    import fare_client # For the shared request headers
+    path = path or AIRPORTS_DATA_PATH
+    session = requests.Session()
+    session.headers.update(fare_client.HEADERS)
+    response = session.get(AIRPORTS_LOCATE_URL, timeout=30)
+    response.raise_for_status()
+
+    airports = []
+    for item in response.json():
+        code = (item.get('code') or '').upper()
+        if not IATA_PATTERN.match(code):
+            continue
+        airports.append({
+            'iata': code,
+            'name': item.get('name') or code,
+            'city': (item.get('city') or {}).get('name') or '',
+            'country': ((item.get('country') or {}).get('code') or '').upper(),
+        })
+
+    if with_routes:
+        with ThreadPoolExecutor(max_workers=fare_client.FARE_FETCH_WORKERS) as executor:
+            routes = executor.map(lambda airport: _fetch_routes(session, airport['iata']), airports)
+            for airport, airport_routes in zip(airports, routes):
+                if airport_routes:
+                    airport['routes'] = airport_routes
+
+    airports.sort(key=lambda airport: airport['iata'])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('{\n  "source": "%s",\n  "airports": [\n' % AIRPORTS_LOCATE_URL)
+        f.write(',\n'.join('    ' + json.dumps(airport, ensure_ascii=False) for airport in airports))
+        f.write('\n  ]\n}\n')
+    os.replace(tmp_path, path)
+    return len(airports)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or refresh the bundled airport index.')
+    parser.add_argument('--refresh', action='store_true', help="Rebuild the data file from Ryanair's locate API.")
+    parser.add_argument('--no-routes', action='store_true', help='Skip fetching served routes per airport.')
+    parser.add_argument('--path', default=AIRPORTS_DATA_PATH)
+    parser.add_argument('query', nargs='?', help='Autocomplete query to try against the index.')
+    args = parser.parse_args()
+
+    if args.refresh:
+        count = refresh_data_file(args.path, with_routes=not args.no_routes)
+        print(f"Wrote {count} airports to {args.path}")
+    index = load_index(args.path)
+    if args.query:
+        for airport in index.search(args.query):
+            print(f"{airport['iata']}  {airport['name']} ({airport['city']}, {airport['country']})")
+
+
+if __name__ == '__main__':
+    main()
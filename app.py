@@ -8,47 +8,123 @@ import calendar
 import atexit # To shut down scheduler
 import logging # For scheduler logging
 import uuid # Added for generating unique IDs
-from supabase import create_client, Client # Added for Supabase
-
-from flask import Flask, render_template, request, flash, jsonify, redirect, url_for # Added redirect, url_for
-from flask_mail import Mail, Message # Added Mail, Message
-from apscheduler.schedulers.background import BackgroundScheduler
-# Test comment
-app = Flask(__name__)
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default-fallback-secret-key') # Use env var for secret key
-
-# --- Flask-Mail Configuration ---
-# IMPORTANT: Set these as environment variables for security!
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER') # e.g., 'smtp.gmail.com'
-app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587)) # e.g., 587 (TLS) or 465 (SSL)
-app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
-app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME') # Your email address
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD') # Your email password or App Password
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', app.config['MAIL_USERNAME']) # Usually same as username
+import time # For request latency metrics
+import threading # For lazy initialization locks
+import functools
+import itertools
+import bisect # Running top lists for streamed results
+import heapq # Top-K parsing under fare budgets
+import hmac # Admin and owner token comparison
+import hashlib # Owner tokens are stored hashed
+import secrets # Owner token generation
+from urllib.parse import urlencode
+
+from flask import Flask, Blueprint, current_app, render_template, request, flash, jsonify, redirect, url_for, g, Response, session # Added redirect, url_for; g/Response for metrics; session for rule owners
+
+import metrics
+import fare_client
+import state_snapshot
+import fare_search
+import price_matrix
+import itinerary_solver
+import meetup_search
+import airports
+import budget
+import jobs
+import page_cache
+import price_stats
+import profiling
+import refresh_scheduler
+import rule_index
+import fx
+import history_store
+from fare_client import ROUND_TRIP_API_TEMPLATE, ONE_WAY_MONTH_API_TEMPLATE
+
+# Supabase, Flask-Mail and APScheduler are imported and initialized lazily on first use
+# (see get_supabase(), send_email() and start_scheduler()) so worker boot stays cheap.
+bp = Blueprint('main', __name__)
+
 # --- Recipient Configuration ---
 # IMPORTANT: Set this as an environment variable!
-MAIL_RECIPIENT = os.environ.get('MAIL_RECIPIENT') # Email address to send notifications to
+MAIL_RECIPIENT = os.environ.get('MAIL_RECIPIENT') # Default recipient, for rules without their own
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
 
-mail = Mail(app)
+def rule_recipient(rule):
+    """Where a rule's alerts go: its own recipient, else MAIL_RECIPIENT (also for rules saved before recipients existed)."""
+    return rule.get('recipient') or MAIL_RECIPIENT
 
 # --- Notification Config File ---
 NOTIFICATION_RULES_FILE = 'notification_rules.json' # Renamed file
 
-# --- Supabase Setup ---
-supabase_url: str = os.environ.get("SUPABASE_URL")
-supabase_key: str = os.environ.get("SUPABASE_ANON_KEY")
-supabase: Client = None
-if supabase_url and supabase_key:
-    try:
-        supabase = create_client(supabase_url, supabase_key)
-        print("Supabase client initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing Supabase client: {e}")
-else:
-    print("Warning: SUPABASE_URL or SUPABASE_ANON_KEY environment variables not set. Supabase integration disabled.")
+# --- Background Scheduler Configuration ---
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+
+# --- Supabase Setup (lazy) ---
+_supabase_client = None
+_supabase_initialized = False
+_supabase_lock = threading.Lock()
+
+def get_supabase():
+    """Returns the Supabase client, creating it on first use. None if not configured."""
+    global _supabase_client, _supabase_initialized
+    if _supabase_initialized:
+        return _supabase_client
+    with _supabase_lock:
+        if not _supabase_initialized:
+            supabase_url = os.environ.get("SUPABASE_URL")
+            supabase_key = os.environ.get("SUPABASE_ANON_KEY")
+            if supabase_url and supabase_key:
+                try:
+                    from supabase import create_client # Heavy import, only paid by workers that need history
+                    _supabase_client = create_client(supabase_url, supabase_key)
+                    print("Supabase client initialized successfully.")
+                except Exception as e:
+                    print(f"Error initializing Supabase client: {e}")
+            else:
+                print("Warning: SUPABASE_URL or SUPABASE_ANON_KEY environment variables not set. Supabase integration disabled.")
+            _supabase_initialized = True
+    return _supabase_client
 # ---------------------
 
+# --- Flask-Mail (lazy) ---
+_mail_lock = threading.Lock()
+
+def _get_mail():
+    """Flask-Mail for the current app, initialized on first use."""
+    from flask_mail import Mail
+    flask_app = current_app._get_current_object()
+    with _mail_lock:
+        mail = flask_app.extensions.get('mail_client')
+        if mail is None:
+            mail = flask_app.extensions['mail_client'] = Mail(flask_app)
+    return mail
+
+def send_email(subject, body, recipients):
+    """Sends a plain-text email."""
+    from flask_mail import Message
+    msg = Message(subject, recipients=recipients)
+    msg.body = body
+    _get_mail().send(msg)
+
+def send_emails(messages):
+    """
+    Sends [(subject, body, recipients)] as plain-text emails over a single SMTP
+    connection (Flask-Mail reconnects every MAIL_MAX_EMAILS messages if set).
+    Returns [(index, error)] for the messages that failed; raises if the
+    connection itself fails.
+    """
+    from flask_mail import Message
+    failed = []
+    with _get_mail().connect() as connection:
+        for index, (subject, body, recipients) in enumerate(messages):
+            msg = Message(subject, recipients=recipients)
+            msg.body = body
+            try:
+                connection.send(msg)
+            except Exception as e:
+                failed.append((index, e))
+    return failed
+
 def load_notification_rules(): # Renamed function
     """Loads the list of notification rules from JSON file."""
     try:
@@ -70,6 +146,7 @@ def save_notification_rules(rules): # Renamed function
     try:
         with open(NOTIFICATION_RULES_FILE, 'w') as f:
             json.dump(rules, f, indent=4)
+        rule_index.matcher.load_rules(rules) # Re-index so fares fetched from now on match the new rules
         return True
     except IOError as e:
         print(f"Error saving notification rules: {e}")
@@ -83,164 +160,380 @@ background_deal_findings = {
     "deals_under_25": [], # List of trip_details dicts
     "notified_deals": set() # Set of unique identifiers (e.g., "DEST-PRICE-OUT_DATE")
 }
+# Held while background_deal_findings is updated or copied (the snapshot job runs on another thread)
+background_deal_findings_lock = threading.Lock()
 
-# --- Define API Endpoint Templates ---
-# Moved ONE_WAY_MONTH_API_TEMPLATE here and renamed API_ENDPOINT_TEMPLATE
-ROUND_TRIP_API_TEMPLATE = "https://www.ryanair.com/api/farfnd/v4/roundTripFares?departureAirportIataCode={origin_iata}&market=en-gb&adultPaxCount=1&arrivalAirportIataCode={destination_iata}&searchMode=ALL&outboundDepartureDateFrom={out_date_from}&outboundDepartureDateTo={out_date_to}&inboundDepartureDateFrom={in_date_from}&inboundDepartureDateTo={in_date_to}&durationFrom={duration_from}&durationTo={duration_to}&currency={currency}"
-ONE_WAY_MONTH_API_TEMPLATE = "https://www.ryanair.com/api/farfnd/v4/oneWayFares/{origin_iata}/{destination_iata}/cheapestPerDay?outboundMonthOfDate={month_date}&currency={currency}"
-# -----------------------------------
-
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
-}
+# --- Warm-start State Snapshot ---
+# Fare cache and deal findings are restored from the last snapshot in the background.
+STATE_SNAPSHOT_ENABLED = os.environ.get('STATE_SNAPSHOT_ENABLED', 'true').lower() == 'true'
+STATE_SNAPSHOT_INTERVAL_MINUTES = int(os.environ.get('STATE_SNAPSHOT_INTERVAL_MINUTES', 5))
 
 def get_last_day_of_month(year, month):
     return calendar.monthrange(year, month)[1]
 
+# === Metrics ===
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+    if profiling.should_trace(request.headers.get(profiling.TRACE_HEADER)):
+        g.trace_token = profiling.start_trace(f"{request.method} {request.path}")
+
+@bp.after_app_request
+def record_request_latency(response):
+    start = g.pop('request_start_time', None)
+    token = g.pop('trace_token', None)
+    trace = profiling.finish_trace(token) if token is not None else None
+    if trace is not None:
+        # Span breakdown for the browser dev tools; the full trace is under /admin/traces
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Trace-Id'] = trace.id
+    if start is not None:
+        duration = time.perf_counter() - start
+        metrics.HTTP_REQUEST_DURATION.observe(duration,
+                                              endpoint=request.endpoint or 'unmatched',
+                                              method=request.method,
+                                              status=response.status_code)
+        profiling.log_if_slow('request', f"{request.method} {request.full_path.rstrip('?')}", duration, trace)
+    return response
+
+@bp.teardown_app_request
+def finish_abandoned_trace(exc):
+    # after_app_request is skipped when a response can't be produced; don't leave the trace current
+    token = g.pop('trace_token', None)
+    if token is not None:
+        profiling.finish_trace(token)
+
+@bp.app_context_processor
+def inject_currencies():
+    # For the currency select in search forms (templates/_currency_select.html)
+    return {'currencies': fx.supported_currencies(), 'default_currency': fx.requested_currency(None)}
+
+@bp.app_context_processor
+def inject_search_limits():
+    # The multi-city form only streams grids the stream route accepts
+    return {'multi_search_job_threshold': MULTI_SEARCH_JOB_THRESHOLD}
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 # === Single Round Trip Search Routes ===
 
-@app.route('/')
+@bp.route('/')
 def index():
     today = date.today()
     default_month = (today.replace(day=1) + timedelta(days=32)).strftime('%Y-%m')
     # Pass 'now' to the template for the footer
     return render_template('index.html', default_month=default_month, now=datetime.utcnow())
 
-@app.route('/search', methods=['POST'])
+def parse_round_trip_fares(data, limit=None):
+    """
+    Parses a roundTripFares response into trip dicts sorted by total price.
+    With a limit only the cheapest `limit` fares are parsed and kept.
+    """
+    fares = data.get('fares') or []
+    if limit is not None and len(fares) > limit:
+        priced = [fare for fare in fares if isinstance(fare, dict) and _fare_price(fare) is not None]
+        fares = heapq.nsmallest(limit, priced, key=_fare_price)
+    all_trips = []
+    for fare in fares:
+        try:
+            total_price = fare['summary']['price']['value']
+            trip_details = {
+                'origin': fare.get('outbound', {}).get('departureAirport', {}).get('iataCode'),
+                'destination': fare.get('outbound', {}).get('arrivalAirport', {}).get('iataCode'),
+                'total_price': total_price,
+                'currency': fare.get('summary', {}).get('price', {}).get('currencyCode'),
+                'outbound': {
+                    'flight_no': fare.get('outbound', {}).get('flightNumber'),
+                    'dep_time': fare.get('outbound', {}).get('departureDate'),
+                    'arr_time': fare.get('outbound', {}).get('arrivalDate'),
+                    'price': fare.get('outbound', {}).get('price', {}).get('value')
+                },
+                'inbound': {
+                    'flight_no': fare.get('inbound', {}).get('flightNumber'),
+                    'dep_time': fare.get('inbound', {}).get('departureDate'),
+                    'arr_time': fare.get('inbound', {}).get('arrivalDate'),
+                    'price': fare.get('inbound', {}).get('price', {}).get('value')
+                }
+            }
+            all_trips.append(trip_details)
+        except (KeyError, TypeError) as e:
+            print(f"Warning: Could not parse fare details, skipping. Error: {e}. Fare: {fare}")
+            continue
+    all_trips.sort(key=lambda x: x['total_price'])
+    return all_trips
+
+def _fare_price(fare):
+    try:
+        return fare['summary']['price']['value']
+    except (KeyError, TypeError):
+        return None
+
+def budget_stop_message(active_budget=None):
+    """Message for a search cut short by its request/job fare budget (the active one by default), or None."""
+    active_budget = active_budget or budget.current()
+    if active_budget is None or not active_budget.exhausted:
+        return None
+    return (f"This search reached its limit of {active_budget.max_fares} fares or "
+            f"{active_budget.max_bytes // (1024 * 1024)} MB of fare data, so some routes or months may be "
+            f"missing from the results. Try fewer airports or months.")
+
+def describe_fetch_error(error, origin_iata, destination_iata):
+    """User-facing message for an exception raised by fare_client.fetch_json()."""
+    if isinstance(error, budget.BudgetExceeded):
+        return budget_stop_message()
+    if isinstance(error, budget.ResponseTooLarge):
+        print(f"Response too large: {error}")
+        return f"API Error: The response for {origin_iata} -> {destination_iata} was too large to process. Try a shorter duration range."
+    if isinstance(error, requests.exceptions.HTTPError):
+        print(f"HTTP error: {error} - Status: {error.response.status_code}")
+        return f"API Error ({error.response.status_code}) for {origin_iata} -> {destination_iata}. Check IATA codes or try later."
+    if isinstance(error, requests.exceptions.RequestException):
+        print(f"Request error: {error}")
+        return "Network Error: Could not connect to Ryanair API."
+    if isinstance(error, (json.JSONDecodeError, KeyError, TypeError)):
+        print(f"Parsing error: {error}")
+        return "API Error: Received unexpected data format from Ryanair."
+    print(f"Unexpected error: {error}")
+    return "An unexpected error occurred."
+
+def cheapest_trip_in_response(data):
+    """Flat trip details for the cheapest fare of a roundTripFares response, or None."""
+    cheapest = None
+    for fare in data.get('fares') or []:
+        try:
+            total_price = fare.get('summary', {}).get('price', {}).get('value')
+            if total_price is not None and (cheapest is None or total_price < cheapest['total_price']):
+                cheapest = {
+                    'origin_iata': fare.get('outbound', {}).get('departureAirport', {}).get('iataCode'),
+                    'destination_iata': fare.get('outbound', {}).get('arrivalAirport', {}).get('iataCode'),
+                    'total_price': total_price,
+                    'currency': fare.get('summary', {}).get('price', {}).get('currencyCode'),
+                    'outbound_dep_time': fare.get('outbound', {}).get('departureDate'),
+                    'outbound_arr_time': fare.get('outbound', {}).get('arrivalDate'),
+                    'inbound_dep_time': fare.get('inbound', {}).get('departureDate'),
+                    'inbound_arr_time': fare.get('inbound', {}).get('arrivalDate')
+                }
+        except (KeyError, TypeError, AttributeError) as e:
+            print(f"    Warning: Parsing error for fare: {e}. Fare: {fare}")
+            continue
+    return cheapest
+
+def display_trip(trip, display_currency):
+    """A flat trip from cheapest_trip_in_response() with its price in display_currency (None stays None)."""
+    return fx.convert_records([trip], ('total_price',), display_currency)[0] if trip else None
+
+def flash_airport_warnings(codes, label='IATA'):
+    """Warns about codes missing from the bundled airport list; they are still searched."""
+    for warning in airports.code_warnings(codes, label):
+        flash(warning, "warning")
+
+SEARCH_RESULTS_LIMIT = 10 # Trips shown on the round trip results page
+
+@bp.route('/search', methods=['POST'])
+@page_cache.cached_page # Served pre-rendered while its fares are unchanged
+@budget.with_request_budget
 def search_flights():
     # Changed variable names to reflect IATA code input
     origin_iata = request.form.get('origin_iata', '').strip().upper()
     destination_iata = request.form.get('destination_iata', '').strip().upper()
     outbound_month_str = request.form.get('outbound_month')
+    outbound_month_to_str = request.form.get('outbound_month_to', '').strip() # Optional end of a month range
     duration_from = request.form.get('duration_from', '2')
     duration_to = request.form.get('duration_to', '7')
-    currency = "EUR"
+    currency = fx.CANONICAL_CURRENCY # Fares are fetched once in EUR and converted for display
+    display_currency = fx.requested_currency(request.form.get('currency'))
 
     # --- Input Validation (IATA Code) ---
-    iata_pattern = re.compile(r"^[A-Za-z]{3}$") # Simple 3-letter validation
     if not (origin_iata and destination_iata and outbound_month_str):
         flash("Please fill in Origin IATA, Destination IATA, and Outbound Month.")
         # Pass back entered values and 'now'
         return render_template('index.html', default_month=outbound_month_str or date.today().strftime('%Y-%m'),
                                origin_iata=origin_iata, destination_iata=destination_iata, now=datetime.utcnow())
 
-    if not iata_pattern.match(origin_iata) or not iata_pattern.match(destination_iata):
-         flash("Origin and Destination must be 3-letter IATA codes.")
+    # Malformed codes and routes Ryanair doesn't fly are rejected before calling the API
+    iata_errors = airports.code_errors([origin_iata, destination_iata])
+    flash_airport_warnings([origin_iata, destination_iata])
+    if not iata_errors and not airports.serves(origin_iata, destination_iata):
+        iata_errors.append(f"Ryanair doesn't fly {origin_iata} -> {destination_iata}.")
+    if iata_errors:
+         for error in iata_errors:
+             flash(error)
          # Pass back entered values and 'now'
          return render_template('index.html', default_month=outbound_month_str,
                                 origin_iata=origin_iata, destination_iata=destination_iata, now=datetime.utcnow())
 
     print(f"Round Trip Search: {origin_iata} -> {destination_iata}")
 
-    # --- Date Parsing and Validation ---
+    # --- Date Parsing and Validation (one query per outbound month) ---
     try:
-        year, month = map(int, outbound_month_str.split('-'))
-        out_date_from = date(year, month, 1)
-        last_day = get_last_day_of_month(year, month)
-        out_date_to = date(year, month, last_day)
-        in_date_from = out_date_from
-        next_month_date = (out_date_to.replace(day=1) + timedelta(days=32))
-        in_year, in_month = next_month_date.year, next_month_date.month
-        in_last_day = get_last_day_of_month(in_year, in_month)
-        in_date_to = date(in_year, in_month, in_last_day)
-    except ValueError:
-        flash("Invalid month format. Please use YYYY-MM.")
+        months = fare_search.month_range(outbound_month_str, outbound_month_to_str or None)
+    except ValueError as e:
+        flash(f"Invalid month range: {e} Please use YYYY-MM.")
         # Pass back entered values and 'now'
         return render_template('index.html', default_month=date.today().strftime('%Y-%m'),
                                origin_iata=origin_iata, destination_iata=destination_iata, now=datetime.utcnow())
+    month_label = fare_search.format_month_range(months)
 
-    # --- Construct API URL (using form IATA codes) ---
-    api_url = ROUND_TRIP_API_TEMPLATE.format(
-        origin_iata=origin_iata,
-        destination_iata=destination_iata,
-        out_date_from=out_date_from.strftime("%Y-%m-%d"),
-        out_date_to=out_date_to.strftime("%Y-%m-%d"),
-        in_date_from=in_date_from.strftime("%Y-%m-%d"),
-        in_date_to=in_date_to.strftime("%Y-%m-%d"),
-        duration_from=duration_from,
-        duration_to=duration_to,
-        currency=currency
-    )
-
-    print(f"Calling API: {api_url}")
-
-    # --- Call API and Process Results (logic remains largely the same) ---
-    all_trips = []
-    error_message = None
-    try:
-        response = requests.get(api_url, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        if 'fares' in data and data['fares']:
-            for fare in data['fares']:
-                try:
-                    total_price = fare['summary']['price']['value']
-                    trip_details = {
-                        'origin': fare.get('outbound', {}).get('departureAirport', {}).get('iataCode'),
-                        'destination': fare.get('outbound', {}).get('arrivalAirport', {}).get('iataCode'),
-                        'total_price': total_price,
-                        'currency': fare.get('summary', {}).get('price', {}).get('currencyCode'),
-                        'outbound': {
-                            'flight_no': fare.get('outbound', {}).get('flightNumber'),
-                            'dep_time': fare.get('outbound', {}).get('departureDate'),
-                            'arr_time': fare.get('outbound', {}).get('arrivalDate'),
-                            'price': fare.get('outbound', {}).get('price', {}).get('value')
-                        },
-                        'inbound': {
-                            'flight_no': fare.get('inbound', {}).get('flightNumber'),
-                            'dep_time': fare.get('inbound', {}).get('departureDate'),
-                            'arr_time': fare.get('inbound', {}).get('arrivalDate'),
-                            'price': fare.get('inbound', {}).get('price', {}).get('value')
-                        }
-                    }
-                    all_trips.append(trip_details)
-                except (KeyError, TypeError) as e:
-                    print(f"Warning: Could not parse fare details, skipping. Error: {e}. Fare: {fare}")
-                    continue
-            all_trips.sort(key=lambda x: x['total_price'])
-            if not all_trips and not error_message:
-                 error_message = "Found flight data, but couldn't parse prices correctly for any trip."
-        else:
-            error_message = f"No round trips found matching your criteria for {origin_iata} -> {destination_iata} in {outbound_month_str}."
-
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error: {http_err} - Status: {http_err.response.status_code}")
-        error_message = f"API Error ({http_err.response.status_code}) for {origin_iata} -> {destination_iata}. Check IATA codes or try later."
-    except requests.exceptions.RequestException as req_err:
-        print(f"Request error: {req_err}")
-        error_message = "Network Error: Could not connect to Ryanair API."
-    except (json.JSONDecodeError, KeyError, TypeError) as e:
-        print(f"Parsing error: {e}")
-        error_message = "API Error: Received unexpected data format from Ryanair."
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        error_message = "An unexpected error occurred."
+    # --- Call API for every month in parallel and merge the sorted results ---
+    print(f"Fetching {len(months)} month(s) for {origin_iata} -> {destination_iata}: {month_label}")
+    responses = fare_search.fetch_round_trips([(origin_iata, destination_iata)], months,
+                                              duration_from, duration_to, currency)
+    trips_per_month = []
+    errors = []
+    for (_, _, year_month), (data, error) in responses.items():
+        if error is not None:
+            message = describe_fetch_error(error, origin_iata, destination_iata)
+            if message not in errors:
+                errors.append(message)
+            continue
+        if data.get('fares'):
+            month_trips = parse_round_trip_fares(data, limit=SEARCH_RESULTS_LIMIT) # Only these can reach the page
+            if month_trips:
+                trips_per_month.append(month_trips)
+            else:
+                errors.append(f"Found flight data for {year_month[0]}-{year_month[1]:02d}, but couldn't parse prices correctly for any trip.")
+
+    top_10_trips = list(itertools.islice(fare_search.merge_by_price(trips_per_month), SEARCH_RESULTS_LIMIT))
+    if not top_10_trips and not errors:
+        errors.append(f"No round trips found matching your criteria for {origin_iata} -> {destination_iata} in {month_label}.")
 
-    if error_message:
+    for error_message in errors:
         flash(error_message)
 
-    top_10_trips = all_trips[:10]
+    # All prices on the page converted in one vectorized step
+    top_10_trips = fx.convert_records(top_10_trips, ('total_price', 'outbound.price', 'inbound.price'), display_currency)
+
     # Pass IATA codes back instead of city names and add 'now' for base template
     return render_template('results.html', top_trips=top_10_trips, query=request.form,
-                           origin_iata=origin_iata, destination_iata=destination_iata, now=datetime.utcnow())
+                           origin_iata=origin_iata, destination_iata=destination_iata,
+                           month_label=month_label, now=datetime.utcnow())
+
+# === Server-Sent Events (progressive results) ===
+
+STREAM_TOP_K = int(os.environ.get('STREAM_TOP_K', 10)) # Size of the running top list sent with each event
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+def sse_response(events):
+    # No proxy buffering, or the browser only sees events when the stream ends
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def stream_results(responses, total, build_payload, stream_budget, top_k=STREAM_TOP_K):
+    """
+    Turns an iterator of (key, data, error) into SSE 'result' events, each
+    carrying the running top list (by total_price of payload['trip']),
+    followed by a final 'done' event. When the client disconnects the server
+    closes this generator, which closes responses and cancels upstream calls
+    that haven't started. The stream also ends early once stream_budget (the
+    budget the responses are fetched under) is exhausted.
+    """
+    completed = 0
+    top = []
+    started = time.perf_counter()
+    try:
+        yield sse_event('start', {'total': total})
+        for key, data, error in responses:
+            completed += 1
+            payload = build_payload(key, data, error)
+            if payload.get('trip'):
+                bisect.insort(top, payload['trip'], key=lambda trip: trip['total_price'])
+                del top[top_k:]
+            payload.update(completed=completed, total=total, top=top)
+            yield sse_event('result', payload)
+            if stream_budget.exhausted:
+                break
+        yield sse_event('done', {'completed': completed, 'top': top, 'message': budget_stop_message(stream_budget),
+                                 'elapsed_ms': round((time.perf_counter() - started) * 1000)})
+    finally:
+        responses.close()
+        print(f"  Stream finished after {completed} result(s) in {time.perf_counter() - started:.2f}s.")
 
 # === Multi-City Cheapest Round Trip Search Routes ===
 
-@app.route('/multi_round_trip', methods=['GET'])
+@bp.route('/multi_round_trip', methods=['GET'])
 def multi_round_trip_form():
     today = date.today()
     default_month = (today.replace(day=1) + timedelta(days=32)).strftime('%Y-%m')
     return render_template('multi_round_trip_search.html', default_month=default_month, duration_from=2, duration_to=7, now=datetime.utcnow())
 
-@app.route('/multi_round_trip', methods=['POST'])
+def describe_pair_error(error, origin_iata, destination_iata):
+    """User-facing message for a failed pair, or None for HTTP errors (usually a route that isn't flown)."""
+    if isinstance(error, budget.BudgetExceeded):
+        return None # Reported once via budget_stop_message()
+    if isinstance(error, budget.ResponseTooLarge):
+        return f"API Error for {origin_iata}<->{destination_iata}: response too large to process."
+    if isinstance(error, requests.exceptions.HTTPError):
+        print(f"    HTTP error for {origin_iata}<->{destination_iata}: {error} - Status: {error.response.status_code}")
+        return None
+    if isinstance(error, requests.exceptions.RequestException):
+        return f"Network Error connecting to API for {origin_iata}<->{destination_iata}: {error}"
+    if isinstance(error, (json.JSONDecodeError, KeyError, TypeError)):
+        return f"API Data Error for {origin_iata}<->{destination_iata}: {error}"
+    return f"Unexpected error searching {origin_iata}<->{destination_iata}: {error}"
+
+def find_cheapest_round_trip(origin_iatas, destination_iatas, months, duration_from, duration_to, currency):
+    """
+    Searches every origin/destination pair for every month in parallel.
+    Returns (overall_cheapest_trip, errors); total_price stays at sys.float_info.max if nothing was found.
+    """
+    overall_cheapest_trip = {
+        "total_price": sys.float_info.max,
+        "origin_iata": None,
+        "destination_iata": None,
+        "currency": currency,
+        "outbound_dep_time": None,
+        "outbound_arr_time": None,
+        "inbound_dep_time": None,
+        "inbound_arr_time": None
+        # Add other details if needed, like flight numbers
+    }
+    errors = []
+
+    pairs = [(o, d) for o in origin_iatas for d in destination_iatas if o != d and airports.serves(o, d)]
+    print(f"Starting Multi-City Round Trip Search for {len(pairs)} pairs in {fare_search.format_month_range(months)}...")
+    # Each response is reduced to its cheapest trip as it arrives, so only one is held at a time
+    responses = fare_search.iter_round_trips(pairs, months, duration_from, duration_to, currency)
+    try:
+        for (origin_iata, destination_iata, _), data, error in responses:
+            if error is not None:
+                error_message = describe_pair_error(error, origin_iata, destination_iata)
+                if error_message:
+                    errors.append(error_message)
+            else:
+                # Parse round trip response
+                trip_details = cheapest_trip_in_response(data)
+                if trip_details and trip_details['total_price'] < overall_cheapest_trip['total_price']:
+                    overall_cheapest_trip.update(trip_details)
+            if budget.exhausted():
+                break # Stop early; closing the iterator cancels the queries not yet started
+    finally:
+        responses.close()
+    if budget_stop_message():
+        errors.append(budget_stop_message())
+
+    print(f"Multi-City Round Trip Search complete. Found cheapest price: {overall_cheapest_trip['total_price']}")
+    return overall_cheapest_trip, errors
+
+@bp.route('/multi_round_trip', methods=['POST'])
+@page_cache.cached_page # Served pre-rendered while its fares are unchanged
+@budget.with_request_budget
 def process_multi_round_trip():
     # Get raw text area content
     origin_iatas_raw = request.form.get('origin_iatas', '')
     destination_iatas_raw = request.form.get('destination_iatas', '')
     search_month_str = request.form.get('outbound_month')
+    outbound_month_to_str = request.form.get('outbound_month_to', '').strip() # Optional end of a month range
     duration_from = request.form.get('duration_from', '2')
     duration_to = request.form.get('duration_to', '7')
-    currency = "EUR"
+    search_mode = request.form.get('mode', 'cheapest') # 'cheapest', 'meetup_sum' or 'meetup_max'
+    currency = fx.CANONICAL_CURRENCY # Fares are fetched once in EUR and converted for display
+    display_currency = fx.requested_currency(request.form.get('currency'))
 
     # Parse IATA lists (split by newline, strip whitespace, uppercase, remove empty)
     origin_iatas = [code.strip().upper() for code in origin_iatas_raw.splitlines() if code.strip()]
@@ -255,20 +548,16 @@ def process_multi_round_trip():
                                destination_iatas=destination_iatas_raw,
                                duration_from=duration_from or 2,
                                duration_to=duration_to or 7,
+                               mode=search_mode,
                                now=datetime.utcnow())
 
-    # Validate each IATA code format
-    iata_pattern = re.compile(r"^[A-Za-z]{3}$")
-    invalid_origins = [code for code in origin_iatas if not iata_pattern.match(code)]
-    invalid_destinations = [code for code in destination_iatas if not iata_pattern.match(code)]
-
+    # Validate each IATA code (format; unknown airports only get a warning)
     error_found = False
-    if invalid_origins:
-        flash(f"Invalid Origin IATA code(s) found: {', '.join(invalid_origins)}. Please use 3 letters only.")
-        error_found = True
-    if invalid_destinations:
-        flash(f"Invalid Destination IATA code(s) found: {', '.join(invalid_destinations)}. Please use 3 letters only.")
+    for error in airports.code_errors(origin_iatas, 'Origin IATA') + airports.code_errors(destination_iatas, 'Destination IATA'):
+        flash(error)
         error_found = True
+    flash_airport_warnings(origin_iatas, 'Origin IATA')
+    flash_airport_warnings(destination_iatas, 'Destination IATA')
 
     # Validate duration
     try:
@@ -287,122 +576,279 @@ def process_multi_round_trip():
                                 destination_iatas=destination_iatas_raw,
                                 duration_from=duration_from or 2,
                                 duration_to=duration_to or 7,
+                                mode=search_mode,
                                 now=datetime.utcnow())
 
-    # --- Date Calculation (similar to single round trip) ---
+    # --- Date Calculation (one query per outbound month in the range) ---
     try:
-        year, month = map(int, search_month_str.split('-'))
-        out_date_from = date(year, month, 1)
-        last_day = get_last_day_of_month(year, month)
-        out_date_to = date(year, month, last_day)
-        in_date_from = out_date_from # Inbound can start same day as outbound starts
-        # Calculate end of inbound search window (end of next month)
-        next_month_date = (out_date_to.replace(day=1) + timedelta(days=32))
-        in_year, in_month = next_month_date.year, next_month_date.month
-        in_last_day = get_last_day_of_month(in_year, in_month)
-        in_date_to = date(in_year, in_month, in_last_day)
-    except ValueError:
-        flash("Invalid month format. Please use YYYY-MM.")
+        months = fare_search.month_range(search_month_str, outbound_month_to_str or None)
+    except ValueError as e:
+        flash(f"Invalid month range: {e} Please use YYYY-MM.")
         return render_template('multi_round_trip_search.html',
                                 default_month=date.today().strftime('%Y-%m'),
                                 origin_iatas=origin_iatas_raw,
                                 destination_iatas=destination_iatas_raw,
                                 duration_from=duration_from or 2,
                                 duration_to=duration_to or 7,
+                                mode=search_mode,
                                 now=datetime.utcnow())
 
-    # --- Search Loop ---
-    overall_cheapest_trip = {
-        "total_price": sys.float_info.max,
-        "origin_iata": None,
-        "destination_iata": None,
-        "currency": currency,
-        "outbound_dep_time": None,
-        "outbound_arr_time": None,
-        "inbound_dep_time": None,
-        "inbound_arr_time": None
-        # Add other details if needed, like flight numbers
-    }
-    errors = []
-
-    total_pairs = len(origin_iatas) * len(destination_iatas)
-    print(f"Starting Multi-City Round Trip Search for {total_pairs} pairs in {search_month_str}...")
-
-    for origin_iata in origin_iatas:
-        for destination_iata in destination_iatas:
-            if origin_iata == destination_iata:
-                continue
-
-            print(f"  Checking: {origin_iata} <-> {destination_iata}")
-
-            # Construct API URL using ROUND_TRIP_API_TEMPLATE
-            api_url = ROUND_TRIP_API_TEMPLATE.format(
-                origin_iata=origin_iata,
-                destination_iata=destination_iata,
-                out_date_from=out_date_from.strftime("%Y-%m-%d"),
-                out_date_to=out_date_to.strftime("%Y-%m-%d"),
-                in_date_from=in_date_from.strftime("%Y-%m-%d"),
-                in_date_to=in_date_to.strftime("%Y-%m-%d"),
-                duration_from=duration_from,
-                duration_to=duration_to,
-                currency=currency
-            )
-
-            try:
-                response = requests.get(api_url, headers=HEADERS, timeout=30) # Increased timeout slightly
-                response.raise_for_status()
-                data = response.json()
-
-                # Parse round trip response
-                if 'fares' in data and data['fares']:
-                    for fare in data['fares']:
-                        try:
-                            current_total_price = fare.get('summary', {}).get('price', {}).get('value')
-                            if current_total_price is not None and current_total_price < overall_cheapest_trip['total_price']:
-                                overall_cheapest_trip['total_price'] = current_total_price
-                                overall_cheapest_trip['origin_iata'] = fare.get('outbound', {}).get('departureAirport', {}).get('iataCode')
-                                overall_cheapest_trip['destination_iata'] = fare.get('outbound', {}).get('arrivalAirport', {}).get('iataCode')
-                                overall_cheapest_trip['currency'] = fare.get('summary', {}).get('price', {}).get('currencyCode')
-                                overall_cheapest_trip['outbound_dep_time'] = fare.get('outbound', {}).get('departureDate')
-                                overall_cheapest_trip['outbound_arr_time'] = fare.get('outbound', {}).get('arrivalDate')
-                                overall_cheapest_trip['inbound_dep_time'] = fare.get('inbound', {}).get('departureDate')
-                                overall_cheapest_trip['inbound_arr_time'] = fare.get('inbound', {}).get('arrivalDate')
-                                # Optionally add flight numbers etc.
-                        except (KeyError, TypeError) as e:
-                             print(f"    Warning: Parsing error for fare {origin_iata}<->{destination_iata}: {e}. Fare: {fare}")
-                             continue # Skip this specific fare if parsing fails
-            except requests.exceptions.HTTPError as http_err:
-                 print(f"    HTTP error for {origin_iata}<->{destination_iata}: {http_err} - Status: {http_err.response.status_code}")
-                 # Optionally add specific error message to errors list
-                 # errors.append(f"API Error ({http_err.response.status_code}) for {origin_iata}<->{destination_iata}")
-            except requests.exceptions.RequestException as req_err:
-                errors.append(f"Network Error connecting to API for {origin_iata}<->{destination_iata}: {req_err}")
-            except (json.JSONDecodeError, KeyError, TypeError) as e:
-                errors.append(f"API Data Error for {origin_iata}<->{destination_iata}: {e}")
-            except Exception as e:
-                errors.append(f"Unexpected error searching {origin_iata}<->{destination_iata}: {e}")
+    # --- Search: inline for small grids, as a background job for large ones ---
+    search_args = (search_mode, origin_iatas, destination_iatas, months, int_duration_from, int_duration_to, currency,
+                   display_currency,
+                   {'origin_iatas_raw': origin_iatas_raw, 'destination_iatas_raw': destination_iatas_raw,
+                    'outbound_month': search_month_str, 'outbound_month_to': outbound_month_to_str,
+                    'duration_from': duration_from, 'duration_to': duration_to, 'currency': display_currency})
+    search_size = len(origin_iatas) * len(destination_iatas) * len(months) # Upstream queries, roughly
+    if search_size > MULTI_SEARCH_JOB_THRESHOLD:
+        # Identical searches (same mode, airports, months and durations) share one job
+        job_key = (search_mode, tuple(sorted(set(origin_iatas))), tuple(sorted(set(destination_iatas))),
+                   tuple(months), int_duration_from, int_duration_to, currency, display_currency)
+        job, reused = jobs.search_jobs.submit('multi_round_trip', job_key,
+                                              budget.with_job_budget(run_multi_round_trip_search), *search_args)
+        print(f"Multi-City search of {search_size} queries {'reuses' if reused else 'queued as'} job {job.id}")
+        return redirect(url_for('main.search_job', job_id=job.id))
+
+    return render_search_result(*run_multi_round_trip_search(*search_args))
+
+def run_multi_round_trip_search(search_mode, origin_iatas, destination_iatas, months, duration_from, duration_to,
+                                currency, display_currency, form_values):
+    """
+    Runs a validated multi-city search (fetching in currency, showing prices in display_currency).
+    Returns (template_name, context, messages) so the result can be rendered right away or
+    later from a background job.
+    """
+    messages = []
+
+    # --- Meet-up mode: cheapest common destination for all origins ---
+    if search_mode in ('meetup_sum', 'meetup_max'):
+        objective = search_mode.split('_', 1)[1]
+        meetups, meetup_stats, fetch_errors = meetup_search.find_meetups(
+            origin_iatas, destination_iatas, months, duration_from, duration_to, objective, currency)
+        for (orig, dest), error in fetch_errors.items():
+            if isinstance(error, budget.BudgetExceeded):
+                continue # Reported once below
+            if not (isinstance(error, requests.exceptions.HTTPError) and error.response.status_code < 500):
+                messages.append(f"Error fetching fares for {orig}->{dest}: {error}")
+        if budget_stop_message():
+            messages.append(budget_stop_message())
+        if not meetups:
+            messages.append("No destination with common travel dates found for all origins.")
+        meetups = fx.convert_records(meetups, ('objective_price', 'total_price', 'max_price'), display_currency, currency)
+        for meetup in meetups:
+            meetup['travellers'] = fx.convert_records(meetup['travellers'], ('out_price', 'in_price', 'price'),
+                                                      display_currency, currency)
+        return 'meetup_results.html', {
+            'meetups': meetups,
+            'stats': meetup_stats,
+            'objective': objective,
+            'origin_iatas': origin_iatas,
+            'month_label': fare_search.format_month_range(months),
+            'currency': display_currency,
+        }, messages
+
+    # --- Search (all pairs and months in parallel) ---
+    overall_cheapest_trip, errors = find_cheapest_round_trip(origin_iatas, destination_iatas, months,
+                                                             duration_from, duration_to, currency)
 
     # --- Display Results ---
-    print(f"Multi-City Round Trip Search complete. Found cheapest price: {overall_cheapest_trip['total_price']}")
-    for error in errors:
-        flash(error) # Show accumulated errors
+    messages.extend(errors) # Show accumulated errors
 
     if overall_cheapest_trip["total_price"] == sys.float_info.max:
-        flash("No round trips found for any of the specified IATA combinations, month, and duration.")
+        messages.append("No round trips found for any of the specified IATA combinations, month, and duration.")
         cheapest_flight_result = None
     else:
         # Format dates for better readability if needed
         # Example: overall_cheapest_trip['outbound_dep_time'] = format_datetime(overall_cheapest_trip['outbound_dep_time'])
-        cheapest_flight_result = overall_cheapest_trip
-
-    # Pass raw form data back for repopulation if needed and add 'now'
-    return render_template('multi_round_trip_results.html',
-                           cheapest_flight=cheapest_flight_result,
-                           origin_iatas_raw=origin_iatas_raw,
-                           destination_iatas_raw=destination_iatas_raw,
-                           outbound_month=search_month_str,
-                           duration_from=duration_from,
-                           duration_to=duration_to,
+        cheapest_flight_result = fx.convert_records([overall_cheapest_trip], ('total_price',), display_currency)[0]
+
+    # Pass raw form data back for repopulation if needed
+    return 'multi_round_trip_results.html', dict(form_values, cheapest_flight=cheapest_flight_result), messages
+
+def render_search_result(template_name, context, messages):
+    for message in messages:
+        flash(message)
+    return render_template(template_name, now=datetime.utcnow(), **context)
+
+# === Background Search Jobs ===
+
+MULTI_SEARCH_JOB_THRESHOLD = int(os.environ.get('MULTI_SEARCH_JOB_THRESHOLD', 40)) # Larger grids run as background jobs
+
+@bp.route('/jobs/<job_id>')
+def search_job(job_id):
+    job = jobs.search_jobs.get(job_id)
+    if job is None:
+        flash("That search has expired or doesn't exist. Please search again.", "warning")
+        return redirect(url_for('main.multi_round_trip_form'))
+    if job.status == jobs.SUCCEEDED:
+        return render_search_result(*job.result)
+    if job.status == jobs.FAILED:
+        flash(f"The search failed: {job.error}", "error")
+    return render_template('search_job.html', job=job, now=datetime.utcnow())
+
+@bp.route('/api/jobs/<job_id>')
+def api_search_job(job_id):
+    job = jobs.search_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(dict(job.to_dict(), result_url=url_for('main.search_job', job_id=job.id)))
+
+@bp.route('/multi_round_trip/stream')
+def multi_round_trip_stream():
+    """SSE version of the multi-city search: one 'result' event per pair and month with the running top trips."""
+    origin_iatas = [code.upper() for code in re.split(r'[\s,]+', request.args.get('origin_iatas', '')) if code]
+    destination_iatas = [code.upper() for code in re.split(r'[\s,]+', request.args.get('destination_iatas', '')) if code]
+    currency = fx.CANONICAL_CURRENCY # Fares are fetched once in EUR and converted for display
+    display_currency = fx.requested_currency(request.args.get('currency'))
+
+    # Codes missing from the airport list are streamed anyway, as on the form
+    errors = airports.code_errors(origin_iatas, 'Origin IATA') + airports.code_errors(destination_iatas, 'Destination IATA')
+    if not (origin_iatas and destination_iatas):
+        errors.append("Please provide Origin(s) and Destination(s).")
+    try:
+        months = fare_search.month_range(request.args.get('outbound_month', ''),
+                                         request.args.get('outbound_month_to', '').strip() or None)
+        int_duration_from = int(request.args.get('duration_from', '2'))
+        int_duration_to = int(request.args.get('duration_to', '7'))
+        if int_duration_from < 1 or int_duration_from > int_duration_to:
+            raise ValueError("Invalid duration range.")
+    except (ValueError, TypeError) as e:
+        errors.append(f"Invalid month range or duration: {e}")
+    if errors:
+        return jsonify({"error": "Invalid parameters", "details": errors}), 400
+
+    pairs = [(o, d) for o in origin_iatas for d in destination_iatas if o != d and airports.serves(o, d)]
+    # Streams run inside the request, so grids that the form would hand to a background job are refused
+    search_size = len(pairs) * len(months)
+    if search_size > MULTI_SEARCH_JOB_THRESHOLD:
+        return jsonify({"error": "Search too large to stream",
+                        "details": [f"This search covers {search_size} route-months, more than the "
+                                    f"{MULTI_SEARCH_JOB_THRESHOLD} that can be streamed. Submit it from the "
+                                    f"multi-city search form to run it as a background job."]}), 400
+    print(f"Starting Multi-City STREAM search for {len(pairs)} pairs in {fare_search.format_month_range(months)}...")
+    # The generator runs after this view returns, outside any budget.limit() block, so it gets its own
+    stream_budget = budget.request_budget()
+    responses = fare_search.iter_round_trips(pairs, months, int_duration_from, int_duration_to, currency,
+                                             fetch_budget=stream_budget)
+
+    def result_event(key, data, error):
+        origin_iata, destination_iata, year_month = key
+        return {
+            'origin_iata': origin_iata,
+            'destination_iata': destination_iata,
+            'month': f"{year_month[0]}-{year_month[1]:02d}",
+            'trip': display_trip(cheapest_trip_in_response(data), display_currency) if error is None else None,
+            'error': describe_pair_error(error, origin_iata, destination_iata) if error is not None else None,
+        }
+
+    return sse_response(stream_results(responses, len(pairs) * len(months), result_event, stream_budget))
+
+# === Open-Jaw / Multi-Stop Itinerary Search ===
+
+@bp.route('/itinerary')
+@budget.with_request_budget
+def itinerary_search():
+    home_iata = request.args.get('home_iata', '').strip().upper()
+    stop_iatas_raw = request.args.get('stop_iatas', '')
+    month_str = request.args.get('month', '')
+    months_str = request.args.get('months', '1')
+    stay_from_str = request.args.get('stay_from', '2')
+    stay_to_str = request.args.get('stay_to', '5')
+    max_trip_days_str = request.args.get('max_trip_days', '10')
+    itinerary_types = request.args.getlist('types') or list(itinerary_solver.ITINERARY_TYPES)
+    currency = fx.CANONICAL_CURRENCY # Fares are fetched once in EUR and converted for display
+    display_currency = fx.requested_currency(request.args.get('currency'))
+
+    form_data = {
+        'home_iata': home_iata,
+        'stop_iatas': stop_iatas_raw,
+        'month': month_str or (date.today().replace(day=1) + timedelta(days=32)).strftime('%Y-%m'),
+        'months': months_str,
+        'stay_from': stay_from_str,
+        'stay_to': stay_to_str,
+        'max_trip_days': max_trip_days_str,
+        'types': itinerary_types,
+        'currency': display_currency
+    }
+    def render_form():
+        return render_template('itinerary_search.html', form_data=form_data,
+                               itinerary_types=itinerary_solver.ITINERARY_TYPES,
+                               max_airports=itinerary_solver.ITINERARY_MAX_AIRPORTS,
+                               max_months=fare_search.MAX_SEARCH_MONTHS, now=datetime.utcnow())
+
+    # If no parameters provided, show the form
+    if not (home_iata and stop_iatas_raw.strip() and month_str):
+        return render_form()
+
+    # --- Input Validation --- #
+    # Stops may be separated by newlines, commas or spaces
+    stop_iatas = list(dict.fromkeys(code.upper() for code in re.split(r'[\s,]+', stop_iatas_raw) if code))
+    errors = airports.code_errors([home_iata] + stop_iatas)
+    flash_airport_warnings([home_iata] + stop_iatas)
+    stop_iatas = [code for code in stop_iatas if code != home_iata]
+    if len(stop_iatas) < 2:
+        errors.append("Please provide at least two stop airports (different from home).")
+    if len(stop_iatas) > itinerary_solver.ITINERARY_MAX_AIRPORTS:
+        errors.append(f"At most {itinerary_solver.ITINERARY_MAX_AIRPORTS} stop airports can be searched at once.")
+    if not set(itinerary_types) <= set(itinerary_solver.ITINERARY_TYPES):
+        errors.append("Unknown itinerary type.")
+    try:
+        year, month = fare_search.parse_month(month_str)
+        num_months = int(months_str)
+        if not (1 <= num_months <= fare_search.MAX_SEARCH_MONTHS):
+            raise ValueError("Invalid horizon")
+        months = fare_search.months_from(year, month, num_months)
+    except (ValueError, TypeError):
+        errors.append(f"Invalid month or horizon. Please use YYYY-MM and 1-{fare_search.MAX_SEARCH_MONTHS} months.")
+    try:
+        stay_from = int(stay_from_str)
+        stay_to = int(stay_to_str)
+        max_trip_days = int(max_trip_days_str)
+        if stay_from < 1 or stay_from > stay_to or max_trip_days < stay_from:
+            raise ValueError("Invalid stay range")
+    except (ValueError, TypeError):
+        errors.append("Stays must be positive numbers with Min <= Max, and the trip at least as long as the minimum stay.")
+
+    if errors:
+        for error in errors:
+            flash(error, "error")
+        return render_form()
+
+    # --- Fetch every leg in one parallel batch, then search --- #
+    print(f"Itinerary Search: {home_iata} via {', '.join(stop_iatas)} in {fare_search.format_month_range(months)} ({', '.join(itinerary_types)})")
+    started = time.perf_counter()
+    legs, fetch_errors = itinerary_solver.fetch_legs(home_iata, stop_iatas, months, itinerary_types, currency)
+    fetch_seconds = time.perf_counter() - started
+    for (orig, dest), error in fetch_errors.items():
+        # Most stop -> stop pairs have no direct route; only surface failures other than 4xx
+        if isinstance(error, requests.exceptions.HTTPError) and error.response.status_code < 500:
+            continue
+        if isinstance(error, budget.BudgetExceeded):
+            continue # Reported once below
+        flash(f"Error fetching fares for {orig}->{dest}: {error}", "error")
+    if budget_stop_message():
+        flash(budget_stop_message(), "warning")
+
+    itineraries = itinerary_solver.solve(legs, home_iata, stop_iatas, itinerary_types,
+                                         stay_from=stay_from, stay_to=stay_to, max_trip_days=max_trip_days)
+    print(f"Itinerary Search complete: {len(legs)} routes fetched in {fetch_seconds:.2f}s, {len(itineraries)} itineraries.")
+
+    # Convert totals and leg prices in one vectorized step
+    amounts = [itinerary['total_price'] for itinerary in itineraries]
+    amounts += [leg[3] for itinerary in itineraries for leg in itinerary['legs']]
+    converted = iter(fx.convert(amounts, display_currency, currency).tolist())
+    itineraries = [dict(itinerary, total_price=next(converted)) for itinerary in itineraries]
+    for itinerary in itineraries:
+        itinerary['legs'] = [(origin, destination, day, next(converted)) for origin, destination, day, _ in itinerary['legs']]
+
+    return render_template('itinerary_results.html',
+                           form_data=form_data,
+                           home_iata=home_iata,
+                           stop_iatas=stop_iatas,
+                           month_label=fare_search.format_month_range(months),
+                           itineraries=itineraries,
+                           routes_fetched=sum(1 for prices in legs.values() if prices),
+                           currency=display_currency,
                            now=datetime.utcnow())
 
 # === Sofia Top 10 Deals ===
@@ -416,7 +862,35 @@ SOFIA_DESTINATIONS = [
     "BTS", "CRL", "BUD", "CPH", "DUB", "EIN", "MLA", "PFO", "BVA", "POZ", "VIE", "WRO", "ZAD"
 ]
 
-@app.route('/sofia_deals')
+SOFIA_ORIGIN = "SOF"
+
+def sofia_deals_params(args):
+    """
+    Validates the Sofia deals form. Returns ((year, month), duration_from, duration_to);
+    raises ValueError with a user-facing message.
+    """
+    year, month = fare_search.parse_month(args.get('outbound_month', ''))
+    int_dur_from = int(args.get('duration_from', ''))
+    int_dur_to = int(args.get('duration_to', ''))
+    # Basic duration validation
+    if int_dur_from < 1 or int_dur_to < 1 or int_dur_from > int_dur_to:
+        raise ValueError("Invalid duration range")
+    return (year, month), int_dur_from, int_dur_to
+
+def describe_deal_error(error, destination_iata):
+    if isinstance(error, budget.BudgetExceeded):
+        return budget_stop_message() or str(error)
+    if isinstance(error, budget.ResponseTooLarge):
+        return f"Response too large for {destination_iata}"
+    if isinstance(error, requests.exceptions.HTTPError):
+        return f"API Error ({error.response.status_code}) for {destination_iata}"
+    if isinstance(error, requests.exceptions.RequestException):
+        return f"Network Error for {destination_iata}"
+    return f"Unexpected error for {destination_iata}"
+
+@bp.route('/sofia_deals')
+@page_cache.cached_page # Served pre-rendered while its fares are unchanged
+@budget.with_request_budget
 def sofia_deals():
     # Define explicit defaults for the form
     today = date.today()
@@ -428,6 +902,7 @@ def sofia_deals():
     search_month_str = request.args.get('outbound_month', default_month)
     duration_from = request.args.get('duration_from', default_duration_from)
     duration_to = request.args.get('duration_to', default_duration_to)
+    display_currency = fx.requested_currency(request.args.get('currency')) # Fetched in EUR, converted for display
 
     cheapest_trips_list = []
     errors = []
@@ -435,24 +910,10 @@ def sofia_deals():
     # Only perform search if the form was actually submitted (check for presence of args)
     if 'outbound_month' in request.args and 'duration_from' in request.args and 'duration_to' in request.args:
         print(f"Starting Sofia Deals MANUAL search for {search_month_str} ({duration_from}-{duration_to} days)...")
-        # --- Validate and Calculate Dates for Manual Search ---
+        # --- Validate Parameters for Manual Search ---
         try:
-            year, month = map(int, search_month_str.split('-'))
-            out_date_from = date(year, month, 1)
-            last_day = get_last_day_of_month(year, month)
-            out_date_to = date(year, month, last_day)
-            in_date_from = out_date_from
-            next_month_date = (out_date_to.replace(day=1) + timedelta(days=32))
-            in_year_in, in_month_in = next_month_date.year, next_month_date.month
-            in_last_day = get_last_day_of_month(in_year_in, in_month_in)
-            in_date_to = date(in_year_in, in_month_in, in_last_day)
-            # Basic duration validation
-            int_dur_from = int(duration_from)
-            int_dur_to = int(duration_to)
-            if int_dur_from < 1 or int_dur_to < 1 or int_dur_from > int_dur_to:
-                raise ValueError("Invalid duration range")
-
-        except Exception as e:
+            year_month, int_dur_from, int_dur_to = sofia_deals_params(request.args)
+        except (ValueError, TypeError) as e:
             flash(f"Invalid date/duration parameters: {e}. Please check values.", "error")
             # Pass back parameters used so form is repopulated and 'now'
             return render_template('sofia_deals.html',
@@ -463,63 +924,23 @@ def sofia_deals():
                                    errors=[f"Invalid date/duration parameters: {e}"],
                                    now=datetime.utcnow())
 
-        # --- Manual Search Logic --- (Moved inside the conditional block)
-        cheapest_per_destination = {}
-        origin_iata = "SOF"
-        currency = "EUR"
-
-        for destination_iata in SOFIA_DESTINATIONS:
-            print(f"  Checking SOF -> {destination_iata}")
-            api_url = ROUND_TRIP_API_TEMPLATE.format(
-                origin_iata=origin_iata,
-                destination_iata=destination_iata,
-                out_date_from=out_date_from.strftime("%Y-%m-%d"),
-                out_date_to=out_date_to.strftime("%Y-%m-%d"),
-                in_date_from=in_date_from.strftime("%Y-%m-%d"),
-                in_date_to=in_date_to.strftime("%Y-%m-%d"),
-                duration_from=duration_from,
-                duration_to=duration_to,
-                currency=currency
-            )
-            try:
-                response = requests.get(api_url, headers=HEADERS, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-
-                if 'fares' in data and data['fares']:
-                    for fare in data['fares']:
-                        try:
-                            total_price = fare.get('summary', {}).get('price', {}).get('value')
-                            if total_price is not None:
-                                trip_details = {
-                                    'origin_iata': fare.get('outbound', {}).get('departureAirport', {}).get('iataCode'),
-                                    'destination_iata': fare.get('outbound', {}).get('arrivalAirport', {}).get('iataCode'),
-                                    'total_price': total_price,
-                                    'currency': fare.get('summary', {}).get('price', {}).get('currencyCode'),
-                                    'outbound_dep_time': fare.get('outbound', {}).get('departureDate'),
-                                    'outbound_arr_time': fare.get('outbound', {}).get('arrivalDate'),
-                                    'inbound_dep_time': fare.get('inbound', {}).get('departureDate'),
-                                    'inbound_arr_time': fare.get('inbound', {}).get('arrivalDate')
-                                }
-                                if destination_iata not in cheapest_per_destination or trip_details['total_price'] < cheapest_per_destination[destination_iata]['total_price']:
-                                    cheapest_per_destination[destination_iata] = trip_details
-                                break # Assume first is cheapest
-                        except (KeyError, TypeError) as e:
-                            print(f"    Warning: Parsing error for manual fare SOF->{destination_iata}: {e}. Fare: {fare}")
-                            continue
-            except requests.exceptions.HTTPError as http_err:
-                print(f"    HTTP error for SOF->{destination_iata} (Manual): {http_err} - Status: {http_err.response.status_code}")
-                errors.append(f"API Error ({http_err.response.status_code}) for {destination_iata}")
-            except requests.exceptions.RequestException as req_err:
-                print(f"    Request error for SOF->{destination_iata} (Manual): {req_err}")
-                errors.append(f"Network Error for {destination_iata}")
-            except Exception as e:
-                print(f"    Unexpected error for SOF->{destination_iata} (Manual): {e}")
-                errors.append(f"Unexpected error for {destination_iata}")
+        # --- Manual Search Logic (all destinations in parallel) ---
+        pairs = [(SOFIA_ORIGIN, destination_iata) for destination_iata in SOFIA_DESTINATIONS]
+        responses = fare_search.fetch_round_trips(pairs, [year_month], int_dur_from, int_dur_to, fx.CANONICAL_CURRENCY)
+        for (_, destination_iata, _), (data, error) in responses.items():
+            if error is not None:
+                print(f"    Error for SOF->{destination_iata} (Manual): {error}")
+                message = describe_deal_error(error, destination_iata)
+                if message not in errors:
+                    errors.append(message)
+                continue
+            trip_details = cheapest_trip_in_response(data)
+            if trip_details:
+                cheapest_trips_list.append(trip_details)
 
-        # Convert results to list and sort
-        cheapest_trips_list = list(cheapest_per_destination.values())
+        # Sort results by price and convert them for display in one vectorized step
         cheapest_trips_list.sort(key=lambda x: x['total_price'])
+        cheapest_trips_list = fx.convert_records(cheapest_trips_list, ('total_price',), display_currency)
         print(f"Sofia Deals page loaded. Found {len(cheapest_trips_list)} destinations via manual search.")
 
         # Flash errors specific to this search
@@ -540,8 +961,47 @@ def sofia_deals():
                            duration_to=duration_to,
                            now=datetime.utcnow())
 
+PAGE_CACHE_PRERENDER_SECONDS = int(os.environ.get('PAGE_CACHE_PRERENDER_SECONDS', 60)) # 0 disables pre-rendering
+
+@metrics.track_job_duration
+def prerender_hot_pages():
+    """Scheduled task keeping the hot page (Sofia deals for next month, default durations) rendered and cached."""
+    today = date.today()
+    next_month = (today.replace(day=1) + timedelta(days=32)).strftime('%Y-%m')
+    path = '/sofia_deals?' + urlencode({'outbound_month': next_month, 'duration_from': 2, 'duration_to': 7})
+    try:
+        page_cache.prerender(current_app._get_current_object(), sofia_deals, path)
+    except Exception as e:
+        print(f"[{datetime.now()}] ERROR pre-rendering {path}: {e}")
+
+@bp.route('/sofia_deals/stream')
+def sofia_deals_stream():
+    """SSE version of the Sofia deals search: one 'result' event per destination as it arrives."""
+    try:
+        year_month, int_dur_from, int_dur_to = sofia_deals_params(request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid date/duration parameters: {e}"}), 400
+
+    pairs = [(SOFIA_ORIGIN, destination_iata) for destination_iata in SOFIA_DESTINATIONS]
+    print(f"Starting Sofia Deals STREAM search for {year_month[0]}-{year_month[1]:02d} ({int_dur_from}-{int_dur_to} days)...")
+    display_currency = fx.requested_currency(request.args.get('currency'))
+    stream_budget = budget.request_budget() # See multi_round_trip_stream()
+    responses = fare_search.iter_round_trips(pairs, [year_month], int_dur_from, int_dur_to, fx.CANONICAL_CURRENCY,
+                                             fetch_budget=stream_budget)
+
+    def result_event(key, data, error):
+        _, destination_iata, _ = key
+        return {
+            'destination_iata': destination_iata,
+            'trip': display_trip(cheapest_trip_in_response(data), display_currency) if error is None else None,
+            'error': describe_deal_error(error, destination_iata) if error is not None else None,
+        }
+
+    # One trip per destination, so the running list is the full ranking like the non-streamed page
+    return sse_response(stream_results(responses, len(pairs), result_event, stream_budget, top_k=len(pairs)))
+
 # === Notification Configuration Route ===
-@app.route('/configure_notifications', methods=['GET', 'POST'])
+@bp.route('/configure_notifications', methods=['GET', 'POST'])
 def configure_notifications():
     if request.method == 'POST':
         # --- Add New Rule Logic ---
@@ -551,15 +1011,23 @@ def configure_notifications():
         duration_from_str = request.form.get('duration_from')
         duration_to_str = request.form.get('duration_to')
         threshold_str = request.form.get('threshold')
+        rule_type = request.form.get('rule_type', 'threshold') # 'threshold' or 'price_drop'
+        drop_percent_str = request.form.get('drop_percent')
+        baseline = request.form.get('baseline', 'mean')
+        rule_currency = fx.requested_currency(request.form.get('currency')) # Threshold and email prices
+        recipient = request.form.get('recipient', '').strip() # Alert email address; MAIL_RECIPIENT if empty
+        owner = request.form.get('owner', '').strip().lower() or recipient.lower() # Groups a user's rules in the list
+        current_rules = load_notification_rules()
+        # The owner's access token: unlocked earlier in this browser, or typed into the form
+        token = request.form.get('token', '').strip() or session_tokens().get(owner, '')
 
         errors = []
-        iata_pattern = re.compile(r"^[A-Za-z]{3}$")
 
         # --- Validation --- #
-        if not origin_iata or not iata_pattern.match(origin_iata):
-            errors.append("Valid 3-letter Origin IATA is required.")
-        if not destination_iata or not iata_pattern.match(destination_iata):
-            errors.append("Valid 3-letter Destination IATA is required.")
+        errors += airports.code_errors([origin_iata], 'Origin IATA')
+        errors += airports.code_errors([destination_iata], 'Destination IATA')
+        flash_airport_warnings([origin_iata], 'Origin IATA')
+        flash_airport_warnings([destination_iata], 'Destination IATA')
         if origin_iata and destination_iata and origin_iata == destination_iata:
              errors.append("Origin and Destination cannot be the same.")
 
@@ -578,12 +1046,31 @@ def configure_notifications():
         except (ValueError, TypeError):
              errors.append("Valid Min/Max Durations (positive numbers, Min <= Max) are required.")
 
-        try:
-            threshold = float(threshold_str)
-            if threshold <= 0:
-                raise ValueError("Threshold must be positive")
-        except (ValueError, TypeError):
-            errors.append("Valid positive Price Threshold is required.")
+        if rule_type == 'price_drop':
+            try:
+                drop_percent = float(drop_percent_str)
+                if not 0 < drop_percent < 100:
+                    raise ValueError("Drop must be between 0 and 100%")
+            except (ValueError, TypeError):
+                errors.append("Valid Price Drop percentage (between 0 and 100) is required.")
+            if baseline not in price_stats.BASELINES:
+                errors.append("Baseline must be the mean, minimum or EWMA price.")
+        elif rule_type == 'threshold':
+            try:
+                threshold = float(threshold_str)
+                if threshold <= 0:
+                    raise ValueError("Threshold must be positive")
+            except (ValueError, TypeError):
+                errors.append("Valid positive Price Threshold is required.")
+        else:
+            errors.append("Unknown rule type.")
+
+        if recipient and not EMAIL_PATTERN.match(recipient):
+            errors.append("Alert email address is not valid.")
+        if not owner:
+            errors.append("An owner or alert email address is required, so you can find and manage the rule.")
+        elif owner_token_hashes(current_rules, owner) and not owner_authorized(current_rules, owner, token):
+            errors.append(f"{owner} already has rules. Enter its access token to add more.")
         # --- End Validation --- #
 
         if not errors:
@@ -595,49 +1082,166 @@ def configure_notifications():
                 'search_month': search_month_str,
                 'duration_from': duration_from,
                 'duration_to': duration_to,
-                'threshold': threshold
+                'type': rule_type,
+                'currency': rule_currency,
+                'owner': owner,
+                'recipient': recipient or None
             }
+            if not owner_token_hashes(current_rules, owner):
+                # First rule of this owner: issue the token that lists and deletes their rules
+                token = secrets.token_urlsafe(16)
+                flash(f"Your access token is {token}. Keep it: it is needed to see, add or delete the rules of "
+                      f"{owner} from another browser, and it won't be shown again.", "info")
+            new_rule['owner_token_hash'] = owner_token_hash(token)
+            remember_owner(owner, token) # This browser stays unlocked for the owner
+            if rule_type == 'price_drop':
+                new_rule['drop_percent'] = drop_percent
+                new_rule['baseline'] = baseline
+            else:
+                new_rule['threshold'] = threshold
 
-            # Load current rules, add new one, save
-            current_rules = load_notification_rules()
+            # Add the new rule to the current ones and save
             current_rules.append(new_rule)
             if save_notification_rules(current_rules):
                 flash("Notification rule added successfully!", "success")
             else:
                 flash("Error saving notification rules. Please check server logs.", "error")
-            return redirect(url_for('configure_notifications')) # Redirect after successful add
+            # Redirect after successful add (tokens never go in URLs, which end up in logs and history)
+            return redirect(url_for('main.configure_notifications'))
         else:
             # If validation fails, flash errors and reload form
             for error in errors:
                 flash(error, "error")
-            # Load existing rules to display them alongside the error message
-            notification_rules = load_notification_rules()
-            # Return submitted values to repopulate form
+            # Return submitted values to repopulate form (never the token)
             submitted_data = request.form.to_dict()
-            return render_template('configure_notifications.html',
-                                   notification_rules=notification_rules,
-                                   mail_recipient=MAIL_RECIPIENT,
-                                   submitted_data=submitted_data, # Pass back submitted data
-                                   now=datetime.utcnow())
+            submitted_data.pop('token', None)
+            return render_notification_rules(current_rules, submitted_data)
 
     # --- GET Request Logic --- #
-    notification_rules = load_notification_rules()
-    # Pass empty dict for submitted_data on GET
-    return render_template('configure_notifications.html', 
-                           notification_rules=notification_rules, 
-                           mail_recipient=MAIL_RECIPIENT, 
-                           submitted_data={},
+    return render_notification_rules(load_notification_rules())
+
+def render_notification_rules(rules, submitted_data=None):
+    """The rules page, listing only the rules this browser has unlocked."""
+    owners = sorted(unlocked_owners(rules))
+    admin = session_is_admin()
+    if submitted_data is None:
+        # Prefill the owner's details so their next rule is added to the same list
+        owner = owners[0] if len(owners) == 1 else ''
+        submitted_data = {'owner': owner, 'recipient': owner if EMAIL_PATTERN.match(owner) else ''} if owner else {}
+    return render_template('configure_notifications.html',
+                           notification_rules=visible_rules(rules, owners, admin) if owners or admin else None,
+                           unlocked_owners=owners,
+                           rules_admin=admin,
+                           mail_recipient=MAIL_RECIPIENT,
+                           submitted_data=submitted_data,
                            now=datetime.utcnow())
 
+def owner_token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def owner_token_hashes(rules, owner):
+    """Token hashes stored with the owner's rules (all the same unless rules were edited by hand)."""
+    return {rule['owner_token_hash'] for rule in rules if rule.get('owner') == owner and rule.get('owner_token_hash')}
+
+def is_admin_token(token):
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def owner_authorized(rules, owner, token):
+    """True if token is owner's access token."""
+    if not (owner and token):
+        return False
+    hashed = owner_token_hash(token)
+    return any(hmac.compare_digest(hashed, stored) for stored in owner_token_hashes(rules, owner))
+
+# Unlocked owners live in the (signed) session cookie, so tokens never appear in URLs or access logs
+def session_tokens():
+    return dict(session.get('rule_tokens') or {})
+
+def remember_owner(owner, token):
+    session['rule_tokens'] = dict(session_tokens(), **{owner: token})
+
+def unlocked_owners(rules):
+    """Owners whose token in this session still matches their rules."""
+    return {owner for owner, token in session_tokens().items() if owner_authorized(rules, owner, token)}
+
+def session_is_admin():
+    return is_admin_token(session.get('rules_admin_token', ''))
+
+def visible_rules(rules, owners, admin=False):
+    """The rules of the unlocked owners; every rule for the admin."""
+    return list(rules) if admin else [rule for rule in rules if rule.get('owner') in owners]
+
+def unclaimed_rules(rules):
+    """Rules without an owner token (saved before rules had owners): only the admin can see and claim them."""
+    return [rule for rule in rules if not rule.get('owner_token_hash')]
+
+@bp.route('/notification_rules/unlock', methods=['POST'])
+def unlock_notification_rules():
+    """Unlocks an owner's rules (or, with the ADMIN_TOKEN, all rules) for this browser session."""
+    owner = request.form.get('owner', '').strip().lower()
+    token = request.form.get('token', '').strip()
+    if not owner and is_admin_token(token):
+        session['rules_admin_token'] = token
+        flash("Showing every notification rule (admin).", "info")
+    elif owner_authorized(load_notification_rules(), owner, token):
+        remember_owner(owner, token)
+        flash(f"Showing the rules of {owner}.", "info")
+    else:
+        flash("Unknown owner or wrong access token.", "error")
+    return redirect(url_for('main.configure_notifications'))
+
+@bp.route('/notification_rules/lock', methods=['POST'])
+def lock_notification_rules():
+    """Forgets every owner (and the admin token) unlocked in this browser session."""
+    session.pop('rule_tokens', None)
+    session.pop('rules_admin_token', None)
+    return redirect(url_for('main.configure_notifications'))
+
+@bp.route('/notification_rules/claim', methods=['POST'])
+def claim_notification_rule():
+    """Admin only: gives an unclaimed rule an owner, issuing the owner a token if they have none yet."""
+    if not session_is_admin():
+        flash("Only the admin can assign rules to owners.", "error")
+        return redirect(url_for('main.configure_notifications'))
+    rule_id = request.form.get('rule_id')
+    current_rules = load_notification_rules()
+    rule = next((rule for rule in current_rules if rule.get('id') == rule_id), None)
+    owner = request.form.get('owner', '').strip().lower() or ((rule or {}).get('recipient') or '').lower()
+    if rule is None or rule.get('owner_token_hash'):
+        flash("Rule not found or already owned.", "warning")
+        return redirect(url_for('main.configure_notifications'))
+    if not owner:
+        flash("An owner is required to claim a rule.", "error")
+        return redirect(url_for('main.configure_notifications'))
+    hashes = sorted(owner_token_hashes(current_rules, owner))
+    if hashes:
+        rule['owner_token_hash'] = hashes[0] # Joins the owner's other rules under their existing token
+    else:
+        token = secrets.token_urlsafe(16)
+        rule['owner_token_hash'] = owner_token_hash(token)
+        flash(f"Access token for {owner}: {token}. Pass it on to them; it won't be shown again.", "info")
+    rule['owner'] = owner
+    if save_notification_rules(current_rules):
+        flash(f"Rule assigned to {owner}.", "success")
+    else:
+        flash("Error saving notification rules. Please check server logs.", "error")
+    return redirect(url_for('main.configure_notifications'))
+
 # === Route for Deleting a Notification Rule ===
-@app.route('/delete_notification_rule', methods=['POST'])
+@bp.route('/delete_notification_rule', methods=['POST'])
 def delete_notification_rule():
     rule_id_to_delete = request.form.get('rule_id')
+    back = url_for('main.configure_notifications')
     if not rule_id_to_delete:
         flash("Invalid request: Missing rule ID for deletion.", "error")
-        return redirect(url_for('configure_notifications'))
+        return redirect(back)
 
     current_rules = load_notification_rules()
+    # Only a session that unlocked the rule's owner (or the admin) deletes a rule
+    rule = next((rule for rule in current_rules if rule.get('id') == rule_id_to_delete), None)
+    if rule is not None and not (session_is_admin() or rule.get('owner') in unlocked_owners(current_rules)):
+        flash("Not allowed to delete that rule: unlock its owner first.", "error")
+        return redirect(back)
     # Filter out the rule with the matching ID
     updated_rules = [rule for rule in current_rules if rule.get('id') != rule_id_to_delete]
 
@@ -649,10 +1253,10 @@ def delete_notification_rule():
     else:
         flash("Rule not found for deletion.", "warning") # Rule ID didn't match any existing rule
 
-    return redirect(url_for('configure_notifications'))
+    return redirect(back)
 
 # === Test Email Route ===
-@app.route('/test_email')
+@bp.route('/test_email')
 def test_email():
     subject = "Test Email from Ryanair Deals App"
     body = f"This is a test email sent at {datetime.now()} to confirm your email configuration is working."
@@ -662,11 +1266,8 @@ def test_email():
         flash("MAIL_RECIPIENT environment variable is not set.", "error")
         return "Recipient email not configured.", 500
 
-    msg = Message(subject, recipients=[recipient])
-    msg.body = body
-
     try:
-        mail.send(msg)
+        send_email(subject, body, [recipient])
         flash(f"Test email successfully sent to {recipient}!", "success")
         print(f"Test email successfully sent to {recipient}")
     except Exception as e:
@@ -680,18 +1281,30 @@ def test_email():
 # === Background Task for Finding Deals ===
 # NOTIFICATION_THRESHOLD = 90.0 # Removed - Threshold is now per-rule
 
+@metrics.track_job_duration
 def check_notification_rules(): # Renamed function
     """Scheduled task to check deals based on saved notification rules."""
     print(f"\n[{datetime.now()}] Running background check for configured notification rules...")
 
     rules = load_notification_rules()
+    rule_index.matcher.load_rules(rules) # Picks up rules saved by other workers
     if not rules:
         print("  No notification rules configured. Skipping checks.")
         return
+    unclaimed = unclaimed_rules(rules)
+    if unclaimed:
+        # Still checked, but nobody can see or delete them until the admin assigns them an owner
+        print(f"  {len(unclaimed)} notification rule(s) have no owner; unlock /configure_notifications with ADMIN_TOKEN to assign them.")
 
     global background_deal_findings # Need this to update notified_deals
-    
-    # --- Loop through each configured rule --- #
+    currency = fx.CANONICAL_CURRENCY # Upstream queries; thresholds and emails use each rule's own currency
+
+    # --- Validate rules and group threshold rules by unique query --- #
+    # Rules of different users watching the same query share one API call; their alerts are
+    # collected and emailed as one digest per recipient at the end.
+    rules_by_id = {}
+    alerts = []
+    queries = {} # (origin, destination, (year, month), duration_from, duration_to) -> rule IDs
     for rule in rules:
         # Extract parameters for this rule
         rule_id = rule.get('id')
@@ -701,239 +1314,382 @@ def check_notification_rules(): # Renamed function
         duration_from = rule.get('duration_from') # Assuming these are stored as int/float now
         duration_to = rule.get('duration_to')
         threshold = rule.get('threshold')
-        currency = "EUR" # Assuming EUR for now, could be added to rule later
+        rule_type = rule.get('type', 'threshold') # 'threshold' or 'price_drop'
 
         # --- Basic validation of rule data --- #
-        if not all([rule_id, origin_iata, destination_iata, search_month_str, duration_from, duration_to, threshold]):
+        criterion = rule.get('drop_percent') if rule_type == 'price_drop' else threshold
+        if not all([rule_id, origin_iata, destination_iata, search_month_str, duration_from, duration_to, criterion]):
             print(f"  Skipping invalid or incomplete rule: {rule}")
             continue
 
-        print(f"  Checking Rule ID {rule_id[:6]}...: {origin_iata} -> {destination_iata} ({search_month_str}, {duration_from}-{duration_to} days, < {threshold} {currency})")
+        if rule_type == 'price_drop':
+            # Evaluated from the incrementally maintained price statistics, no API call
+            alert = check_price_drop_rule(rule)
+            if alert:
+                alerts.append(alert)
+            continue
 
-        # --- Calculate Dates --- #
         try:
-            year, month = map(int, search_month_str.split('-'))
-            out_date_from = date(year, month, 1)
-            last_day = get_last_day_of_month(year, month)
-            out_date_to = date(year, month, last_day)
-            in_date_from = out_date_from
-            next_month_date = (out_date_to.replace(day=1) + timedelta(days=32))
-            in_year_in, in_month_in = next_month_date.year, next_month_date.month
-            in_last_day = get_last_day_of_month(in_year_in, in_month_in)
-            in_date_to = date(in_year_in, in_month_in, in_last_day)
+            year_month = fare_search.parse_month(search_month_str)
         except (AttributeError, ValueError, TypeError) as e:
             print(f"    ERROR: Invalid date/duration in rule {rule_id[:6]}. Skipping. Error: {e}")
             continue # Skip this rule
-        # --- End Date Calculation --- #
-
-        # --- API Call --- #
-        found_deals_for_this_rule = []
-        api_url = ROUND_TRIP_API_TEMPLATE.format(
-            origin_iata=origin_iata, destination_iata=destination_iata,
-            out_date_from=out_date_from.strftime("%Y-%m-%d"), out_date_to=out_date_to.strftime("%Y-%m-%d"),
-            in_date_from=in_date_from.strftime("%Y-%m-%d"), in_date_to=in_date_to.strftime("%Y-%m-%d"),
-            duration_from=duration_from, duration_to=duration_to, currency=currency
-        )
-        try:
-            response = requests.get(api_url, headers=HEADERS, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            if 'fares' in data and data['fares']:
-                for fare in data['fares']:
-                    try:
-                        total_price = fare.get('summary', {}).get('price', {}).get('value')
-                        # Check against the threshold FOR THIS RULE
-                        if total_price is not None and total_price < threshold:
-                            trip_details = {
-                                'origin_iata': fare.get('outbound', {}).get('departureAirport', {}).get('iataCode'),
-                                'destination_iata': fare.get('outbound', {}).get('arrivalAirport', {}).get('iataCode'),
-                                'total_price': total_price,
-                                'currency': fare.get('summary', {}).get('price', {}).get('currencyCode'),
-                                'outbound_dep_time': fare.get('outbound', {}).get('departureDate'),
-                                'inbound_dep_time': fare.get('inbound', {}).get('departureDate')
-                            }
-                            found_deals_for_this_rule.append(trip_details)
-                    except (KeyError, TypeError):
-                        continue # Skip parsing error for specific fare
-        except Exception as e:
-            print(f"    Error checking API for rule {rule_id[:6]}: {e}")
-            continue # Skip this rule if API fails
-        # --- End API Call --- #
-
-        # --- Email Notification Logic (per rule) --- #
+        rules_by_id[rule_id] = rule
+        queries.setdefault((origin_iata, destination_iata, year_month, duration_from, duration_to), []).append(rule_id)
+
+    # --- API Calls: one per unique query, in parallel --- #
+    # Every fare is matched against all rules through the threshold index, so rules sharing a
+    # query share its call, and deals seen by user searches or the history collector count too.
+    query_urls = {
+        query: fare_search.round_trip_url(query[0], query[1], query[2][0], query[2][1], query[3], query[4], currency)
+        for query in queries
+    }
+    requests_to_make = [(query, ROUND_TRIP_API_TEMPLATE, api_url) for query, api_url in query_urls.items()]
+    # A response still at the cache version it had before the calls was served from the cache
+    cached_versions = {query: fare_client.cache_version(api_url) for query, api_url in query_urls.items()}
+    print(f"  Checking {len(rules_by_id)} threshold rule(s) with {len(requests_to_make)} API call(s)...")
+    for query, (data, error) in fare_client.fetch_json_many(requests_to_make).items():
+        if error is not None:
+            origin_iata, destination_iata, year_month = query[:3]
+            print(f"    Error checking API for {origin_iata} -> {destination_iata} ({year_month[0]}-{year_month[1]:02d}): {error}")
+            continue
+        # Fresh responses were already offered by the fare client listener. Cached ones never reach it,
+        # so offer those explicitly; payloads matched by an earlier run are skipped, changed ones diffed.
+        version = cached_versions[query]
+        if version is not None and fare_client.cache_version(query_urls[query]) == version:
+            rule_index.matcher.offer_round_trip_response(data, query_urls[query])
+
+    # --- Alerts (per rule) --- #
+    for rule_id, found_deals_for_this_rule in rule_index.matcher.pop_pending().items():
+        rule = rules_by_id.get(rule_id)
+        if rule is None:
+            continue # Rule deleted or invalid since the deal was matched
+        origin_iata = rule['origin_iata']
+        destination_iata = rule['destination_iata']
+        search_month_str = rule['search_month']
+        duration_from, duration_to, threshold = rule['duration_from'], rule['duration_to'], rule['threshold']
+        rule_currency = rule.get('currency') or currency
+
         newly_found_deals_for_email = []
-        if found_deals_for_this_rule:
-            for deal in found_deals_for_this_rule:
-                # Make notified_deals key more specific including rule ID
-                deal_id = f"{rule_id}-{deal['destination_iata']}-{deal['total_price']}-{deal['outbound_dep_time']}"
-                if deal_id not in background_deal_findings["notified_deals"]:
-                    newly_found_deals_for_email.append(deal)
-                    # Note: Adding to notified set happens after potential successful send attempt
+        new_deal_ids = []
+        for deal in sorted(found_deals_for_this_rule, key=lambda deal: deal['total_price']):
+            # Make notified_deals key more specific including rule ID
+            if rule_index.deal_id(rule_id, deal) not in background_deal_findings["notified_deals"]:
+                newly_found_deals_for_email.append(deal)
+                new_deal_ids.append(rule_index.deal_id(rule_id, deal))
+                # Note: Adding to notified set happens after potential successful send attempt
+        # Prices in the email are shown in the rule's currency
+        newly_found_deals_for_email = fx.convert_records(newly_found_deals_for_email, ('total_price',), rule_currency)
 
         if newly_found_deals_for_email:
-            print(f"  Found {len(newly_found_deals_for_email)} new deal(s) matching Rule ID {rule_id[:6]} ({origin_iata}->{destination_iata} < {threshold} {currency}) to notify.")
-            if not MAIL_RECIPIENT:
-                print("    ERROR: MAIL_RECIPIENT environment variable not set. Cannot send email.")
-                continue # Skip email sending for this rule if recipient not set
-
-            subject = f"Ryanair Deal Alert! {origin_iata} -> {destination_iata} flight(s) under {threshold} {currency} found!"
-            body_lines = [f"Found {len(newly_found_deals_for_email)} new round trip deal(s) matching your rule ({origin_iata} -> {destination_iata} in {search_month_str}, {duration_from}-{duration_to} days, under {threshold} {currency}):", ""]
+            print(f"  Found {len(newly_found_deals_for_email)} new deal(s) matching Rule ID {rule_id[:6]} ({origin_iata}->{destination_iata} < {threshold} {rule_currency}) to notify.")
+            subject = f"Ryanair Deal Alert! {origin_iata} -> {destination_iata} flight(s) under {threshold} {rule_currency} found!"
+            body_lines = [f"Found {len(newly_found_deals_for_email)} new round trip deal(s) matching your rule ({origin_iata} -> {destination_iata} in {search_month_str}, {duration_from}-{duration_to} days, under {threshold} {rule_currency}):", ""]
             for deal in newly_found_deals_for_email:
                 body_lines.append(f"- Price: {deal['total_price']}{deal['currency']} (Outbound: {deal['outbound_dep_time'][:10]}, Inbound: {deal['inbound_dep_time'][:10]})")
-            body = "\n".join(body_lines)
-
-            # Send email within app context
-            try:
-                with app.app_context():
-                    msg = Message(subject, recipients=[MAIL_RECIPIENT])
-                    msg.body = body
-                    mail.send(msg)
-                print(f"    Successfully sent email notification to {MAIL_RECIPIENT} for rule {rule_id[:6]}")
-                # Update notified set only after successful send attempt
-                for deal in newly_found_deals_for_email:
-                     deal_id = f"{rule_id}-{deal['destination_iata']}-{deal['total_price']}-{deal['outbound_dep_time']}"
-                     background_deal_findings["notified_deals"].add(deal_id)
-            except Exception as e:
-                print(f"    ERROR sending email notification for rule {rule_id[:6]}: {e}")
-                # Decide if you want to retry or just skip marking as notified on failure
+            alerts.append({'rule_id': rule_id, 'recipient': rule_recipient(rule), 'subject': subject,
+                           'body': "\n".join(body_lines), 'deal_ids': new_deal_ids})
 
     # --- End loop through rules --- #
-    background_deal_findings["last_checked"] = datetime.now() # Update overall last checked time
+    # Send emails (scheduler jobs run inside an app context, see start_scheduler())
+    if alerts and not send_rule_alerts(alerts):
+        # Retried next run: unchanged fares are matched again once the snapshots are gone
+        rule_index.matcher.forget_snapshots()
+    with background_deal_findings_lock:
+        background_deal_findings["last_checked"] = datetime.now() # Update overall last checked time
     print(f"[{datetime.now()}] Background check finished.")
 
+def send_rule_alerts(alerts):
+    """
+    Emails alerts ({'rule_id', 'recipient', 'subject', 'body', 'deal_ids'}) as one
+    message per recipient, all over one SMTP connection, and marks the deals of
+    the delivered ones as notified. Returns False if sending failed for any.
+    """
+    by_recipient = {} # Lower-cased address -> alerts, in rule order
+    for alert in alerts:
+        if not alert['recipient']:
+            # Not worth retrying: MAIL_RECIPIENT only changes with a restart
+            print(f"    ERROR: Rule {alert['rule_id'][:6]} has no recipient and MAIL_RECIPIENT is not set. Cannot send email.")
+            continue
+        by_recipient.setdefault(alert['recipient'].lower(), []).append(alert)
+    if not by_recipient:
+        return True
+
+    messages = []
+    for recipient_alerts in by_recipient.values():
+        if len(recipient_alerts) == 1:
+            subject = recipient_alerts[0]['subject']
+        else:
+            subject = f"Ryanair Deal Alert! {len(recipient_alerts)} of your rules found new deals"
+        body = "\n\n".join(alert['body'] for alert in recipient_alerts)
+        messages.append((subject, body, [recipient_alerts[0]['recipient']]))
+    try:
+        failed = dict(send_emails(messages))
+    except Exception as e:
+        print(f"    ERROR connecting to the mail server, {len(messages)} alert email(s) not sent: {e}")
+        return False
+
+    for index, recipient_alerts in enumerate(by_recipient.values()):
+        recipient = recipient_alerts[0]['recipient']
+        if index in failed:
+            print(f"    ERROR sending email notification to {recipient}: {failed[index]}")
+            continue
+        # Update notified set only after a successful send
+        with background_deal_findings_lock:
+            for alert in recipient_alerts:
+                background_deal_findings["notified_deals"].update(alert['deal_ids'])
+    print(f"  Sent {len(messages) - len(failed)} of {len(messages)} alert email(s) for {len(alerts)} rule(s).")
+    return not failed
+
+def check_price_drop_rule(rule):
+    """
+    Finds round trips whose latest price dropped drop_percent below the rule's
+    baseline (mean, min or EWMA). Returns an alert for send_rule_alerts(), or None.
+    """
+    rule_id = rule['id']
+    origin_iata = rule['origin_iata']
+    destination_iata = rule['destination_iata']
+    baseline = rule.get('baseline', 'mean')
+    drop_percent = float(rule['drop_percent'])
+    currency = rule.get('currency') or fx.CANONICAL_CURRENCY # Statistics are kept in EUR; emails use the rule's currency
+    print(f"  Checking Rule ID {rule_id[:6]}...: {origin_iata} -> {destination_iata} ({rule['search_month']}, {rule['duration_from']}-{rule['duration_to']} days, {drop_percent}% below {baseline})")
+    try:
+        year, month = fare_search.parse_month(rule['search_month'])
+        drops = price_stats.find_price_drops(price_stats.route_stats, origin_iata, destination_iata, year, month,
+                                             int(rule['duration_from']), int(rule['duration_to']), drop_percent, baseline)
+    except (KeyError, ValueError, TypeError) as e:
+        print(f"    ERROR: Invalid price-drop rule {rule_id[:6]}. Skipping. Error: {e}")
+        return None
+
+    new_drops = []
+    for drop in drops:
+        deal_id = f"{rule_id}-{destination_iata}-{drop['price']}-{drop['out_date'].isoformat()}-{drop['in_date'].isoformat()}"
+        if deal_id not in background_deal_findings["notified_deals"]:
+            new_drops.append((deal_id, drop))
+    if not new_drops:
+        return None
+
+    shown_drops = fx.convert_records([drop for _, drop in new_drops], ('price', 'baseline_price'), currency, fx.CANONICAL_CURRENCY)
+    print(f"  Found {len(new_drops)} new price drop(s) matching Rule ID {rule_id[:6]} ({origin_iata}->{destination_iata}) to notify.")
+    subject = f"Ryanair Price Drop! {origin_iata} -> {destination_iata} fare(s) {drop_percent:g}% below the {baseline} price"
+    body_lines = [f"Found {len(new_drops)} round trip(s) at least {drop_percent:g}% below their {baseline} price ({origin_iata} -> {destination_iata} in {rule['search_month']}, {rule['duration_from']}-{rule['duration_to']} days):", ""]
+    for drop in shown_drops:
+        body_lines.append(f"- Price: {drop['price']}{currency}, {drop['drop_percent']}% below {drop['baseline_price']}{currency} (Outbound: {drop['out_date']}, Inbound: {drop['in_date']})")
+    return {'rule_id': rule_id, 'recipient': rule_recipient(rule), 'subject': subject,
+            'body': "\n".join(body_lines), 'deal_ids': [deal_id for deal_id, _ in new_drops]}
+
 # === Background Task for Historical Data Collection ===
 
+@metrics.track_job_duration
 def collect_price_history():
-    """Scheduled task to collect daily cheapest prices and store in Supabase."""
+    """Scheduled task to collect daily cheapest prices, store them in Supabase and update the price statistics."""
     print(f"[{datetime.now()}] Attempting to start collect_price_history task...") # ADDED FOR DEBUGGING
+    supabase = get_supabase()
     if not supabase: # Check if Supabase client is initialized
-        print(f"[{datetime.now()}] Skipping price history collection: Supabase client not available.")
-        return
+        # Fares are still collected for the price-drop statistics, just not stored
+        print(f"[{datetime.now()}] Supabase client not available: collected prices will only update the price statistics.")
 
     # --- Configuration (Hardcoded for now) ---
     routes_to_track = [
         {"origin": "SOF", "destination": "BCN"}
         # Add more routes here later if needed
     ]
-    # Dynamically calculate next month instead of using a hardcoded value
+    # Rolling horizon: the current month and the following ones
     today = date.today()
-    current_month_start = today.replace(day=1)
-    # Add enough days to guarantee getting into the next month, then replace day with 1
-    next_month_start = (current_month_start + timedelta(days=35)).replace(day=1) 
-    month_to_track_str = next_month_start.strftime('%Y-%m')
+    horizon_months = [date(year, month, 1) for year, month in
+                      fare_search.months_from(today.year, today.month, refresh_scheduler.REFRESH_HORIZON_MONTHS)]
 
-    currency = "EUR"
+    currency = fx.CANONICAL_CURRENCY # Stored in EUR; converted when read (see api_price_history)
     # -----------------------------------------
 
-    print(f"\n[{datetime.now()}] Running price history collection for {month_to_track_str}...")
-
-    try:
-        year, month = map(int, month_to_track_str.split('-'))
-        month_date = date(year, month, 1)
-        # last_day = get_last_day_of_month(year, month) # Not needed for API call
-    except (ValueError, TypeError, AttributeError):
-        print(f"  ERROR: Invalid month format '{month_to_track_str}' for history collection.")
-        return
+    print(f"\n[{datetime.now()}] Running price history collection for {fare_search.format_month_range([(m.year, m.month) for m in horizon_months])}...")
 
     # Helper function (similar to analysis one, but formats for DB)
-    def get_and_prepare_daily_prices(orig, dest, month_dt):
+    def prepare_daily_prices(orig, dest, month_dt, direction, data):
         records_to_insert = []
-        api_url = ONE_WAY_MONTH_API_TEMPLATE.format(
-            origin_iata=orig,
-            destination_iata=dest,
-            month_date=month_dt.strftime("%Y-%m-%d"),
-            currency=currency
-        )
-        print(f"  Calling History API: {api_url}")
-        try:
-            response = requests.get(api_url, headers=HEADERS, timeout=20)
-            response.raise_for_status()
-            data = response.json()
-            if 'fares' in data:
-                for day_fare in data['fares']:
-                    day_num = day_fare.get('day')
-                    price_info = day_fare.get('price')
-                    if day_num and price_info and price_info['value'] is not None:
-                        try:
-                            departure_dt = date(month_dt.year, month_dt.month, day_num)
-                            record = {
-                                # collected_at is handled by DB default
-                                'origin_iata': orig,
-                                'destination_iata': dest,
-                                'departure_date': departure_dt.isoformat(), # Store as YYYY-MM-DD string
-                                'price': price_info['value'],
-                                'currency': price_info.get('currencyCode', currency),
-                                'direction': 'outbound' if orig == route["origin"] else 'inbound'
-                            }
-                            records_to_insert.append(record)
-                        except ValueError: # Handle invalid day numbers (e.g., 31 in Feb)
-                            print(f"    Warning: Invalid day number {day_num} for {month_dt.strftime('%Y-%m')}. Skipping.")
-                            continue
-            return records_to_insert, None # Return records, no error
-        except requests.exceptions.RequestException as req_err:
-            err_msg = f"Network Error fetching history for {orig}->{dest}: {req_err}"
-            print(f"    {err_msg}")
-            return [], err_msg # Return empty list, error message
-        except Exception as e:
-            err_msg = f"Error fetching/parsing history for {orig}->{dest}: {e}"
-            print(f"    {err_msg}")
-            return [], err_msg # Return empty list, error message
+        for departure_dt, price_value, currency_code in fare_client.iter_daily_fares(data, month_dt):
+            record = {
+                # collected_at is handled by DB default
+                'origin_iata': orig,
+                'destination_iata': dest,
+                'departure_date': departure_dt.isoformat(), # Store as YYYY-MM-DD string
+                'price': price_value,
+                'currency': currency_code or currency,
+                'direction': direction
+            }
+            records_to_insert.append(record)
+        return records_to_insert
 
-    # --- Collect and Insert Data for each route --- #
+    # --- Routes of price-drop rules (return legs may cross into the following month) --- #
+    tracked_routes = [(route["origin"], route["destination"], horizon_months, horizon_months) for route in routes_to_track]
+    for rule in load_notification_rules():
+        if rule.get('type') != 'price_drop':
+            continue
+        try:
+            rule_month = date(*fare_search.parse_month(rule.get('search_month', '')), 1)
+        except (ValueError, TypeError, AttributeError):
+            continue
+        following_month = (rule_month + timedelta(days=32)).replace(day=1)
+        tracked_routes.append((rule.get('origin_iata'), rule.get('destination_iata'), [rule_month], [rule_month, following_month]))
+
+    # Each (origin, destination, month) is tracked once, whatever asked for it
+    month_fetches = {}
+    current_month = today.replace(day=1)
+    for origin, destination, out_months, in_months in tracked_routes:
+        for month_dt in out_months:
+            month_fetches.setdefault((origin, destination, month_dt), 'outbound')
+        for month_dt in in_months:
+            month_fetches.setdefault((destination, origin, month_dt), 'inbound')
+    month_fetches = {key: direction for key, direction in month_fetches.items() if key[2] >= current_month}
+
+    # Only the route-months whose refresh is due, most overdue first, within the per-run budget
+    refresh_scheduler.history_refresh.sync(month_fetches.keys(), today)
+    due_items = refresh_scheduler.history_refresh.due()
+    print(f"  Refreshing {len(due_items)} of {len(month_fetches)} tracked route-months.")
+    responses = fare_client.fetch_json_many([
+        (item, ONE_WAY_MONTH_API_TEMPLATE, fare_search.one_way_month_url(item[0], item[1], item[2].year, item[2].month, currency))
+        for item in due_items
+    ], timeout=20, use_cache=False) # Cached fares are up to FARE_CACHE_TTL_SECONDS old: history rows must be fresh
+
+    # --- Update Statistics and Insert --- #
     total_inserted = 0
-    for route in routes_to_track:
-        origin = route["origin"]
-        destination = route["destination"]
-        
-        # Get outbound and inbound prices
-        out_records, out_err = get_and_prepare_daily_prices(origin, destination, month_date)
-        in_records, in_err = get_and_prepare_daily_prices(destination, origin, month_date)
-        
-        all_records_for_route = out_records + in_records
-        
-        if not all_records_for_route:
-             print(f"  No price data found or error occurred for {origin}<->{destination}. Skipping DB insert.")
+    for (orig, dest, month_dt), (data, error) in responses.items():
+        records = []
+        if error is not None:
+            print(f"    Error fetching history for {orig}->{dest} ({month_dt.strftime('%Y-%m')}): {error}")
+        else:
+            try:
+                records = prepare_daily_prices(orig, dest, month_dt, month_fetches[(orig, dest, month_dt)], data)
+            except Exception as e:
+                print(f"    Error parsing history for {orig}->{dest} ({month_dt.strftime('%Y-%m')}): {e}")
+        # Volatility and the next refresh time come from the prices seen now
+        refresh_scheduler.history_refresh.record_refresh(
+            (orig, dest, month_dt), {record['departure_date']: record['price'] for record in records}, today)
+        if not records:
+             print(f"  No price data found or error occurred for {orig}->{dest} ({month_dt.strftime('%Y-%m')}). Skipping.")
              continue
 
+        # Running mean/variance, min and EWMA per (route, departure date) for price-drop rules
+        for record in records:
+            price_stats.route_stats.observe(orig, dest, date.fromisoformat(record['departure_date']), record['price'])
+
+        if not supabase:
+            continue
         # Insert into Supabase
         try:
-            print(f"  Attempting to insert {len(all_records_for_route)} records for {origin}<->{destination}...")
-            data, count = supabase.table('price_history').insert(all_records_for_route).execute()
+            print(f"  Attempting to insert {len(records)} records for {orig}->{dest}...")
+            with profiling.span('supabase', table='price_history'):
+                data, count = supabase.table('price_history').insert(records).execute()
             # Note: Supabase python client v1 might return count differently or not at all.
             # V2 execute() returns a tuple like (data, count).
             # We primarily care if an exception occurs.
-            print(f"  Successfully inserted records for {origin}<->{destination}.")
-            total_inserted += len(all_records_for_route) # Rough count, actual count might differ if some rows fail
+            print(f"  Successfully inserted records for {orig}->{dest}.")
+            total_inserted += len(records) # Rough count, actual count might differ if some rows fail
+            history_store.record_ingest(records) # Cached trend data for these dates is now out of date
         except Exception as db_err:
-            print(f"  ERROR inserting price history for {origin}<->{destination} into Supabase: {db_err}")
+            print(f"  ERROR inserting price history for {orig}->{dest} into Supabase: {db_err}")
+
+    price_stats.route_stats.prune()
+    print(f"[{datetime.now()}] Price history collection finished. Attempted to insert ~{total_inserted} records; tracking statistics for {len(price_stats.route_stats)} route dates.")
 
-    print(f"[{datetime.now()}] Price history collection finished. Attempted to insert ~{total_inserted} records.")
+# === Background Task for FX Rates ===
 
-# --- Initialize Scheduler ---
-logging.basicConfig()
-logging.getLogger('apscheduler').setLevel(logging.WARNING) # Reduce APScheduler noise
+@metrics.track_job_duration
+def refresh_fx_rates():
+    """Scheduled task refreshing the FX rate table; the last rates stay in use if the feed is down."""
+    try:
+        count = fx.refresh_rates()
+    except Exception as e:
+        print(f"[{datetime.now()}] ERROR refreshing FX rates (keeping rates as of {fx.get_table().as_of or 'bundled file'}): {e}")
+        return
+    # Only this process's table is swapped here. Other workers reload theirs from the state file on their
+    # next lookup (see fx.get_table()), and their cached pages built with the old table stop being served
+    page_cache.clear() # Cached pages may show converted prices
+    rule_index.matcher.load_rules(load_notification_rules()) # Thresholds are indexed in EUR
+    print(f"[{datetime.now()}] FX rates refreshed: {count} currencies as of {fx.get_table().as_of}.")
 
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.add_job(check_notification_rules, 'interval', minutes=2)
-# Add job for history collection (e.g., every 2 minutes for debugging)
-scheduler.add_job(collect_price_history, 'interval', minutes=2, id='price_history_collector') # Changed from hours=1
+# === Background Task for State Snapshots ===
 
-try:
-    scheduler.start()
-    print("Background notification rule checker scheduled to run every 2 minutes.")
-    print("Background price history collector scheduled to run every 2 minutes.") # Updated message
-    # Shut down the scheduler when exiting the app
-    atexit.register(lambda: scheduler.shutdown())
-except (KeyboardInterrupt, SystemExit):
-    scheduler.shutdown()
+@metrics.track_job_duration
+def save_state_snapshot():
+    """Scheduled task (and shutdown hook) persisting the fare cache and deal findings."""
+    try:
+        saved = state_snapshot.save_snapshot(background_deal_findings, lock=background_deal_findings_lock)
+        print(f"[{datetime.now()}] State snapshot saved ({saved} fare cache entries).")
+    except Exception as e:
+        print(f"[{datetime.now()}] ERROR saving state snapshot: {e}")
+
+# --- Initialize Scheduler (lazy) ---
+scheduler = None
+_scheduler_lock = threading.Lock()
+
+def _run_in_app_context(flask_app, func):
+    """
+    Wraps a scheduler job so it runs inside the given app's context (needed for mail),
+    under a job fare budget and with slow-job logging.
+    """
+    @functools.wraps(func)
+    def job():
+        with flask_app.app_context(), budget.limit(budget.job_budget()), profiling.job_trace(func.__name__):
+            return func()
+    return job
+
+def start_scheduler(flask_app):
+    """Starts the background scheduler and its jobs once per process."""
+    global scheduler
+    if scheduler is not None:
+        return scheduler
+    with _scheduler_lock:
+        if scheduler is not None:
+            return scheduler
+        from apscheduler.schedulers.background import BackgroundScheduler # Deferred import
+
+        logging.basicConfig()
+        logging.getLogger('apscheduler').setLevel(logging.WARNING) # Reduce APScheduler noise
+
+        new_scheduler = BackgroundScheduler(daemon=True)
+        new_scheduler.add_job(_run_in_app_context(flask_app, check_notification_rules), 'interval', minutes=2)
+        # Add job for history collection (e.g., every 2 minutes for debugging)
+        new_scheduler.add_job(_run_in_app_context(flask_app, collect_price_history), 'interval', minutes=2, id='price_history_collector') # Changed from hours=1
+        if page_cache.PAGE_CACHE_ENABLED and PAGE_CACHE_PRERENDER_SECONDS > 0:
+            # Re-renders only once the fares behind the cached page have refreshed or expired
+            new_scheduler.add_job(_run_in_app_context(flask_app, prerender_hot_pages), 'interval',
+                                  seconds=PAGE_CACHE_PRERENDER_SECONDS, id='page_prerender',
+                                  next_run_time=datetime.now())
+        # Right away only if no worker refreshed the shared rates file recently
+        new_scheduler.add_job(refresh_fx_rates, 'interval', hours=fx.FX_REFRESH_HOURS, id='fx_rates',
+                              next_run_time=fx.next_refresh_time())
+        if STATE_SNAPSHOT_ENABLED:
+            new_scheduler.add_job(save_state_snapshot, 'interval', minutes=STATE_SNAPSHOT_INTERVAL_MINUTES, id='state_snapshot')
+            atexit.register(save_state_snapshot)
+
+        new_scheduler.start()
+        print("Background notification rule checker scheduled to run every 2 minutes.")
+        print("Background price history collector scheduled to run every 2 minutes.") # Updated message
+        # Shut down the scheduler when exiting the app
+        atexit.register(lambda: new_scheduler.shutdown(wait=False))
+        scheduler = new_scheduler
+    return scheduler
+
+@bp.before_app_request
+def ensure_background_services():
+    # The scheduler starts with the first request a worker serves, not at import time
+    if SCHEDULER_ENABLED and scheduler is None:
+        start_scheduler(current_app._get_current_object())
 
 # === Price Analysis Route ===
 
-@app.route('/price_analysis')
+MAX_ANALYSIS_DURATION = 30 # Longest stay shown in the round trip price matrix
+
+@bp.route('/price_analysis')
+@budget.with_request_budget
 def price_analysis():
     origin_iata = request.args.get('origin_iata', '').strip().upper()
     destination_iata = request.args.get('destination_iata', '').strip().upper()
     month_str = request.args.get('month', '')
+    months_str = request.args.get('months', '1') # Horizon length in months
+    duration_from_str = request.args.get('duration_from', '2')
+    duration_to_str = request.args.get('duration_to', '7')
 
     # If no parameters provided, show the form
     if not all([origin_iata, destination_iata, month_str]):
@@ -944,78 +1700,92 @@ def price_analysis():
         form_data = {
             'origin_iata': origin_iata,
             'destination_iata': destination_iata,
-            'month': month_str or default_month
+            'month': month_str or default_month,
+            'months': months_str,
+            'duration_from': duration_from_str,
+            'duration_to': duration_to_str,
+            'currency': request.args.get('currency', '')
         }
-        return render_template('price_analysis_form.html', form_data=form_data, now=datetime.utcnow())
+        return render_template('price_analysis_form.html', form_data=form_data,
+                               max_months=fare_search.MAX_SEARCH_MONTHS, now=datetime.utcnow())
 
     # --- Parameters provided, proceed with analysis --- #
-    print(f"Price Analysis Req: {origin_iata} <-> {destination_iata} for {month_str}")
+    print(f"Price Analysis Req: {origin_iata} <-> {destination_iata} for {month_str} (+{months_str} month(s))")
     results = [] # List to hold daily price info: {'day': d, 'out_price': p1, 'in_price': p2}
+    matrix_summary = None
     errors = []
-    currency = "EUR"
+    currency = fx.CANONICAL_CURRENCY # Fares are fetched once in EUR and converted for display
+    display_currency = fx.requested_currency(request.args.get('currency'))
 
     # --- Input Validation --- #
-    iata_pattern = re.compile(r"^[A-Za-z]{3}$")
-    if not iata_pattern.match(origin_iata) or not iata_pattern.match(destination_iata):
-        errors.append("Origin and Destination must be valid 3-letter IATA codes.")
+    errors += airports.code_errors([origin_iata, destination_iata])
+    flash_airport_warnings([origin_iata, destination_iata])
     if origin_iata == destination_iata:
         errors.append("Origin and Destination cannot be the same.")
+    elif not errors and not airports.serves(origin_iata, destination_iata):
+        errors.append(f"Ryanair doesn't fly {origin_iata} -> {destination_iata}.")
     
     try:
         year, month = map(int, month_str.split('-'))
         if not (1 <= month <= 12) or year < date.today().year:
             raise ValueError("Invalid month/year")
-        month_date = date(year, month, 1)
-        last_day = get_last_day_of_month(year, month)
+        num_months = int(months_str)
+        if not (1 <= num_months <= fare_search.MAX_SEARCH_MONTHS):
+            raise ValueError("Invalid horizon")
+        # Outbound covers the horizon; inbound needs one more month for stays crossing its end
+        inbound_months = fare_search.months_from(year, month, num_months + 1)
+        outbound_months = inbound_months[:-1]
     except (ValueError, TypeError, AttributeError):
-        errors.append("Invalid month format. Please use YYYY-MM.")
+        errors.append(f"Invalid month or horizon. Please use YYYY-MM and 1-{fare_search.MAX_SEARCH_MONTHS} months.")
+
+    try:
+        duration_from = int(duration_from_str)
+        duration_to = int(duration_to_str)
+        if duration_from < 1 or duration_to > MAX_ANALYSIS_DURATION or duration_from > duration_to:
+            raise ValueError("Invalid duration range")
+    except (ValueError, TypeError):
+        errors.append(f"Valid Min/Max Durations (1-{MAX_ANALYSIS_DURATION} days, Min <= Max) are required.")
     # --- End Validation --- #
 
     if not errors:
-        # Helper function to get daily prices for one direction
-        def get_daily_prices(orig, dest, month_dt):
-            daily_prices = {}
-            api_url = ONE_WAY_MONTH_API_TEMPLATE.format(
-                origin_iata=orig,
-                destination_iata=dest,
-                month_date=month_dt.strftime("%Y-%m-%d"),
-                currency=currency
-            )
-            print(f"  Calling Analysis API: {api_url}")
-            try:
-                response = requests.get(api_url, headers=HEADERS, timeout=20)
-                response.raise_for_status()
-                data = response.json()
-                if 'fares' in data:
-                    for day_fare in data['fares']:
-                        if day_fare.get('price') and day_fare['price']['value'] is not None:
-                            daily_prices[day_fare['day']] = day_fare['price']['value']
-                return daily_prices, None # Return prices, no error
-            except requests.exceptions.HTTPError as http_err:
-                err_msg = f"API Error ({http_err.response.status_code}) for {orig}->{dest}"
-                print(f"    {err_msg}")
-                return {}, err_msg # Return empty dict, error message
-            except Exception as e:
-                err_msg = f"Error fetching data for {orig}->{dest}: {e}"
-                print(f"    {err_msg}")
-                return {}, err_msg # Return empty dict, error message
-
-        # Get outbound and inbound prices
-        outbound_prices, out_err = get_daily_prices(origin_iata, destination_iata, month_date)
-        inbound_prices, in_err = get_daily_prices(destination_iata, origin_iata, month_date)
-
-        if out_err: errors.append(out_err)
-        if in_err: errors.append(in_err)
-
-        # Combine results day by day
-        # Check if last_day was successfully calculated before using it
-        if 'last_day' in locals(): 
-            for day_num in range(1, last_day + 1):
-                results.append({
-                    'day': day_num,
-                    'out_price': outbound_prices.get(day_num), # Will be None if day not found
-                    'in_price': inbound_prices.get(day_num)  # Will be None if day not found
-                })
+        # --- Fetch all outbound and inbound months in parallel --- #
+        route_months = [(origin_iata, destination_iata, ym) for ym in outbound_months]
+        route_months += [(destination_iata, origin_iata, ym) for ym in inbound_months]
+        print(f"  Calling Analysis API for {len(route_months)} route-months")
+        daily_prices, fetch_errors = fare_search.fetch_daily_fares(route_months, currency)
+        for (orig, dest), error in fetch_errors.items():
+            if isinstance(error, budget.BudgetExceeded):
+                err_msg = budget_stop_message() or str(error)
+            elif isinstance(error, requests.exceptions.HTTPError):
+                err_msg = f"API Error ({error.response.status_code}) for {orig}->{dest}"
+            else:
+                err_msg = f"Error fetching data for {orig}->{dest}: {error}"
+            print(f"    {err_msg}")
+            if err_msg not in errors:
+                errors.append(err_msg)
+        outbound_prices = daily_prices[(origin_iata, destination_iata)] # {date: price}
+        inbound_prices = daily_prices[(destination_iata, origin_iata)]
+
+        # --- Daily table and vectorized round trip matrix --- #
+        start_date = date(*outbound_months[0], 1)
+        last_y, last_m = outbound_months[-1]
+        num_days = (date(last_y, last_m, get_last_day_of_month(last_y, last_m)) - start_date).days + 1
+        for offset in range(num_days):
+            day = start_date + timedelta(days=offset)
+            results.append({
+                'day': day.isoformat() if num_months > 1 else day.day,
+                'out_price': outbound_prices.get(day), # Will be None if day not found
+                'in_price': inbound_prices.get(day)  # Will be None if day not found
+            })
+
+        results = fx.convert_records(results, ('out_price', 'in_price'), display_currency, currency)
+
+        # The daily arrays are converted before the matrix is built: one multiply per direction
+        outbound_array = fx.convert(price_matrix.prices_to_array(outbound_prices, start_date, num_days), display_currency, currency)
+        inbound_array = fx.convert(price_matrix.prices_to_array(inbound_prices, start_date, num_days + duration_to), display_currency, currency)
+        matrix, durations = price_matrix.build_matrix(outbound_array, inbound_array, duration_from, duration_to)
+        matrix_summary = price_matrix.summarize(matrix, durations, start_date)
+        matrix_summary['durations'] = [int(d) for d in durations]
             
     # Flash any errors accumulated
     for error in errors:
@@ -1024,15 +1794,17 @@ def price_analysis():
     return render_template('price_analysis_results.html',
                            origin_iata=origin_iata,
                            destination_iata=destination_iata,
-                           month_str=month_str,
+                           month_str=fare_search.format_month_range(outbound_months) if not errors else month_str,
                            results=results,
-                           currency=currency,
+                           matrix=matrix_summary,
+                           currency=display_currency,
                            now=datetime.utcnow())
 
 # === API Route for Historical Price Data ===
 
-@app.route('/api/price_history')
+@bp.route('/api/price_history')
 def api_price_history():
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Supabase client not available"}), 503
 
@@ -1041,16 +1813,19 @@ def api_price_history():
     destination_iata = request.args.get('destination_iata', '').strip().upper()
     departure_date_str = request.args.get('departure_date', '') # Expect YYYY-MM-DD
     direction = request.args.get('direction', 'outbound').lower() # 'outbound' or 'inbound'
+    currency = fx.requested_currency(request.args.get('currency')) # Stored prices are converted from their own currency
+    granularity = request.args.get('granularity', 'raw').lower() # 'raw' (every collection) or 'day' (daily OHLC rollup)
 
     # --- Basic Validation --- #
     errors = []
-    iata_pattern = re.compile(r"^[A-Za-z]{3}$")
-    if not origin_iata or not iata_pattern.match(origin_iata):
+    if not origin_iata or not airports.IATA_PATTERN.match(origin_iata):
         errors.append("Missing or invalid origin_iata parameter.")
-    if not destination_iata or not iata_pattern.match(destination_iata):
+    if not destination_iata or not airports.IATA_PATTERN.match(destination_iata):
         errors.append("Missing or invalid destination_iata parameter.")
     if direction not in ['outbound', 'inbound']:
         errors.append("Invalid direction parameter. Use 'outbound' or 'inbound'.")
+    if granularity not in ['raw', 'day']:
+        errors.append("Invalid granularity parameter. Use 'raw' or 'day'.")
     
     try:
         departure_date_obj = datetime.strptime(departure_date_str, '%Y-%m-%d').date()
@@ -1067,37 +1842,55 @@ def api_price_history():
 
     print(f"API Req: History for {query_origin}->{query_destination} on {departure_date_str}")
 
-    # --- Query Supabase --- #
+    # --- Query Supabase (through the history cache) --- #
     try:
-        query = supabase.table('price_history')\
-            .select('collected_at, price')\
-            .eq('origin_iata', query_origin)\
-            .eq('destination_iata', query_destination)\
-            .eq('departure_date', departure_date_str)\
-            .order('collected_at', desc=False)
-            # .limit(1000) # Optional: Limit results if needed
-        
-        results = query.execute()
-
-        # Supabase Python client v2 returns an APIResponse object
-        # Access data via response.data
-        data = results.data
-        
+        if granularity == 'day':
+            bars = fx.convert_records(
+                history_store.daily_rollup(supabase, query_origin, query_destination, departure_date_str),
+                ('open', 'low', 'high', 'close'), currency)
+            if bars:
+                return jsonify({
+                    "labels": [bar['day'] for bar in bars],
+                    "prices": [bar['close'] for bar in bars], # Same shape as raw: the day's last price
+                    "open": [bar['open'] for bar in bars],
+                    "low": [bar['low'] for bar in bars],
+                    "high": [bar['high'] for bar in bars],
+                    "samples": [bar['samples'] for bar in bars],
+                    "granularity": granularity,
+                    "currency": currency,
+                })
+            return jsonify({"labels": [], "prices": [], "granularity": granularity, "currency": currency,
+                            "message": "No historical data found for these criteria."}), 200
+
+        data = history_store.price_rows(supabase, query_origin, query_destination, departure_date_str)
+
         if data:
              # Prepare data for Chart.js (labels = timestamps, data = prices)
              labels = [item['collected_at'] for item in data]
-             prices = [item['price'] for item in data]
-             return jsonify({"labels": labels, "prices": prices})
+             prices = [item['price'] for item in fx.convert_records(data, ('price',), currency)]
+             return jsonify({"labels": labels, "prices": prices, "granularity": granularity, "currency": currency})
         else:
-             return jsonify({"labels": [], "prices": [], "message": "No historical data found for these criteria."}), 200
+             return jsonify({"labels": [], "prices": [], "granularity": granularity, "currency": currency, "message": "No historical data found for these criteria."}), 200
 
     except Exception as e:
         print(f"Error querying Supabase for price history: {e}")
         return jsonify({"error": "Database query failed"}), 500
 
+# === API Route for Airport Autocomplete ===
+
+@bp.route('/api/airports')
+def api_airports():
+    """Prefix search over the airport index by code, name or city: /api/airports?q=bar"""
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    return jsonify(airports.get_index().search(query, limit=limit))
+
 # === Route for Price Trend Visualization ===
 
-@app.route('/price_trends')
+@bp.route('/price_trends')
 def price_trends():
     # Just render the form template. Data loading and chart rendering happens via JavaScript.
     today = date.today()
@@ -1108,12 +1901,95 @@ def price_trends():
         'origin_iata': request.args.get('origin_iata', 'SOF'),
         'destination_iata': request.args.get('destination_iata', 'BCN'),
         'departure_date': request.args.get('departure_date', default_date),
-        'direction': request.args.get('direction', 'outbound')
+        'direction': request.args.get('direction', 'outbound'),
+        'granularity': request.args.get('granularity', 'day')
     }
     return render_template('price_trends.html', form_data=form_data, now=datetime.utcnow())
 
+# === Admin: Profiling ===
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') # Admin endpoints are disabled (404) without it
+
+def admin_authorized():
+    if not ADMIN_TOKEN:
+        return False
+    supplied = request.headers.get('X-Admin-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        supplied = authorization[len('Bearer '):]
+    return hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+@bp.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """POST starts a sampling profile of this worker; GET returns the last one."""
+    if not ADMIN_TOKEN:
+        return Response('Not Found', status=404, mimetype='text/plain')
+    if not admin_authorized():
+        return Response('Unauthorized', status=401, mimetype='text/plain')
+    if request.method == 'POST':
+        seconds = request.args.get('seconds', 5, type=float)
+        interval_ms = request.args.get('interval_ms', 10, type=float)
+        # Sampled in a background thread: a sync worker can't serve requests while this one waits
+        if not profiling.capture_profile(seconds, interval_ms):
+            return jsonify({'error': 'A profile capture is already running.'}), 409
+        return jsonify({'status': 'started', 'seconds': min(seconds, profiling.PROFILE_MAX_SECONDS),
+                        'pid': os.getpid(), 'result': url_for('main.admin_profile')}), 202
+    if profiling.profile_running():
+        return Response('Profile capture still running.\n', status=202, mimetype='text/plain')
+    report = profiling.profile_report(request.args.get('format', 'text'), request.args.get('top', 40, type=int))
+    if report is None:
+        return Response('No profile captured yet; POST to start one.\n', status=404, mimetype='text/plain')
+    return Response(report, mimetype='text/plain')
+
+@bp.route('/admin/traces')
+def admin_traces():
+    """The most recent request and job traces of this worker, newest first."""
+    if not ADMIN_TOKEN:
+        return Response('Not Found', status=404, mimetype='text/plain')
+    if not admin_authorized():
+        return Response('Unauthorized', status=401, mimetype='text/plain')
+    return jsonify({'pid': os.getpid(), 'traces': profiling.recent_traces()})
+
+# === App Factory ===
+
+def create_app():
+    """Creates the Flask app. Supabase, mail and the scheduler are initialized lazily on first use."""
+    flask_app = Flask(__name__)
+    flask_app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default-fallback-secret-key') # Use env var for secret key
+
+    # --- Flask-Mail Configuration ---
+    # IMPORTANT: Set these as environment variables for security!
+    flask_app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER') # e.g., 'smtp.gmail.com'
+    flask_app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587)) # e.g., 587 (TLS) or 465 (SSL)
+    flask_app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
+    flask_app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
+    flask_app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME') # Your email address
+    flask_app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD') # Your email password or App Password
+    flask_app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', flask_app.config['MAIL_USERNAME']) # Usually same as username
+
+    flask_app.register_blueprint(bp)
+    profiling.connect_template_signals(flask_app) # 'render' spans for traced requests
+
+    # --- Alert Rule Matching ---
+    # Every fresh upstream response (searches, scheduler polls, history collection) is matched against the rules
+    rule_index.matcher.load_rules(load_notification_rules())
+    fare_client.add_response_listener(rule_index.matcher.on_response)
+
+    # --- Fare Cache Warm-up ---
+    if os.environ.get('FARE_CACHE_WARM_FROM_CAPTURE', 'false').lower() == 'true':
+        print(f"Fare cache warmed with {fare_client.warm_cache_from_capture()} captured responses.")
+    if STATE_SNAPSHOT_ENABLED:
+        state_snapshot.restore_in_background(background_deal_findings, lock=background_deal_findings_lock)
+
+    return flask_app
+
+# Module-level app for gunicorn (app:app)
+app = create_app()
+
 # === Main Execution ===
 if __name__ == '__main__':
+    if SCHEDULER_ENABLED:
+        start_scheduler(app)
     # Note: Flask's default reloader might interfere with APScheduler.
     # Consider running with app.run(debug=True, use_reloader=False) if issues arise during development.
     app.run(debug=True, use_reloader=False) 
\ No newline at end of file
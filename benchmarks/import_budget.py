@@ -0,0 +1,76 @@
+"""
+Import-time budget check for app.py.
+
+Imports the app in a fresh interpreter with -X importtime and fails if the
+import takes longer than the budget, or if subsystems that are supposed to be
+initialized lazily (Supabase, Flask-Mail, APScheduler) were pulled in.
+
+Usage:
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --budget-ms 800
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages that must not be imported just by importing the app
+LAZY_MODULES = ("supabase", "flask_mail", "apscheduler")
+
+_PROBE = "import json, sys; import app; print(json.dumps(sorted(sys.modules)))"
+
+
+def measure_import(env=None):
+    """Returns (total_import_us_for_app, [(cumulative_us, module)], loaded_module_names)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE],
+                            cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True)
+    timings = []
+    app_total_us = 0
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:].rstrip() # Keep the indentation that marks nested imports
+        timings.append((int(cumulative), name))
+        if name == "app":
+            app_total_us = int(cumulative)
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return app_total_us, timings, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import-time budget of app.py.')
+    parser.add_argument('--budget-ms', type=float, default=750.0, help='Maximum cumulative import time of app.')
+    parser.add_argument('--top', type=int, default=10, help='Show the N slowest top-level imports.')
+    args = parser.parse_args()
+
+    env = dict(os.environ, SCHEDULER_ENABLED='false', STATE_SNAPSHOT_ENABLED='false')
+    app_total_us, timings, loaded = measure_import(env)
+
+    # Direct imports of app.py are indented one level (two spaces) in -X importtime output
+    direct = [(us, name.strip()) for us, name in timings if name.startswith('  ') and not name.startswith('    ')]
+    print(f"app import: {app_total_us / 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print("Slowest direct imports of app:")
+    for cumulative_us, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if app_total_us / 1000 > args.budget_ms:
+        failures.append(f"app import took {app_total_us / 1000:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    eager = sorted({name.split('.')[0] for name in loaded} & set(LAZY_MODULES))
+    if eager:
+        failures.append(f"lazily initialized subsystems imported at startup: {', '.join(eager)}")
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK: import budget met and lazy subsystems not loaded.")
+
+
+if __name__ == '__main__':
+    main()
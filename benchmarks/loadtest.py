@@ -0,0 +1,430 @@
+"""
+Load test: the real app under gunicorn against the local farfnd stand-in.
+
+Starts benchmarks/mock_farfnd.py and gunicorn (benchmarks/loadtest_app.py,
+which swaps Supabase for a seeded in-memory store) on free local ports, then
+runs closed-loop virtual users in stages of increasing concurrency. Each user
+repeatedly picks a weighted scenario:
+  - search:     POST /search for a random destination and month
+  - deals:      GET /sofia_deals
+  - multi:      POST /multi_round_trip across several origins/destinations
+  - trends:     GET /price_trends, then /api/price_history (raw or daily)
+  - rules:      list, create and delete notification rules
+
+Reports throughput, error rate and p50/p95/p99 latency per stage and request
+type, and the concurrency at which throughput stops growing (the workers are
+saturated). Results can be saved and compared across commits like
+benchmarks/run.py.
+
+Usage:
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --users 1 4 8 16 --stage-seconds 20 --workers 2 --threads 4
+    python -m benchmarks.loadtest --mix search=1 deals=1 --latency-ms 150
+    python -m benchmarks.loadtest --json load.json
+    python -m benchmarks.loadtest --compare load.json --max-regression 0.3
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+# Allow running as a script from the repository root as well as with -m
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks import mock_farfnd
+from benchmarks.run import _percentile
+
+DESTINATIONS = ["BCN", "MAD", "BGY"] # Also the routes seeded with price history
+MULTI_ORIGINS = ["SOF", "VAR"]
+MULTI_DESTINATIONS = ["BCN", "MAD", "BGY", "STN", "DUB"]
+DEFAULT_MIX = {'search': 35, 'deals': 15, 'multi': 10, 'trends': 25, 'rules': 15}
+SATURATION_GAIN = 0.10 # Throughput growth below this from one stage to the next counts as saturated
+
+_RULE_ID_PATTERN = re.compile(r'name="rule_id" value="([^"]+)"')
+_OWNER_IDS = itertools.count(1) # One rule owner per virtual user, unique across stages
+
+
+def _months(count=3):
+    first = date.today().replace(day=1)
+    months = []
+    for _ in range(count):
+        first = (first + timedelta(days=32)).replace(day=1)
+        months.append(first.strftime('%Y-%m'))
+    return months
+
+
+class Recorder:
+    """Latencies and failures per request type for one stage, shared by its users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {} # label -> [seconds]
+        self.errors = {} # label -> count
+        self.error_samples = {} # label -> first error message
+
+    def record(self, label, seconds, error=None):
+        with self.lock:
+            self.timings.setdefault(label, []).append(seconds)
+            if error is not None:
+                self.errors[label] = self.errors.get(label, 0) + 1
+                self.error_samples.setdefault(label, error)
+
+
+class AppClient:
+    """One virtual user's keep-alive connection to the app; every request is timed into the recorder."""
+
+    def __init__(self, host, port, recorder, timeout):
+        self.host = host
+        self.port = port
+        self.recorder = recorder
+        self.timeout = timeout
+        self._connection = None
+        self.owner = f"loadtest-{next(_OWNER_IDS)}@example.com" # Notification rules are listed per owner
+        self.cookies = {} # The session cookie keeps the owner's rules unlocked
+
+    def request(self, label, method, path, params=None, form=None, expect=(200,)):
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        body = urlencode(form, doseq=True) if form is not None else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body is not None else {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+        start = time.perf_counter()
+        error = None
+        text = ''
+        try:
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._connection.request(method, path, body=body, headers=headers)
+            response = self._connection.getresponse()
+            text = response.read().decode('utf-8', errors='replace')
+            for header in response.msg.get_all('Set-Cookie') or []:
+                self.cookies.update((name, morsel.value) for name, morsel in SimpleCookie(header).items())
+            if response.status not in expect:
+                error = f"HTTP {response.status}"
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+        except (OSError, http.client.HTTPException) as e:
+            error = f"{type(e).__name__}: {e}"
+            self.close()
+        self.recorder.record(label, time.perf_counter() - start, error)
+        return text if error is None else None
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def build_scenarios():
+    """Returns scenario name -> callable(client, rng)."""
+    months = _months()
+
+    def search(client, rng):
+        client.request('search', 'POST', '/search', form={
+            'origin_iata': 'SOF',
+            'destination_iata': rng.choice(DESTINATIONS + MULTI_DESTINATIONS[3:]),
+            'outbound_month': rng.choice(months),
+            'duration_from': '2',
+            'duration_to': str(rng.randint(4, 9)),
+        })
+
+    def deals(client, rng):
+        client.request('sofia_deals', 'GET', '/sofia_deals', params={
+            'outbound_month': rng.choice(months), 'duration_from': '2', 'duration_to': '7',
+        })
+
+    def multi(client, rng):
+        client.request('multi_round_trip', 'POST', '/multi_round_trip', form={
+            'origin_iatas': "\n".join(MULTI_ORIGINS),
+            'destination_iatas': "\n".join(MULTI_DESTINATIONS),
+            'outbound_month': rng.choice(months),
+            'duration_from': '2',
+            'duration_to': '7',
+        })
+
+    def trends(client, rng):
+        destination = rng.choice(DESTINATIONS)
+        departure_date = (date.today() + timedelta(days=rng.randint(0, 59))).isoformat()
+        client.request('price_trends', 'GET', '/price_trends', params={
+            'origin_iata': 'SOF', 'destination_iata': destination, 'departure_date': departure_date,
+        })
+        client.request('price_history_api', 'GET', '/api/price_history', params={
+            'origin_iata': 'SOF',
+            'destination_iata': destination,
+            'departure_date': departure_date,
+            'direction': rng.choice(['outbound', 'inbound']),
+            'granularity': rng.choice(['raw', 'day']),
+        })
+
+    def rules(client, rng):
+        page = client.request('rules_list', 'GET', '/configure_notifications')
+        client.request('rule_create', 'POST', '/configure_notifications', form={
+            'owner': client.owner,
+            'origin_iata': 'SOF',
+            'destination_iata': rng.choice(DESTINATIONS),
+            'outbound_month': rng.choice(months),
+            'duration_from': '2',
+            'duration_to': '7',
+            'threshold': str(rng.randint(20, 80)),
+        }, expect=(302,)) # 200 re-renders the form with validation errors
+        # Delete one of the owner's listed rules so the rule file stays small over a long run
+        rule_ids = _RULE_ID_PATTERN.findall(page or '')
+        if rule_ids:
+            client.request('rule_delete', 'POST', '/delete_notification_rule',
+                           form={'rule_id': rng.choice(rule_ids)}, expect=(302,))
+
+    return {'search': search, 'deals': deals, 'multi': multi, 'trends': trends, 'rules': rules}
+
+
+def run_stage(host, port, users, seconds, scenarios, mix, think_ms, seed, timeout):
+    """Runs users closed-loop virtual users for seconds; returns the stage's Recorder and its wall time."""
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.perf_counter() + seconds
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index) # Same request sequence per user on every run
+        client = AppClient(host, port, recorder, timeout)
+        try:
+            while time.perf_counter() < deadline:
+                scenarios[rng.choices(names, weights)[0]](client, rng)
+                if think_ms:
+                    time.sleep(rng.expovariate(1000.0 / think_ms))
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=user, args=(index,), name=f'loadtest-user-{index}', daemon=True)
+               for index in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def summarize(timings, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'error_rate': errors / len(timings) if timings else 0.0,
+        'throughput_per_s': len(timings) / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(timings, 0.50) * 1000,
+        'p95_ms': _percentile(timings, 0.95) * 1000,
+        'p99_ms': _percentile(timings, 0.99) * 1000,
+    }
+
+
+def stage_result(users, recorder, elapsed):
+    all_timings = [seconds for timings in recorder.timings.values() for seconds in timings]
+    result = summarize(all_timings, sum(recorder.errors.values()), elapsed)
+    result['users'] = users
+    result['requests_by_type'] = {label: summarize(timings, recorder.errors.get(label, 0), elapsed)
+                                  for label, timings in sorted(recorder.timings.items())}
+    result['error_samples'] = dict(recorder.error_samples)
+    return result
+
+
+def saturation_point(stages):
+    """Users of the last stage before throughput stopped growing by SATURATION_GAIN, or None."""
+    for previous, stage in zip(stages, stages[1:]):
+        if previous['throughput_per_s'] and stage['throughput_per_s'] < previous['throughput_per_s'] * (1 + SATURATION_GAIN):
+            return previous['users']
+    return None
+
+
+def print_report(stages, settings, mock_config):
+    print(f"\nLoad test: {settings['workers']} gunicorn worker(s) x {settings['threads']} thread(s), "
+          f"upstream latency {settings['latency_ms']} ms, {settings['stage_seconds']}s per stage")
+    print(f"\n{'users':>6}{'req/s':>9}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("-" * 54)
+    for stage in stages:
+        print(f"{stage['users']:>6}{stage['throughput_per_s']:>9.1f}{stage['error_rate']:>9.1%}"
+              f"{stage['p50_ms']:>10.1f}{stage['p95_ms']:>10.1f}{stage['p99_ms']:>10.1f}")
+
+    for stage in stages:
+        print(f"\n{stage['users']} user(s):")
+        print(f"  {'request':<20}{'count':>7}{'req/s':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for label, result in stage['requests_by_type'].items():
+            print(f"  {label:<20}{result['requests']:>7}{result['throughput_per_s']:>9.1f}{result['errors']:>8}"
+                  f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+        for label, message in stage['error_samples'].items():
+            print(f"  first {label} error: {message}")
+
+    print("-" * 54)
+    saturated_at = saturation_point(stages)
+    if saturated_at is not None:
+        print(f"Throughput stops growing beyond {saturated_at} concurrent user(s).")
+    elif len(stages) > 1:
+        print("Throughput still grew at the highest concurrency tested.")
+    print(f"Upstream requests served by mock: {mock_config.request_count} ({mock_config.error_count} injected errors)")
+
+
+def compare_to_baseline(stages, baseline_path, max_regression):
+    """Regression messages for stages (matched by users) whose throughput fell or p95 rose beyond the allowed ratio."""
+    with open(baseline_path) as f:
+        baseline = {stage['users']: stage for stage in json.load(f).get('stages', [])}
+    regressions = []
+    for stage in stages:
+        previous = baseline.get(stage['users'])
+        if not previous:
+            continue
+        if previous['throughput_per_s'] and stage['throughput_per_s'] < previous['throughput_per_s'] * (1 - max_regression):
+            regressions.append(f"{stage['users']} users: {previous['throughput_per_s']:.1f} -> "
+                               f"{stage['throughput_per_s']:.1f} req/s")
+        if previous['p95_ms'] and stage['p95_ms'] > previous['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{stage['users']} users: p95 {previous['p95_ms']:.1f} ms -> {stage['p95_ms']:.1f} ms")
+        if stage['error_rate'] > previous['error_rate'] + 0.01:
+            regressions.append(f"{stage['users']} users: errors {previous['error_rate']:.1%} -> {stage['error_rate']:.1%}")
+    return regressions
+
+
+def _wait_until_ready(host, port, process, log_path, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=5)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    with open(log_path, errors='replace') as f:
+        tail = f.read()[-3000:]
+    raise RuntimeError(f"gunicorn did not become ready (log {log_path}):\n{tail}")
+
+
+def start_gunicorn(host, port, api_base, args, work_dir, log_file):
+    """Starts the app under gunicorn in work_dir (where it keeps its notification rules file)."""
+    env = dict(os.environ,
+               RYANAIR_API_BASE=api_base,
+               SCHEDULER_ENABLED='false', # Background jobs would compete for the same workers
+               STATE_SNAPSHOT_ENABLED='false', # Every run starts cold
+               LOADTEST_DESTINATIONS=','.join(DESTINATIONS),
+               PYTHONUNBUFFERED='1')
+    if not args.cache:
+        env['FARE_CACHE_TTL_SECONDS'] = '0'
+        env['PAGE_CACHE_ENABLED'] = 'false'
+    command = [sys.executable, '-m', 'gunicorn', 'benchmarks.loadtest_app:app',
+               '--bind', f'{host}:{port}',
+               '--workers', str(args.workers),
+               '--threads', str(args.threads),
+               '--timeout', str(int(args.timeout) + 30),
+               '--chdir', work_dir,
+               '--pythonpath', REPO_ROOT,
+               '--log-level', 'warning']
+    return subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def parse_mix(values):
+    mix = dict(DEFAULT_MIX)
+    if values:
+        mix = {}
+        for value in values:
+            name, _, weight = value.partition('=')
+            if name not in DEFAULT_MIX:
+                raise ValueError(f"Unknown scenario '{name}' (choose from {', '.join(DEFAULT_MIX)})")
+            mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the app under gunicorn against a local farfnd stand-in.')
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 4, 8, 16], help='Concurrent users per stage.')
+    parser.add_argument('--stage-seconds', type=float, default=15.0)
+    parser.add_argument('--warmup-seconds', type=float, default=3.0, help='Unrecorded run before the first stage.')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='Mean pause between a user\'s scenarios.')
+    parser.add_argument('--mix', nargs='*', help=f"Scenario weights as name=weight (default: "
+                                                 f"{' '.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items())}).")
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes.')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker (1 = sync worker).')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Client timeout per request in seconds.')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Simulated upstream latency.')
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fares', type=int, default=50, help='Fares per roundTripFares response.')
+    parser.add_argument('--cache', action='store_true', help='Keep the fare and page caches enabled (disabled by default).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Baseline JSON from a previous --json run.')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Allowed throughput drop or p95 rise vs. baseline before failing (0.25 = 25%%).')
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    host = '127.0.0.1'
+    mock_port = mock_farfnd.find_free_port(host)
+    mock_config = mock_farfnd.MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                         error_rate=args.error_rate, fares_per_response=args.fares, seed=args.seed)
+    server, api_base = mock_farfnd.start_in_background(mock_config, host=host, port=mock_port)
+
+    work_dir = tempfile.mkdtemp(prefix='loadtest-')
+    log_path = os.path.join(work_dir, 'gunicorn.log')
+    app_port = mock_farfnd.find_free_port(host)
+    with open(log_path, 'w') as log_file:
+        process = start_gunicorn(host, app_port, api_base, args, work_dir, log_file)
+    try:
+        _wait_until_ready(host, app_port, process, log_path)
+        print(f"App under gunicorn at http://{host}:{app_port} (pid {process.pid}), mock farfnd API at {api_base}")
+        scenarios = build_scenarios()
+        if args.warmup_seconds > 0:
+            print(f"Warming up for {args.warmup_seconds}s...", flush=True)
+            run_stage(host, app_port, max(args.users), args.warmup_seconds, scenarios, mix, args.think_ms, args.seed + 1, args.timeout)
+
+        stages = []
+        for users in args.users:
+            print(f"Running {users} user(s) for {args.stage_seconds}s...", flush=True)
+            recorder, elapsed = run_stage(host, app_port, users, args.stage_seconds, scenarios, mix,
+                                          args.think_ms, args.seed, args.timeout)
+            stages.append(stage_result(users, recorder, elapsed))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server.shutdown()
+
+    settings = dict(vars(args), mix=mix)
+    print_report(stages, settings, mock_config)
+    print(f"App log: {log_path}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'settings': settings, 'stages': stages,
+                       'saturated_at_users': saturation_point(stages)}, f, indent=4)
+        print(f"Results written to {args.json_path}")
+
+    if args.compare:
+        regressions = compare_to_baseline(stages, args.compare, args.max_regression)
+        if regressions:
+            print("\nLoad test regressions vs. baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.max_regression:.0%} vs. {args.compare}.")
+
+
+if __name__ == '__main__':
+    main()
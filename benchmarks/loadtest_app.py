@@ -0,0 +1,52 @@
+"""
+Gunicorn entry point for the load test (benchmarks/loadtest.py).
+
+Imports the real app, swaps Supabase for the in-memory stand-in seeded with a
+few weeks of price history for the load test routes (so the trends API has
+data to serve) and disables notification mail. Each gunicorn worker imports
+this module, so each has its own copy of the seeded history.
+
+    gunicorn --pythonpath /path/to/repo benchmarks.loadtest_app:app
+"""
+import os
+import random
+from datetime import date, datetime, time, timedelta, timezone
+
+import app as app_module
+from benchmarks.run import InMemorySupabase
+
+HISTORY_ROUTES = [('SOF', destination) for destination in os.environ.get('LOADTEST_DESTINATIONS', 'BCN,MAD,BGY').split(',')]
+HISTORY_DAYS = 21 # Collection days seeded per departure date
+HISTORY_DEPARTURE_DAYS = 60 # Departure dates seeded from today
+
+
+def seed_price_history(supabase, today=None):
+    """Synthetic daily collections (one per day, random walk) for every route and departure date, both directions."""
+    today = today or date.today()
+    rng = random.Random(0)
+    rows = supabase.rows.setdefault('price_history', [])
+    for origin, destination in HISTORY_ROUTES:
+        for orig, dest in ((origin, destination), (destination, origin)):
+            for offset in range(HISTORY_DEPARTURE_DAYS):
+                departure_date = (today + timedelta(days=offset)).isoformat()
+                price = rng.uniform(20, 120)
+                for day in range(HISTORY_DAYS, 0, -1):
+                    price = max(9.99, round(price * rng.uniform(0.9, 1.1), 2))
+                    collected_at = datetime.combine(today - timedelta(days=day), time(6), tzinfo=timezone.utc)
+                    rows.append({
+                        'origin_iata': orig,
+                        'destination_iata': dest,
+                        'departure_date': departure_date,
+                        'price': price,
+                        'currency': 'EUR',
+                        'collected_at': collected_at.isoformat(),
+                    })
+    return len(rows)
+
+
+supabase = InMemorySupabase()
+seed_price_history(supabase)
+app_module.get_supabase = lambda: supabase
+app_module.MAIL_RECIPIENT = None # Never send mail from load tests
+
+app = app_module.app
@@ -0,0 +1,234 @@
+"""
+Local stand-in for the Ryanair farfnd API.
+
+Serves roundTripFares and cheapestPerDay responses with configurable latency
+and error rate so the app can be exercised without touching the live API.
+Responses are synthetic (deterministic per query) unless a fixtures directory
+with recorded payloads or a fare client capture log (FARE_CLIENT_MODE=capture)
+is given; captured responses are replayed for the exact queries they recorded.
+
+Usage:
+    python -m benchmarks.mock_farfnd --port 8765 --latency-ms 150 --error-rate 0.02
+    RYANAIR_API_BASE=http://127.0.0.1:8765/api/farfnd/v4 python app.py
+"""
+import argparse
+import calendar
+import json
+import os
+import random
+import socket
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+API_PREFIX = '/api/farfnd/v4'
+
+
+class MockConfig:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, fares_per_response=50,
+                 fixtures_dir=None, capture_path=None, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.fares_per_response = fares_per_response
+        self.seed = seed
+        self.fixtures = _load_fixtures(fixtures_dir) if fixtures_dir else {}
+        self.recorded = _load_capture(capture_path) if capture_path else {}
+        self.request_count = 0
+        self.error_count = 0
+        self.lock = threading.Lock()
+
+
+def _load_fixtures(fixtures_dir):
+    """Loads recorded payloads named roundTripFares.json / cheapestPerDay.json."""
+    fixtures = {}
+    for endpoint in ('roundTripFares', 'cheapestPerDay'):
+        path = os.path.join(fixtures_dir, f'{endpoint}.json')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                fixtures[endpoint] = f.read()
+    return fixtures
+
+
+def _load_capture(capture_path):
+    # Imported lazily: fare_client reads RYANAIR_API_BASE at import time
+    import fare_client
+    return fare_client.load_capture(capture_path)
+
+
+def _rng_for(config, key):
+    # Deterministic per query so repeated runs see identical payloads
+    return random.Random(zlib.crc32(key.encode()) ^ config.seed)
+
+
+def _leg(origin, destination, departure, rng, price):
+    arrival = departure + timedelta(minutes=rng.randint(60, 240))
+    return {
+        'departureAirport': {'iataCode': origin, 'name': origin},
+        'arrivalAirport': {'iataCode': destination, 'name': destination},
+        'departureDate': departure.strftime('%Y-%m-%dT%H:%M:%S'),
+        'arrivalDate': arrival.strftime('%Y-%m-%dT%H:%M:%S'),
+        'price': {'value': price, 'valueMainUnit': str(int(price)), 'currencyCode': 'EUR'},
+        'flightNumber': f"FR{rng.randint(100, 9999)}",
+    }
+
+
+def synthetic_round_trip(config, query):
+    origin = query['departureAirportIataCode']
+    destination = query['arrivalAirportIataCode']
+    out_from = date.fromisoformat(query['outboundDepartureDateFrom'])
+    out_to = date.fromisoformat(query['outboundDepartureDateTo'])
+    duration_from = int(query.get('durationFrom', 2))
+    duration_to = int(query.get('durationTo', 7))
+    rng = _rng_for(config, f"rt|{origin}|{destination}|{out_from}|{out_to}|{duration_from}|{duration_to}")
+
+    days = max((out_to - out_from).days + 1, 1)
+    fares = []
+    for _ in range(config.fares_per_response):
+        out_day = out_from + timedelta(days=rng.randrange(days))
+        out_dt = datetime(out_day.year, out_day.month, out_day.day, rng.randint(6, 21), rng.choice((0, 15, 30, 45)))
+        in_dt = out_dt + timedelta(days=rng.randint(duration_from, max(duration_from, duration_to)), hours=rng.randint(-4, 4))
+        out_price = round(rng.uniform(9.99, 150), 2)
+        in_price = round(rng.uniform(9.99, 150), 2)
+        fares.append({
+            'outbound': _leg(origin, destination, out_dt, rng, out_price),
+            'inbound': _leg(destination, origin, in_dt, rng, in_price),
+            'summary': {'price': {'value': round(out_price + in_price, 2), 'currencyCode': 'EUR'},
+                        'tripDurationDays': (in_dt.date() - out_dt.date()).days},
+        })
+    fares.sort(key=lambda fare: fare['summary']['price']['value'])
+    return {'arrivalAirportCategories': None, 'fares': fares, 'nextPage': None, 'size': len(fares)}
+
+
+def synthetic_cheapest_per_day(config, origin, destination, query):
+    month_date = date.fromisoformat(query['outboundMonthOfDate'])
+    rng = _rng_for(config, f"ow|{origin}|{destination}|{month_date:%Y-%m}")
+    days_in_month = calendar.monthrange(month_date.year, month_date.month)[1]
+    fares = []
+    for day in range(1, days_in_month + 1):
+        day_date = month_date.replace(day=day)
+        unavailable = rng.random() < 0.15
+        fares.append({
+            'day': day_date.isoformat(),
+            'arrivalDate': None if unavailable else f"{day_date.isoformat()}T10:30:00",
+            'departureDate': None if unavailable else f"{day_date.isoformat()}T08:00:00",
+            'price': None if unavailable else {'value': round(rng.uniform(9.99, 120), 2), 'currencyCode': 'EUR'},
+            'soldOut': False,
+            'unavailable': unavailable,
+        })
+    return {'outbound': {'fares': fares, 'minFare': None, 'maxFare': None}}
+
+
+class MockFarfndHandler(BaseHTTPRequestHandler):
+    server_version = 'MockFarfnd/1.0'
+    config = None # Set per server in make_server()
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output clean
+
+    def _send(self, status, body):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        config = self.config
+        with config.lock:
+            config.request_count += 1
+
+        delay_ms = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+
+        if config.error_rate and random.random() < config.error_rate:
+            with config.lock:
+                config.error_count += 1
+            return self._send(503, {'message': 'Service temporarily unavailable (mock)'})
+
+        recorded = config.recorded.get(self.path[len(API_PREFIX):] if self.path.startswith(API_PREFIX) else self.path)
+        if recorded is not None:
+            return self._send(recorded['status'], recorded['body'])
+
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        path = parts.path[len(API_PREFIX):] if parts.path.startswith(API_PREFIX) else parts.path
+        segments = [segment for segment in path.split('/') if segment]
+
+        try:
+            if segments == ['roundTripFares']:
+                if 'roundTripFares' in config.fixtures:
+                    return self._send(200, config.fixtures['roundTripFares'])
+                return self._send(200, synthetic_round_trip(config, query))
+            if len(segments) == 4 and segments[0] == 'oneWayFares' and segments[3] == 'cheapestPerDay':
+                if 'cheapestPerDay' in config.fixtures:
+                    return self._send(200, config.fixtures['cheapestPerDay'])
+                return self._send(200, synthetic_cheapest_per_day(config, segments[1], segments[2], query))
+        except (KeyError, ValueError) as e:
+            return self._send(400, {'message': f'Invalid query: {e}'})
+        return self._send(404, {'message': f'Unknown endpoint {parts.path}'})
+
+
+class MockFarfndServer(ThreadingHTTPServer):
+    # The default listen backlog (5) overflows under parallel fan-out and the
+    # dropped connects are retried after ~1s, which would dominate latencies
+    request_queue_size = 128
+
+
+def make_server(config, host='127.0.0.1', port=0):
+    """Creates (but does not start) a threaded mock server. Port 0 picks a free port."""
+    handler = type('ConfiguredMockFarfndHandler', (MockFarfndHandler,), {'config': config})
+    server = MockFarfndServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def find_free_port(host='127.0.0.1'):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_in_background(config, host='127.0.0.1', port=0):
+    """Starts the mock server on a daemon thread and returns (server, api_base_url)."""
+    server = make_server(config, host, port)
+    thread = threading.Thread(target=server.serve_forever, name='mock-farfnd', daemon=True)
+    thread.start()
+    api_base = f"http://{server.server_address[0]}:{server.server_address[1]}{API_PREFIX}"
+    return server, api_base
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Ryanair farfnd API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mean added latency per response.')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Uniform +/- jitter around the latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    parser.add_argument('--fares', type=int, default=50, help='Fares per synthetic roundTripFares response.')
+    parser.add_argument('--fixtures', help='Directory with recorded roundTripFares.json / cheapestPerDay.json.')
+    parser.add_argument('--capture', help='Fare client capture log (JSONL) to replay recorded responses from.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                        fares_per_response=args.fares, fixtures_dir=args.fixtures,
+                        capture_path=args.capture, seed=args.seed)
+    server = make_server(config, args.host, args.port)
+    print(f"Mock farfnd API listening on http://{args.host}:{args.port}{API_PREFIX}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Offline benchmark suite.
+
+Starts the local farfnd stand-in (benchmarks/mock_farfnd.py), points the app
+at it and times the hot code paths: the /search, /multi_round_trip and
+/sofia_deals handlers plus the check_notification_rules and
+collect_price_history scheduler jobs. Reports throughput, p50/p99 latency and
+peak Python memory per benchmark.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --latency-ms 50 --iterations 30 --json bench.json
+    python -m benchmarks.run --compare bench.json --max-regression 0.25
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+# Allow running as a script from the repository root as well as with -m
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import mock_farfnd
+
+MULTI_ORIGINS = ["SOF", "VAR"]
+MULTI_DESTINATIONS = ["BCN", "MAD", "BGY", "STN", "DUB"]
+SEARCH_DESTINATIONS = ["BCN", "MAD", "AGP", "VLC", "BGY", "NAP", "BER", "STN"]
+
+
+class InMemorySupabase:
+    """Stand-in for the Supabase client so collect_price_history and the price history API can run offline."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def table(self, name):
+        return _InMemoryTable(self.rows.setdefault(name, []))
+
+
+class _InMemoryResult:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data)
+
+    def __iter__(self):
+        # Unpacks as (data, count) like the client's insert().execute()
+        return iter((self.data, self.count))
+
+
+class _InMemoryTable:
+    """Supports the insert() and select().eq().order() chains the app uses."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._pending = None
+        self._columns = None
+        self._filters = []
+        self._order = None
+
+    def insert(self, records):
+        self._pending = list(records)
+        return self
+
+    def select(self, columns):
+        self._columns = [column.strip() for column in columns.split(',')]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, value))
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def execute(self):
+        if self._pending is not None:
+            collected_at = datetime.now(timezone.utc).isoformat() # The table's column default
+            self._rows.extend({'collected_at': collected_at, **record} for record in self._pending)
+            return _InMemoryResult(self._pending)
+        rows = [row for row in self._rows if all(row.get(column) == value for column, value in self._filters)]
+        if self._order:
+            rows.sort(key=lambda row: row.get(self._order[0]), reverse=self._order[1])
+        if self._columns and self._columns != ['*']:
+            rows = [{column: row.get(column) for column in self._columns} for row in rows]
+        return _InMemoryResult(rows)
+
+
+def _next_month():
+    return (date.today().replace(day=1) + timedelta(days=32)).strftime('%Y-%m')
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def build_benchmarks(app_module, client, rules_file):
+    """Returns an ordered dict of benchmark name -> callable(iteration)."""
+    month = _next_month()
+
+    def search(i):
+        response = client.post('/search', data={
+            'origin_iata': 'SOF',
+            'destination_iata': SEARCH_DESTINATIONS[i % len(SEARCH_DESTINATIONS)],
+            'outbound_month': month,
+            'duration_from': '2',
+            'duration_to': '7',
+        })
+        assert response.status_code == 200, response.status_code
+
+    def multi_round_trip(i):
+        response = client.post('/multi_round_trip', data={
+            'origin_iatas': "\n".join(MULTI_ORIGINS),
+            'destination_iatas': "\n".join(MULTI_DESTINATIONS),
+            'outbound_month': month,
+            'duration_from': '2',
+            'duration_to': '7',
+        })
+        assert response.status_code == 200, response.status_code
+
+    def sofia_deals(i):
+        response = client.get('/sofia_deals', query_string={
+            'outbound_month': month, 'duration_from': '2', 'duration_to': '7',
+        })
+        assert response.status_code == 200, response.status_code
+
+    def check_notification_rules(i):
+        app_module.check_notification_rules()
+
+    def collect_price_history(i):
+        # A fresh scheduler makes every tracked route-month due, so each iteration does a full run's work
+        app_module.refresh_scheduler.history_refresh = app_module.refresh_scheduler.RefreshScheduler()
+        app_module.collect_price_history()
+
+    # Rules used by the notification checker benchmark
+    rules = [{
+        'id': f"bench-rule-{n:04d}",
+        'origin_iata': 'SOF',
+        'destination_iata': SEARCH_DESTINATIONS[n % len(SEARCH_DESTINATIONS)],
+        'search_month': month,
+        'duration_from': 2,
+        'duration_to': 7,
+        'threshold': 40.0,
+    } for n in range(10)]
+    with open(rules_file, 'w') as f:
+        json.dump(rules, f)
+
+    return {
+        'search': search,
+        'multi_round_trip': multi_round_trip,
+        'sofia_deals': sofia_deals,
+        'check_notification_rules': check_notification_rules,
+        'collect_price_history': collect_price_history,
+    }
+
+
+def run_benchmark(func, iterations, warmup):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(warmup):
+            func(i)
+
+        timings = []
+        started = time.perf_counter()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            func(i)
+            timings.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+
+        # Separate pass for memory so tracing overhead doesn't skew timings
+        tracemalloc.start()
+        func(0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'throughput_per_s': iterations / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(timings, 0.50) * 1000,
+        'p99_ms': _percentile(timings, 0.99) * 1000,
+        'peak_alloc_kb': peak / 1024,
+    }
+
+
+def print_report(results, mock_config):
+    print(f"\n{'benchmark':<26}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>11}")
+    print("-" * 67)
+    for name, result in results.items():
+        print(f"{name:<26}{result['throughput_per_s']:>10.1f}{result['p50_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['peak_alloc_kb']:>11.0f}")
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("-" * 67)
+    print(f"Max RSS: {max_rss_mb:.1f} MB | upstream requests served by mock: {mock_config.request_count} "
+          f"({mock_config.error_count} injected errors)")
+
+
+def compare_to_baseline(results, baseline_path, max_regression):
+    """Returns a list of regression messages for p50 latency beyond the allowed ratio."""
+    with open(baseline_path) as f:
+        baseline = json.load(f).get('results', {})
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get('p50_ms'):
+            continue
+        ratio = result['p50_ms'] / previous['p50_ms'] - 1
+        if ratio > max_regression:
+            regressions.append(f"{name}: p50 {previous['p50_ms']:.1f} ms -> {result['p50_ms']:.1f} ms (+{ratio:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks against a local farfnd stand-in.')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated upstream latency.')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fares', type=int, default=50, help='Fares per roundTripFares response.')
+    parser.add_argument('--fixtures', help='Directory with recorded payloads for the mock server.')
+    parser.add_argument('--capture', help='Fare client capture log whose recorded responses the mock replays.')
+    parser.add_argument('--cache', action='store_true', help='Keep the fare cache enabled (disabled by default).')
+    parser.add_argument('--only', nargs='*', help='Run only the named benchmarks.')
+    parser.add_argument('--json', dest='json_path', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Baseline JSON from a previous --json run.')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Allowed p50 slowdown vs. baseline before failing (0.25 = 25%%).')
+    args = parser.parse_args()
+
+    # Must be set before fare_client (imported by the app or a capture replay) is loaded
+    port = mock_farfnd.find_free_port()
+    os.environ['RYANAIR_API_BASE'] = f"http://127.0.0.1:{port}{mock_farfnd.API_PREFIX}"
+    os.environ['STATE_SNAPSHOT_ENABLED'] = 'false' # Every run starts cold
+    os.environ['SCHEDULER_ENABLED'] = 'false' # Benchmarks drive the jobs directly
+    if not args.cache:
+        os.environ['FARE_CACHE_TTL_SECONDS'] = '0'
+
+    mock_config = mock_farfnd.MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                         error_rate=args.error_rate, fares_per_response=args.fares,
+                                         fixtures_dir=args.fixtures, capture_path=args.capture)
+    server, api_base = mock_farfnd.start_in_background(mock_config, port=port)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import app as app_module
+
+    rules_dir = tempfile.mkdtemp(prefix='bench-rules-')
+    app_module.NOTIFICATION_RULES_FILE = os.path.join(rules_dir, 'notification_rules.json')
+    in_memory_supabase = InMemorySupabase()
+    app_module.get_supabase = lambda: in_memory_supabase
+    app_module.MAIL_RECIPIENT = None # Never send mail from benchmarks
+
+    client = app_module.app.test_client()
+    benchmarks = build_benchmarks(app_module, client, app_module.NOTIFICATION_RULES_FILE)
+    if args.only:
+        unknown = set(args.only) - set(benchmarks)
+        if unknown:
+            parser.error(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+        benchmarks = {name: func for name, func in benchmarks.items() if name in args.only}
+
+    print(f"Mock farfnd API at {api_base} (latency {args.latency_ms} ms, error rate {args.error_rate})")
+    results = {}
+    for name, func in benchmarks.items():
+        print(f"Running {name}...", flush=True)
+        results[name] = run_benchmark(func, args.iterations, args.warmup)
+
+    server.shutdown()
+    print_report(results, mock_config)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=4)
+        print(f"Results written to {args.json_path}")
+
+    if args.compare:
+        regressions = compare_to_baseline(results, args.compare, args.max_regression)
+        if regressions:
+            print("\nPerformance regressions vs. baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.max_regression:.0%} vs. {args.compare}.")
+
+
+if __name__ == '__main__':
+    main()
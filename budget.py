@@ -0,0 +1,120 @@
+"""
+Fare-count and payload budgets for web requests and background jobs.
+
+Every upstream response a request or job pulls in through fare_client is
+charged against its budget: the number of fares it holds and the bytes it
+was sent as (the bulk of the memory a search needs). Once either limit is
+reached the budget is exhausted: fare_client refuses further fetches with
+BudgetExceeded and the aggregation loops stop early, keeping the results
+collected so far. Single responses over FARE_RESPONSE_MAX_BYTES are refused
+while they download (or from their Content-Length), before they are held in
+memory or parsed.
+
+The active budget lives in a context variable, so it follows fetches into
+the fare client's worker threads (see fare_client.fetch_json_many()).
+"""
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+
+import metrics
+
+FARE_BUDGET_PER_REQUEST = int(os.environ.get('FARE_BUDGET_PER_REQUEST', 20000)) # Fares one web request may load
+FARE_BUDGET_PER_JOB = int(os.environ.get('FARE_BUDGET_PER_JOB', 100000)) # Fares one background/scheduler job may load
+PAYLOAD_BUDGET_PER_REQUEST_MB = float(os.environ.get('PAYLOAD_BUDGET_PER_REQUEST_MB', 32))
+PAYLOAD_BUDGET_PER_JOB_MB = float(os.environ.get('PAYLOAD_BUDGET_PER_JOB_MB', 128))
+FARE_RESPONSE_MAX_BYTES = int(os.environ.get('FARE_RESPONSE_MAX_BYTES', 8 * 1024 * 1024)) # Any single upstream response
+
+_current = contextvars.ContextVar('fare_budget', default=None)
+
+
+class BudgetExceeded(Exception):
+    """Raised for fetches attempted after the request's or job's budget ran out."""
+
+
+class ResponseTooLarge(Exception):
+    """Raised for an upstream response larger than FARE_RESPONSE_MAX_BYTES."""
+
+
+class Budget:
+    def __init__(self, scope, max_fares, max_bytes):
+        self.scope = scope # 'request' or 'job', the metric label
+        self.max_fares = max_fares
+        self.max_bytes = max_bytes
+        self.fares = 0
+        self.bytes = 0
+        self.exhausted_by = None # 'fares' or 'bytes' once a limit is reached
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self):
+        return self.exhausted_by is not None
+
+    def charge(self, fares=0, size=0):
+        """Adds a response to the budget. Returns False if this exhausted it."""
+        with self._lock:
+            self.fares += fares
+            self.bytes += size
+            if self.exhausted_by is not None:
+                return False
+            if self.fares > self.max_fares:
+                self.exhausted_by = 'fares'
+            elif self.bytes > self.max_bytes:
+                self.exhausted_by = 'bytes'
+            else:
+                return True
+        metrics.BUDGET_EXHAUSTED.inc(scope=self.scope, resource=self.exhausted_by)
+        print(f"  Fare budget ({self.scope}) exhausted by {self.exhausted_by}: {self.fares} fares, {self.bytes} bytes.")
+        return False
+
+    def check(self):
+        if self.exhausted_by is not None:
+            raise BudgetExceeded(f"The {self.scope} fare budget is used up ({self.fares} fares, {self.bytes} bytes loaded).")
+
+
+def request_budget():
+    return Budget('request', FARE_BUDGET_PER_REQUEST, int(PAYLOAD_BUDGET_PER_REQUEST_MB * 1024 * 1024))
+
+
+def job_budget():
+    return Budget('job', FARE_BUDGET_PER_JOB, int(PAYLOAD_BUDGET_PER_JOB_MB * 1024 * 1024))
+
+
+def current():
+    """The active budget, or None outside limit()."""
+    return _current.get()
+
+
+def exhausted():
+    active = _current.get()
+    return active is not None and active.exhausted
+
+
+@contextlib.contextmanager
+def limit(active_budget):
+    """Makes active_budget the budget for fetches in this context. Yields it."""
+    token = _current.set(active_budget)
+    try:
+        yield active_budget
+    finally:
+        _current.reset(token)
+
+
+def with_request_budget(view):
+    """Decorator running a view under a fresh per-request budget."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with limit(request_budget()):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def with_job_budget(func):
+    """Decorator running a background or scheduler job under a fresh per-job budget."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with limit(job_budget()):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,517 @@
+"""
+Shared client for the Ryanair fare finder (farfnd) API.
+
+All upstream calls go through fetch_json(), which records latency, parse time
+and fare counts per URL template, and keeps a short-lived in-memory cache so
+identical queries issued close together (e.g. a user search and the
+scheduler checking the same rule) only hit the API once.
+
+FARE_CLIENT_MODE selects where responses come from:
+  live    - call the API (default)
+  capture - call the API and append every response to a rotating JSONL log
+  replay  - serve responses from that log only, never touching the network
+"""
+import base64
+import contextlib
+import contextvars
+import hashlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import budget
+import metrics
+import profiling
+
+# --- API Endpoint Templates ---
+# RYANAIR_API_BASE can point at a local stand-in server (see benchmarks/mock_farfnd.py)
+RYANAIR_API_BASE = os.environ.get('RYANAIR_API_BASE', 'https://www.ryanair.com/api/farfnd/v4').rstrip('/')
+ROUND_TRIP_API_TEMPLATE = RYANAIR_API_BASE + "/roundTripFares?departureAirportIataCode={origin_iata}&market=en-gb&adultPaxCount=1&arrivalAirportIataCode={destination_iata}&searchMode=ALL&outboundDepartureDateFrom={out_date_from}&outboundDepartureDateTo={out_date_to}&inboundDepartureDateFrom={in_date_from}&inboundDepartureDateTo={in_date_to}&durationFrom={duration_from}&durationTo={duration_to}&currency={currency}"
+ONE_WAY_MONTH_API_TEMPLATE = RYANAIR_API_BASE + "/oneWayFares/{origin_iata}/{destination_iata}/cheapestPerDay?outboundMonthOfDate={month_date}&currency={currency}"
+
+# Short names used as metric labels
+TEMPLATE_NAMES = {
+    ROUND_TRIP_API_TEMPLATE: 'round_trip',
+    ONE_WAY_MONTH_API_TEMPLATE: 'one_way_month',
+}
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
+}
+
+# --- Connection Pool / Parallel Fetch Configuration ---
+FARE_FETCH_WORKERS = int(os.environ.get('FARE_FETCH_WORKERS', 8)) # Concurrent upstream calls per process
+ITER_FETCH_WINDOW = FARE_FETCH_WORKERS * 2 # Requests iter_fetch_json() keeps in flight or unconsumed
+
+# Shared session so repeated calls reuse TLS connections to the API
+_session = requests.Session()
+_session.headers.update(HEADERS)
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=FARE_FETCH_WORKERS))
+_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=FARE_FETCH_WORKERS))
+
+_fetch_executor = ThreadPoolExecutor(max_workers=FARE_FETCH_WORKERS, thread_name_prefix='fare-fetch')
+
+# --- Fare Cache Configuration ---
+FARE_CACHE_TTL_SECONDS = float(os.environ.get('FARE_CACHE_TTL_SECONDS', 120))
+FARE_CACHE_MAX_ENTRIES = int(os.environ.get('FARE_CACHE_MAX_ENTRIES', 2000))
+
+# --- Capture / Replay Configuration ---
+FARE_CLIENT_MODE = os.environ.get('FARE_CLIENT_MODE', 'live').lower() # 'live', 'capture' or 'replay'
+FARE_CAPTURE_PATH = os.environ.get('FARE_CAPTURE_PATH', os.path.join('captures', 'requests.jsonl'))
+FARE_CAPTURE_MAX_BYTES = int(os.environ.get('FARE_CAPTURE_MAX_BYTES', 20 * 1024 * 1024))
+FARE_CAPTURE_BACKUP_COUNT = int(os.environ.get('FARE_CAPTURE_BACKUP_COUNT', 5))
+
+_fare_cache = {} # api_url -> (expires_at, stored_at, data), insertion ordered
+_fare_cache_lock = threading.Lock()
+_content_digests = {} # api_url -> digest of the latest upstream payload, insertion ordered (same bound as the cache)
+
+# {api_url: stored_at} of the responses served in the current context (see track_dependencies())
+_dependencies = contextvars.ContextVar('fare_dependencies', default=None)
+
+
+def _cache_entry(api_url):
+    """Returns (stored_at, data) for a fresh entry, or None."""
+    with _fare_cache_lock:
+        entry = _fare_cache.get(api_url)
+        if entry is None:
+            return None
+        expires_at, stored_at, data = entry
+        if expires_at < time.monotonic():
+            del _fare_cache[api_url]
+            return None
+        return stored_at, data
+
+
+def _cache_get(api_url):
+    entry = _cache_entry(api_url)
+    return entry[1] if entry is not None else None
+
+
+def _cache_put(api_url, data, ttl=None, stored_at=None):
+    """Stores a response; returns its stored_at, or None when caching is disabled."""
+    ttl = FARE_CACHE_TTL_SECONDS if ttl is None else ttl
+    if ttl <= 0:
+        return None
+    stored_at = stored_at or time.time()
+    with _fare_cache_lock:
+        _fare_cache.pop(api_url, None)
+        _fare_cache[api_url] = (time.monotonic() + ttl, stored_at, data)
+        while len(_fare_cache) > FARE_CACHE_MAX_ENTRIES:
+            # Evict the oldest entry (dicts keep insertion order)
+            del _fare_cache[next(iter(_fare_cache))]
+    return stored_at
+
+
+def response_digest(api_url):
+    """
+    Digest of the latest upstream payload fetched for api_url, or None if
+    unknown (never fetched by this process, e.g. restored from a snapshot).
+    Equal digests mean byte-identical responses.
+    """
+    with _fare_cache_lock:
+        return _content_digests.get(api_url)
+
+
+def _record_digest(api_url, content):
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    with _fare_cache_lock:
+        _content_digests.pop(api_url, None)
+        _content_digests[api_url] = digest
+        while len(_content_digests) > FARE_CACHE_MAX_ENTRIES:
+            del _content_digests[next(iter(_content_digests))]
+    return digest
+
+
+def cache_version(api_url):
+    """
+    The stored_at of the cached response for api_url, or None if it isn't
+    cached (anymore). A changed version means the data was refreshed.
+    """
+    entry = _cache_entry(api_url)
+    return entry[0] if entry is not None else None
+
+
+@contextlib.contextmanager
+def track_dependencies():
+    """
+    Collects {api_url: version} for every response fetch_json() serves inside
+    the block, including from fetch_json_many()/iter_fetch_json() workers.
+    A version of None means the response wasn't cached.
+    """
+    dependencies = {}
+    token = _dependencies.set(dependencies)
+    try:
+        yield dependencies
+    finally:
+        _dependencies.reset(token)
+
+
+_response_listeners = [] # Called with (template, api_url, data) for every fresh upstream response
+
+
+def add_response_listener(listener):
+    """Registers listener(template, api_url, data) for fresh (not cached) responses, e.g. the alert rule matcher."""
+    if listener not in _response_listeners:
+        _response_listeners.append(listener)
+
+
+def _notify_listeners(template, api_url, data):
+    for listener in _response_listeners:
+        try:
+            listener(template, api_url, data)
+        except Exception as e:
+            print(f"Warning: Fare response listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+
+def _record_dependency(api_url, version):
+    dependencies = _dependencies.get()
+    if dependencies is not None:
+        dependencies[api_url] = version
+
+
+def export_cache():
+    """Returns the fresh cache entries as [{'key', 'stored_at', 'data'}] for snapshotting."""
+    now = time.monotonic()
+    with _fare_cache_lock:
+        entries = list(_fare_cache.items())
+    return [{'key': _capture_key(api_url), 'stored_at': stored_at, 'data': data}
+            for api_url, (expires_at, stored_at, data) in entries if expires_at >= now]
+
+
+def import_cache(entries, max_age_seconds, grace_seconds):
+    """
+    Restores snapshotted cache entries younger than max_age_seconds. Each entry
+    stays fresh for the rest of its normal TTL, but at least grace_seconds, so
+    a freshly started worker can serve warm results straight away.
+    """
+    if FARE_CACHE_TTL_SECONDS <= 0:
+        return 0 # Cache disabled
+    restored = 0
+    now = time.time()
+    for entry in entries:
+        age = now - entry.get('stored_at', 0)
+        if age > max_age_seconds:
+            continue
+        ttl = max(FARE_CACHE_TTL_SECONDS - age, grace_seconds)
+        api_url = RYANAIR_API_BASE + entry['key']
+        if _cache_get(api_url) is None: # Never overwrite data fetched since startup
+            _cache_put(api_url, entry['data'], ttl=ttl, stored_at=entry['stored_at'])
+            restored += 1
+    return restored
+
+
+def _count_fares(data):
+    if isinstance(data, dict):
+        if isinstance(data.get('fares'), list):
+            return len(data['fares'])
+        outbound = data.get('outbound')
+        if isinstance(outbound, dict) and isinstance(outbound.get('fares'), list):
+            return len(outbound['fares'])
+    return 0
+
+
+RESPONSE_CHUNK_BYTES = 64 * 1024
+
+
+def _read_body(response, max_bytes):
+    """
+    Reads a streamed response body, refusing it with budget.ResponseTooLarge as
+    soon as it is known to exceed max_bytes: up front from Content-Length, else
+    while downloading, so no more than max_bytes are ever held in memory.
+    """
+    length = response.headers.get('Content-Length', '')
+    too_large = length.isdigit() and int(length) > max_bytes
+    size = 0
+    chunks = []
+    if not too_large:
+        for chunk in response.iter_content(RESPONSE_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                too_large = True
+                break
+            chunks.append(chunk)
+    if too_large:
+        response.close() # Drops the rest of the download
+        metrics.BUDGET_EXHAUSTED.inc(scope='response', resource='bytes')
+        raise budget.ResponseTooLarge(f"Response of {int(length) if length.isdigit() else f'over {size}'} bytes "
+                                      f"exceeds FARE_RESPONSE_MAX_BYTES ({max_bytes}).")
+    # Stored like a non-streamed download, so .content/.json() work as usual
+    response._content = b''.join(chunks)
+    response._content_consumed = True
+    return response._content
+
+
+def fetch_json(template, api_url, timeout=30, use_cache=True):
+    """
+    Fetches and decodes a farfnd API response, serving it from the fare cache when fresh.
+    use_cache=False always asks upstream (the fresh response still refreshes the cache).
+
+    Raises the same requests exceptions as requests.get()/raise_for_status()/json(),
+    so callers keep their existing error handling, plus budget.BudgetExceeded once
+    the active request/job budget is used up and budget.ResponseTooLarge.
+    """
+    template_name = TEMPLATE_NAMES.get(template, 'other')
+    active_budget = budget.current()
+    if active_budget is not None:
+        active_budget.check()
+
+    entry = _cache_entry(api_url) if use_cache else None
+    if entry is not None:
+        metrics.FARE_CACHE_REQUESTS.inc(result='hit')
+        profiling.count('fare_cache_hit')
+        _record_dependency(api_url, entry[0])
+        if active_budget is not None:
+            active_budget.charge(fares=_count_fares(entry[1]))
+        return entry[1]
+    metrics.FARE_CACHE_REQUESTS.inc(result='miss' if use_cache else 'bypass')
+
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        with profiling.span('upstream', template=template_name):
+            if FARE_CLIENT_MODE == 'replay':
+                response = _replay_response(api_url)
+            else:
+                response = _session.get(api_url, timeout=timeout, stream=True)
+            status = str(response.status_code)
+            # Oversized payloads are refused while downloading, before they take up memory or get parsed
+            body = _read_body(response, budget.FARE_RESPONSE_MAX_BYTES)
+        if FARE_CLIENT_MODE == 'capture':
+            _capture_response(template_name, api_url, response, time.perf_counter() - start)
+        response.raise_for_status()
+    except requests.exceptions.Timeout:
+        status = 'timeout'
+        raise
+    except requests.exceptions.ConnectionError:
+        status = 'connection_error'
+        raise
+    finally:
+        metrics.UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - start, template=template_name, status=status)
+
+    size = len(body)
+    with metrics.UPSTREAM_PARSE_DURATION.time(template=template_name), profiling.span('parse', template=template_name):
+        data = response.json()
+    fare_count = _count_fares(data)
+    metrics.UPSTREAM_FARES_PER_RESPONSE.observe(fare_count, template=template_name)
+    if active_budget is not None:
+        active_budget.charge(fares=fare_count, size=size)
+
+    _record_digest(api_url, body) # Lets listeners skip payloads identical to the last one
+    _record_dependency(api_url, _cache_put(api_url, data))
+    _notify_listeners(template, api_url, data)
+    return data
+
+
+def fetch_json_many(requests_to_make, timeout=30, use_cache=True):
+    """
+    Fetches several API URLs in parallel through the fare cache (see fetch_json() for use_cache).
+
+    requests_to_make is an iterable of (key, template, api_url). Returns
+    {key: (data, error)} where exactly one of data/error is None.
+    """
+    def _fetch(template, api_url):
+        try:
+            return fetch_json(template, api_url, timeout=timeout, use_cache=use_cache), None
+        except Exception as e:
+            return None, e
+
+    # Each worker runs in a copy of the caller's context so dependency tracking follows the fetch
+    futures = {key: _fetch_executor.submit(contextvars.copy_context().run, _fetch, template, api_url)
+               for key, template, api_url in requests_to_make}
+    return {key: future.result() for key, future in futures.items()}
+
+
+def iter_fetch_json(requests_to_make, timeout=30, fetch_budget=None):
+    """
+    Like fetch_json_many(), but yields (key, data, error) as each response
+    arrives. At most ITER_FETCH_WINDOW requests are in flight or waiting to
+    be yielded, so responses already yielded can be freed and memory stays
+    bounded however many requests there are. Closing the generator early
+    (e.g. the client went away) cancels every request that hasn't started yet.
+
+    The fetches are charged to fetch_budget if given, else to the budget
+    active where the generator runs. Pass it explicitly for generators
+    consumed outside the request that created them (streamed responses).
+    """
+    def _fetch(template, api_url):
+        try:
+            if fetch_budget is not None:
+                with budget.limit(fetch_budget):
+                    return fetch_json(template, api_url, timeout=timeout), None
+            return fetch_json(template, api_url, timeout=timeout), None
+        except Exception as e:
+            return None, e
+
+    requests_to_make = iter(requests_to_make)
+    futures = {} # future -> key, only for requests not yielded yet
+
+    def _submit_more():
+        for key, template, api_url in itertools.islice(requests_to_make, ITER_FETCH_WINDOW - len(futures)):
+            futures[_fetch_executor.submit(contextvars.copy_context().run, _fetch, template, api_url)] = key
+
+    try:
+        _submit_more()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            results = [(futures.pop(future), future.result()) for future in done]
+            del done
+            _submit_more() # Keeps the workers busy while these are consumed
+            while results:
+                key, (data, error) = results.pop(0)
+                yield key, data, error
+    finally:
+        for future in futures:
+            future.cancel() # No-op for requests already running or done
+
+
+# === Capture / Replay ===
+
+_capture_logger = None
+_capture_logger_lock = threading.Lock()
+_replay_index = None
+_replay_index_lock = threading.Lock()
+
+
+def _capture_key(api_url):
+    """Path and query relative to the API base, so captures replay against any base URL."""
+    if api_url.startswith(RYANAIR_API_BASE):
+        return api_url[len(RYANAIR_API_BASE):]
+    return api_url
+
+
+def _get_capture_logger():
+    global _capture_logger
+    with _capture_logger_lock:
+        if _capture_logger is None:
+            capture_dir = os.path.dirname(FARE_CAPTURE_PATH)
+            if capture_dir:
+                os.makedirs(capture_dir, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                FARE_CAPTURE_PATH, maxBytes=FARE_CAPTURE_MAX_BYTES,
+                backupCount=FARE_CAPTURE_BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger('fare_client.capture')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _capture_logger = logger
+        return _capture_logger
+
+
+def _capture_response(template_name, api_url, response, elapsed_seconds):
+    body = response.content or b''
+    record = {
+        'ts': datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+        'template': template_name,
+        'key': _capture_key(api_url),
+        'status': response.status_code,
+        'elapsed_ms': round(elapsed_seconds * 1000, 1),
+        'size': len(body),
+        'body': base64.b64encode(zlib.compress(body, 6)).decode('ascii'), # zlib + base64
+    }
+    try:
+        _get_capture_logger().info(json.dumps(record, separators=(',', ':')))
+    except Exception as e:
+        print(f"Warning: Could not write fare capture record: {e}")
+
+
+def iter_capture_records(path=None):
+    """
+    Yields decoded capture records (oldest first, including rotated files) with
+    'body' as raw bytes. Malformed lines are skipped.
+    """
+    path = path or FARE_CAPTURE_PATH
+    rotated = [f"{path}.{n}" for n in range(FARE_CAPTURE_BACKUP_COUNT, 0, -1)]
+    for file_path in rotated + [path]:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    record['body'] = zlib.decompress(base64.b64decode(record['body']))
+                except (ValueError, KeyError, zlib.error):
+                    continue
+                yield record
+
+
+def load_capture(path=None):
+    """Returns {key: record} with the most recent record per upstream query."""
+    return {record['key']: record for record in iter_capture_records(path)}
+
+
+def _replay_response(api_url):
+    global _replay_index
+    with _replay_index_lock:
+        if _replay_index is None:
+            _replay_index = load_capture()
+            print(f"Fare client replay mode: loaded {len(_replay_index)} recorded responses from {FARE_CAPTURE_PATH}")
+    record = _replay_index.get(_capture_key(api_url))
+    if record is None:
+        raise requests.exceptions.ConnectionError(f"No recorded response for {api_url} (replay mode)")
+
+    # Rebuild a Response so raise_for_status()/json() behave as for a live call
+    response = requests.Response()
+    response.status_code = record['status']
+    response._content = record['body']
+    response._content_consumed = True
+    response.url = api_url
+    response.encoding = 'utf-8'
+    return response
+
+
+def warm_cache_from_capture(path=None):
+    """Loads the latest successful captured response per query into the fare cache."""
+    warmed = 0
+    for key, record in load_capture(path).items():
+        if record.get('status') != 200:
+            continue
+        try:
+            data = json.loads(record['body'])
+        except ValueError:
+            continue
+        _cache_put(RYANAIR_API_BASE + key, data)
+        warmed += 1
+    return warmed
+
+
+def iter_daily_fares(data, month_dt):
+    """
+    Yields (departure_date, price_value, currency_code) for each priced day of a
+    cheapestPerDay response, skipping sold out / unavailable days.
+
+    The API nests days under data['outbound']['fares'] with ISO 'day' strings
+    (see flight_finder.py); a top-level 'fares' list with day-of-month numbers
+    is also accepted.
+    """
+    if not isinstance(data, dict):
+        return
+    outbound = data.get('outbound')
+    if isinstance(outbound, dict) and 'fares' in outbound:
+        day_fares = outbound.get('fares') or []
+    else:
+        day_fares = data.get('fares') or []
+
+    for day_fare in day_fares:
+        price_info = day_fare.get('price')
+        day = day_fare.get('day')
+        if not price_info or price_info.get('value') is None or not day:
+            continue
+        try:
+            if isinstance(day, int):
+                departure_date = date(month_dt.year, month_dt.month, day)
+            else:
+                departure_date = date.fromisoformat(str(day)[:10])
+        except ValueError: # Handle invalid day numbers (e.g., 31 in Feb)
+            continue
+        yield departure_date, price_info['value'], price_info.get('currencyCode')
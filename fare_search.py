@@ -0,0 +1,151 @@
+"""
+Date windows and multi-month round trip queries.
+
+A month-range search is split into one roundTripFares query per outbound
+month. The queries run in parallel through the fare client (and its cache)
+and the per-month results, each already sorted by price, are combined with a
+streaming k-way merge.
+"""
+import calendar
+import heapq
+import os
+from datetime import date, timedelta
+
+import fare_client
+from fare_client import ONE_WAY_MONTH_API_TEMPLATE, ROUND_TRIP_API_TEMPLATE
+
+MAX_SEARCH_MONTHS = int(os.environ.get('MAX_SEARCH_MONTHS', 6)) # Upper bound for a month-range search
+
+
+def parse_month(month_str):
+    """Parses 'YYYY-MM' into (year, month). Raises ValueError on bad input."""
+    year, month = map(int, month_str.split('-'))
+    date(year, month, 1) # Validates the month number
+    return year, month
+
+
+def month_range(start_month_str, end_month_str=None, max_months=MAX_SEARCH_MONTHS):
+    """
+    Returns [(year, month), ...] from start to end inclusive (end defaults to start).
+    Raises ValueError if the range is reversed or longer than max_months.
+    """
+    year, month = parse_month(start_month_str)
+    end_year, end_month = parse_month(end_month_str) if end_month_str else (year, month)
+    count = (end_year - year) * 12 + (end_month - month) + 1
+    if count < 1:
+        raise ValueError("End month is before start month.")
+    if count > max_months:
+        raise ValueError(f"Month range is limited to {max_months} months.")
+    return months_from(year, month, count)
+
+
+def months_from(year, month, count):
+    """Returns count consecutive (year, month) tuples starting at year/month."""
+    months = []
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def round_trip_window(year, month):
+    """
+    Outbound window is the whole month; inbound runs from the first of the
+    month to the end of the following month.
+    Returns (out_date_from, out_date_to, in_date_from, in_date_to).
+    """
+    out_date_from = date(year, month, 1)
+    out_date_to = date(year, month, calendar.monthrange(year, month)[1])
+    next_month_date = out_date_to.replace(day=1) + timedelta(days=32)
+    in_date_to = date(next_month_date.year, next_month_date.month,
+                      calendar.monthrange(next_month_date.year, next_month_date.month)[1])
+    return out_date_from, out_date_to, out_date_from, in_date_to
+
+
+def round_trip_url(origin_iata, destination_iata, year, month, duration_from, duration_to, currency):
+    out_date_from, out_date_to, in_date_from, in_date_to = round_trip_window(year, month)
+    return ROUND_TRIP_API_TEMPLATE.format(
+        origin_iata=origin_iata,
+        destination_iata=destination_iata,
+        out_date_from=out_date_from.strftime("%Y-%m-%d"),
+        out_date_to=out_date_to.strftime("%Y-%m-%d"),
+        in_date_from=in_date_from.strftime("%Y-%m-%d"),
+        in_date_to=in_date_to.strftime("%Y-%m-%d"),
+        duration_from=duration_from,
+        duration_to=duration_to,
+        currency=currency
+    )
+
+
+def _round_trip_requests(pairs, months, duration_from, duration_to, currency):
+    return [
+        ((origin, destination, year_month), ROUND_TRIP_API_TEMPLATE,
+         round_trip_url(origin, destination, year_month[0], year_month[1], duration_from, duration_to, currency))
+        for origin, destination in pairs
+        for year_month in months
+    ]
+
+
+def fetch_round_trips(pairs, months, duration_from, duration_to, currency, timeout=30):
+    """
+    Fetches roundTripFares for every (origin, destination) pair and month in parallel.
+    Returns {(origin, destination, (year, month)): (data, error)}.
+    """
+    return fare_client.fetch_json_many(
+        _round_trip_requests(pairs, months, duration_from, duration_to, currency), timeout=timeout)
+
+
+def iter_round_trips(pairs, months, duration_from, duration_to, currency, timeout=30, fetch_budget=None):
+    """
+    Like fetch_round_trips(), but yields ((origin, destination, (year, month)), data, error) as responses
+    arrive. See fare_client.iter_fetch_json() for fetch_budget.
+    """
+    return fare_client.iter_fetch_json(
+        _round_trip_requests(pairs, months, duration_from, duration_to, currency), timeout=timeout,
+        fetch_budget=fetch_budget)
+
+
+def one_way_month_url(origin_iata, destination_iata, year, month, currency):
+    return ONE_WAY_MONTH_API_TEMPLATE.format(
+        origin_iata=origin_iata,
+        destination_iata=destination_iata,
+        month_date=date(year, month, 1).strftime("%Y-%m-%d"),
+        currency=currency
+    )
+
+
+def fetch_daily_fares(route_months, currency, timeout=20):
+    """
+    Fetches cheapestPerDay for every (origin, destination, (year, month)) in one parallel batch.
+    Returns ({(origin, destination): {date: price}}, {(origin, destination): error}).
+    Days outside the requested month are left out.
+    """
+    requests_to_make = [
+        ((origin, destination, year_month), ONE_WAY_MONTH_API_TEMPLATE,
+         one_way_month_url(origin, destination, year_month[0], year_month[1], currency))
+        for origin, destination, year_month in route_months
+    ]
+    responses = fare_client.fetch_json_many(requests_to_make, timeout=timeout)
+
+    prices = {(origin, destination): {} for origin, destination, _ in route_months}
+    errors = {}
+    for (origin, destination, year_month), (data, error) in responses.items():
+        if error is not None:
+            errors.setdefault((origin, destination), error)
+            continue
+        route_prices = prices[(origin, destination)]
+        for departure_date, price, _ in fare_client.iter_daily_fares(data, date(year_month[0], year_month[1], 1)):
+            if (departure_date.year, departure_date.month) == year_month:
+                route_prices[departure_date] = price
+    return prices, errors
+
+
+def merge_by_price(sorted_trip_lists):
+    """Lazily merges trip lists that are each sorted by 'total_price'."""
+    return heapq.merge(*sorted_trip_lists, key=lambda trip: trip['total_price'])
+
+
+def format_month_range(months):
+    first = date(*months[0], 1).strftime('%Y-%m')
+    last = date(*months[-1], 1).strftime('%Y-%m')
+    return first if first == last else f"{first} to {last}"
@@ -1,4 +1,30 @@
+"""
+Cheapest one-way fares per day from the Ryanair cheapestPerDay API.
+
+Without arguments it prints the daily fares for the single route and month
+set in the constants below. With --spec it runs as a batch job: every route
+of a spec file for every month, fetched concurrently through the shared
+fare client (FARE_FETCH_WORKERS parallel calls), with rows streamed to CSV,
+NDJSON or Parquet as responses arrive.
+
+Spec file (JSON), e.g.:
+    {"routes": ["SOF-BCN", "SOF-MAD"], "months": {"from": "2025-05", "to": "2025-10"}}
+  routes           "XXX-YYY" strings; "origins" and "destinations" lists add every pair
+  months           a list of "YYYY-MM", or a {"from", "to"} range
+  both_directions  optional, also fetches the return routes
+  currency         optional, defaults to CURRENCY
+
+Usage:
+    python flight_finder.py
+    python flight_finder.py --spec routes.json --output fares.csv
+    python flight_finder.py --spec routes.json --output fares.parquet   # needs pyarrow
+    python flight_finder.py --spec routes.json --format ndjson > fares.ndjson
+"""
+import argparse
+import csv
+import os
 import sys
+import time
 import requests # Import requests
 import json     # Import json for parsing
 from datetime import date
@@ -117,5 +143,204 @@ def find_cheapest_flights(origin, destination, year, month, currency):
         print("Check the input parameters and API availability.")
 
 
+# === Batch Mode ===
+
+MAX_SPEC_MONTHS = 24 # Longest month range a spec file may ask for
+PARQUET_ROW_GROUP_ROWS = 50000 # Rows buffered per Parquet row group
+OUTPUT_COLUMNS = ['origin_iata', 'destination_iata', 'departure_date', 'price', 'currency']
+
+
+def _parse_route(route):
+    """'SOF-BCN' or ['SOF', 'BCN'] -> ('SOF', 'BCN')."""
+    parts = route.split('-') if isinstance(route, str) else list(route)
+    if len(parts) != 2 or not all(isinstance(code, str) and len(code.strip()) == 3 for code in parts):
+        raise ValueError(f"Invalid route {route!r}, expected 'XXX-YYY'.")
+    return parts[0].strip().upper(), parts[1].strip().upper()
+
+
+def load_spec(path):
+    """
+    Reads a batch spec file. Returns (routes, months, currency) with routes as
+    (origin, destination) pairs and months as (year, month) tuples.
+    Raises ValueError on an invalid spec.
+    """
+    import fare_search # Deferred with fare_client, see main()
+
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+
+    routes = [_parse_route(route) for route in spec.get('routes', [])]
+    origins = [code.strip().upper() for code in spec.get('origins', [])]
+    destinations = [code.strip().upper() for code in spec.get('destinations', [])]
+    routes += [(origin, destination) for origin in origins for destination in destinations if origin != destination]
+    if spec.get('both_directions'):
+        routes += [(destination, origin) for origin, destination in routes]
+    routes = list(dict.fromkeys(routes)) # Drop duplicates, keep order
+    if not routes:
+        raise ValueError("Spec has no routes ('routes' or 'origins' and 'destinations').")
+
+    months_spec = spec.get('months')
+    if isinstance(months_spec, dict):
+        months = fare_search.month_range(months_spec.get('from', ''), months_spec.get('to'), max_months=MAX_SPEC_MONTHS)
+    elif isinstance(months_spec, list) and months_spec:
+        months = list(dict.fromkeys(fare_search.parse_month(month) for month in months_spec))
+    else:
+        raise ValueError("Spec needs 'months': a list of 'YYYY-MM' or {'from': 'YYYY-MM', 'to': 'YYYY-MM'}.")
+    return routes, months, spec.get('currency', CURRENCY).upper()
+
+
+class CsvOutput:
+    def __init__(self, stream):
+        self._writer = csv.writer(stream)
+        self._writer.writerow(OUTPUT_COLUMNS)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class NdjsonOutput:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._stream.write(json.dumps(dict(zip(OUTPUT_COLUMNS, row))) + '\n')
+
+    def close(self):
+        pass
+
+
+class ParquetOutput:
+    """Buffers rows column-wise and writes a row group every PARQUET_ROW_GROUP_ROWS rows."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); use CSV or NDJSON instead.")
+        self._pa = pa
+        self._schema = pa.schema([('origin_iata', pa.string()), ('destination_iata', pa.string()),
+                                  ('departure_date', pa.date32()), ('price', pa.float64()), ('currency', pa.string())])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._columns = [[] for _ in OUTPUT_COLUMNS]
+
+    def write_rows(self, rows):
+        for row in rows:
+            for column, value in zip(self._columns, row):
+                column.append(value)
+        if len(self._columns[0]) >= PARQUET_ROW_GROUP_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self._columns[0]:
+            self._columns[2] = [date.fromisoformat(day) for day in self._columns[2]]
+            self._writer.write_table(self._pa.Table.from_arrays(
+                [self._pa.array(column, type=field.type) for column, field in zip(self._columns, self._schema)],
+                schema=self._schema))
+            self._columns = [[] for _ in OUTPUT_COLUMNS]
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def run_batch(routes, months, currency, output):
+    """
+    Fetches cheapestPerDay for every route and month concurrently and writes
+    one row per priced day to output as each response arrives (so rows are
+    grouped by route-month but not ordered). Returns (rows_written, errors).
+    """
+    import fare_client # Deferred so main() can configure it through the environment first
+    import fare_search
+
+    requests_to_make = [
+        ((origin, destination, year_month), fare_client.ONE_WAY_MONTH_API_TEMPLATE,
+         fare_search.one_way_month_url(origin, destination, year_month[0], year_month[1], currency))
+        for origin, destination in routes
+        for year_month in months
+    ]
+    total = len(requests_to_make)
+    print(f"Fetching {total} route-months ({len(routes)} routes x {len(months)} months) "
+          f"with {fare_client.FARE_FETCH_WORKERS} workers...", file=sys.stderr)
+
+    rows_written = 0
+    errors = []
+    for done, ((origin, destination, year_month), data, error) in enumerate(
+            fare_client.iter_fetch_json(requests_to_make, timeout=20), start=1):
+        if error is not None:
+            errors.append((origin, destination, year_month, error))
+            print(f"  {origin}->{destination} {year_month[0]}-{year_month[1]:02d}: {error}", file=sys.stderr)
+            continue
+        rows = [(origin, destination, departure_date.isoformat(), float(price), currency_code or currency)
+                for departure_date, price, currency_code in fare_client.iter_daily_fares(data, date(*year_month, 1))
+                if (departure_date.year, departure_date.month) == year_month]
+        output.write_rows(rows)
+        rows_written += len(rows)
+        if done % 500 == 0:
+            print(f"  {done}/{total} route-months, {rows_written} rows", file=sys.stderr)
+    return rows_written, errors
+
+
+def _output_format(args):
+    if args.format:
+        return args.format
+    extension = os.path.splitext(args.output or '')[1].lower()
+    return {'.parquet': 'parquet', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(extension, 'csv')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cheapest Ryanair fares per day, for one route or a batch spec file.')
+    parser.add_argument('--spec', help='JSON file of routes and months to fetch (batch mode).')
+    parser.add_argument('--output', help='Output file (batch mode); defaults to stdout.')
+    parser.add_argument('--format', choices=['csv', 'ndjson', 'parquet'],
+                        help='Output format; defaults to the --output extension, else CSV.')
+    parser.add_argument('--currency', help='Overrides the spec file currency.')
+    parser.add_argument('--workers', type=int, help='Concurrent API calls (default FARE_FETCH_WORKERS or 8).')
+    args = parser.parse_args()
+
+    if not args.spec:
+        find_cheapest_flights(ORIGIN_IATA, DESTINATION_IATA, SEARCH_YEAR, SEARCH_MONTH, CURRENCY)
+        return 0
+
+    # Must be set before fare_client is loaded; each route-month is fetched once, so caching it is useless
+    if args.workers:
+        os.environ['FARE_FETCH_WORKERS'] = str(args.workers)
+    os.environ.setdefault('FARE_CACHE_TTL_SECONDS', '0')
+
+    try:
+        routes, months, currency = load_spec(args.spec)
+    except (OSError, ValueError) as e:
+        print(f"Error: Invalid spec file {args.spec}: {e}", file=sys.stderr)
+        return 2
+    currency = (args.currency or currency).upper()
+
+    output_format = _output_format(args)
+    if output_format == 'parquet' and not args.output:
+        print("Error: Parquet output needs --output.", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    stream = None
+    if output_format == 'parquet':
+        output = ParquetOutput(args.output)
+    else:
+        stream = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+        output = CsvOutput(stream) if output_format == 'csv' else NdjsonOutput(stream)
+    try:
+        rows_written, errors = run_batch(routes, months, currency, output)
+    finally:
+        output.close()
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+
+    print(f"Wrote {rows_written} rows in {time.perf_counter() - start:.1f}s; "
+          f"{len(errors)} of {len(routes) * len(months)} route-months failed.", file=sys.stderr)
+    return 1 if errors else 0
+
+
 if __name__ == "__main__":
-    find_cheapest_flights(ORIGIN_IATA, DESTINATION_IATA, SEARCH_YEAR, SEARCH_MONTH, CURRENCY) 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Foreign exchange rates for showing fares in other currencies.
+
+Fares are always fetched upstream in CANONICAL_CURRENCY, so a search shown in
+GBP and the same search in EUR share their API calls and cache entries.
+Results are converted at render time with one NumPy multiply per page, using
+rates per EUR from the European Central Bank's daily reference feed.
+
+Rates are refreshed on a schedule into a local state file
+(state/fx_rates.json, not tracked by git). Every worker reloads its table
+when that file changes, so rates refreshed by one process reach them all.
+Until the first refresh, or when the feed can't be reached, the rates
+bundled in data/fx_rates.json are used; that file is never written at
+runtime. Refresh by hand with:
+    python -m fx --refresh
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import requests
+
+CANONICAL_CURRENCY = 'EUR' # Currency of every upstream query; ECB rates are quoted per EUR
+FX_DEFAULT_CURRENCY = os.environ.get('FX_DEFAULT_CURRENCY', CANONICAL_CURRENCY).upper() # Shown when none is requested
+# Bundled rates, read-only fallback
+FX_RATES_PATH = os.environ.get('FX_RATES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'fx_rates.json'))
+# Refreshed rates, shared by the workers (like state_snapshot's STATE_SNAPSHOT_PATH)
+FX_RATES_STATE_PATH = os.environ.get('FX_RATES_STATE_PATH', os.path.join('state', 'fx_rates.json'))
+FX_RATES_URL = os.environ.get('FX_RATES_URL', 'https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml')
+FX_REFRESH_HOURS = float(os.environ.get('FX_REFRESH_HOURS', 6))
+
+_ECB_NAMESPACE = '{http://www.ecb.int/vocabulary/2002-08-01/eurofxref}'
+
+
+class RateTable:
+    """Rates per EUR in one array, so a batch of prices converts in a single multiply."""
+
+    def __init__(self, rates, as_of=None, source=None):
+        rates = dict(rates, **{CANONICAL_CURRENCY: 1.0})
+        self.currencies = sorted(rates)
+        self._positions = {currency: i for i, currency in enumerate(self.currencies)}
+        self._rates = np.array([float(rates[currency]) for currency in self.currencies])
+        self.as_of = as_of
+        self.source = source
+
+    def __contains__(self, currency):
+        return currency in self._positions
+
+    def factor(self, from_currency, to_currency):
+        """Multiplier converting an amount in from_currency into to_currency."""
+        return self._rates[self._positions[to_currency]] / self._rates[self._positions[from_currency]]
+
+    def factors(self, from_currencies, to_currency):
+        """Per-amount multipliers for a sequence of source currencies."""
+        positions = np.array([self._positions[currency] for currency in from_currencies], dtype=int)
+        return self._rates[self._positions[to_currency]] / self._rates[positions]
+
+
+_table = None
+_table_mtime = None # Modification time of the state file when _table was loaded (None: no state file)
+_table_lock = threading.Lock()
+
+
+def _read_table(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return RateTable(data['rates'], as_of=data.get('date'), source=data.get('source'))
+
+
+def load_table(path=None):
+    """Loads path, or else the refreshed rates if there are any and the bundled ones otherwise."""
+    if path is None and os.path.exists(FX_RATES_STATE_PATH):
+        try:
+            return _read_table(FX_RATES_STATE_PATH)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Warning: Could not load FX rates from {FX_RATES_STATE_PATH}: {e}. Using the bundled rates.")
+    path = path or FX_RATES_PATH
+    try:
+        return _read_table(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Warning: Could not load FX rates from {path}: {e}. Only {CANONICAL_CURRENCY} is available.")
+        return RateTable({})
+
+
+def _state_mtime():
+    try:
+        return os.path.getmtime(FX_RATES_STATE_PATH)
+    except OSError:
+        return None
+
+
+def get_table():
+    """
+    Returns the current rate table, loading it on first use and again whenever
+    the state file changes (e.g. refreshed by another worker's scheduler).
+    """
+    global _table, _table_mtime
+    mtime = _state_mtime()
+    if _table is None or mtime != _table_mtime:
+        with _table_lock:
+            if _table is None or mtime != _table_mtime:
+                _table = load_table()
+                _table_mtime = mtime
+    return _table
+
+
+def supported_currencies():
+    return get_table().currencies
+
+
+def requested_currency(value):
+    """Normalizes a ?currency= value; unknown or missing currencies fall back to FX_DEFAULT_CURRENCY."""
+    currency = (value or '').strip().upper()
+    table = get_table()
+    if currency in table:
+        return currency
+    return FX_DEFAULT_CURRENCY if FX_DEFAULT_CURRENCY in table else CANONICAL_CURRENCY
+
+
+def convert(amounts, to_currency, from_currency=CANONICAL_CURRENCY):
+    """
+    Converts a scalar or array of amounts (NaN stays NaN), rounded to cents.
+    Returns a float for scalar input, an ndarray otherwise.
+    """
+    values = np.asarray(amounts, dtype=float)
+    if to_currency != from_currency:
+        values = values * get_table().factor(from_currency, to_currency)
+    values = np.round(values, 2)
+    return float(values) if values.ndim == 0 else values
+
+
+def _get_path(record, path):
+    for name in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(name)
+    return record
+
+
+def _set_path(record, path, value):
+    for name in path[:-1]:
+        record = record[name]
+    record[path[-1]] = value
+
+
+def _copy_path(record, path):
+    """Shallow-copies the nested dicts along path so cached source data is never modified."""
+    for name in path[:-1]:
+        if isinstance(record.get(name), dict):
+            record[name] = dict(record[name])
+            record = record[name]
+        else:
+            return
+
+
+def convert_records(records, fields, to_currency, from_currency=None):
+    """
+    Returns copies of records (dicts) with the given price fields converted to
+    to_currency and 'currency' set to it. Fields may be nested ('outbound.price').
+    from_currency defaults to each record's own 'currency' (or CANONICAL_CURRENCY).
+    All amounts of all records are converted with a single vectorized multiply.
+    """
+    paths = [tuple(field.split('.')) for field in fields]
+    converted = []
+    for record in records:
+        copy = dict(record)
+        for path in paths:
+            _copy_path(copy, path)
+        converted.append(copy)
+    if not converted:
+        return converted
+
+    table = get_table()
+    sources = [from_currency or record.get('currency') or CANONICAL_CURRENCY for record in converted]
+    sources = [source if source in table else CANONICAL_CURRENCY for source in sources]
+    amounts = np.array([[_get_path(record, path) for path in paths] for record in converted], dtype=float)
+    amounts = np.round(amounts * table.factors(sources, to_currency)[:, None], 2)
+
+    for record, row in zip(converted, amounts):
+        for path, value in zip(paths, row):
+            if _get_path(record, path) is not None:
+                _set_path(record, path, float(value))
+        record['currency'] = to_currency
+    return converted
+
+
+# --- Rate Refresh ---
+
+def fetch_ecb_rates(timeout=20):
+    """Returns (date, {currency: rate per EUR}) from the ECB daily reference rates feed."""
+    response = requests.get(FX_RATES_URL, timeout=timeout)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+    rates = {}
+    as_of = None
+    for cube in root.iter(_ECB_NAMESPACE + 'Cube'):
+        if cube.get('time'):
+            as_of = cube.get('time')
+        if cube.get('currency') and cube.get('rate'):
+            rates[cube.get('currency').upper()] = float(cube.get('rate'))
+    if not rates:
+        raise ValueError("No rates found in the ECB feed.")
+    return as_of, rates
+
+
+def next_refresh_time(path=None):
+    """When the rates in path (default the state file) are due a refresh: now if missing or stale."""
+    path = path or FX_RATES_STATE_PATH
+    try:
+        age_seconds = max(0.0, time.time() - os.path.getmtime(path))
+    except OSError:
+        return datetime.now()
+    return datetime.now() + timedelta(seconds=max(0.0, FX_REFRESH_HOURS * 3600 - age_seconds))
+
+
+def refresh_rates(path=None):
+    """
+    Fetches fresh rates, writes them to path (default the state file) and swaps them in.
+    On failure the current table (or the file's) stays in use. Returns the number of currencies.
+    """
+    global _table, _table_mtime
+    path = path or FX_RATES_STATE_PATH
+    as_of, rates = fetch_ecb_rates()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # A temp file per writer and a rename, so workers refreshing at once never clobber each other's writes
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.fx_rates-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'base': CANONICAL_CURRENCY, 'date': as_of, 'source': FX_RATES_URL,
+                       'rates': dict(sorted(rates.items()))}, f, indent=2)
+            f.write('\n')
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    with _table_lock:
+        _table = RateTable(rates, as_of=as_of, source=FX_RATES_URL)
+        _table_mtime = _state_mtime()
+    return len(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or refresh the FX rate table.')
+    parser.add_argument('--refresh', action='store_true', help="Fetch the ECB reference rates into the state file.")
+    parser.add_argument('--path', help="Rates file to refresh or show (default: the state file, else the bundled rates). "
+                                       "Pass data/fx_rates.json to update the bundled fallback.")
+    args = parser.parse_args()
+
+    if args.refresh:
+        print(f"Wrote {refresh_rates(args.path)} rates to {args.path or FX_RATES_STATE_PATH}")
+    table = load_table(args.path)
+    print(f"Rates per {CANONICAL_CURRENCY} as of {table.as_of or 'unknown date'}:")
+    for currency in table.currencies:
+        print(f"  {currency}  {table.factor(CANONICAL_CURRENCY, currency):.4f}")
+
+
+if __name__ == '__main__':
+    main()
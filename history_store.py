@@ -0,0 +1,141 @@
+"""
+Cached reads of the price_history table for the trend charts.
+
+Two in-process LRU stores sit in front of Supabase, both keyed by
+(origin, destination, departure_date):
+  - rows:   the raw (collected_at, price, currency) series of one query,
+            dropped whenever collect_price_history() ingests new prices for
+            that key, and after HISTORY_CACHE_TTL_SECONDS at the latest.
+  - rollup: per collection day open/low/high/close prices in
+            CANONICAL_CURRENCY. Built from the raw series, then kept
+            current by this process's ingest path (record_ingest()) without
+            touching the database. Rebuilt after HISTORY_CACHE_TTL_SECONDS
+            too, to pick up rows other workers or collectors wrote.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import fx
+import metrics
+import profiling
+
+HISTORY_CACHE_MAX_ENTRIES = int(os.environ.get('HISTORY_CACHE_MAX_ENTRIES', 512))
+HISTORY_CACHE_TTL_SECONDS = float(os.environ.get('HISTORY_CACHE_TTL_SECONDS', 900)) # Bounds staleness from other writers
+HISTORY_ROLLUP_MAX_ENTRIES = int(os.environ.get('HISTORY_ROLLUP_MAX_ENTRIES', 2048))
+
+_rows = OrderedDict() # key -> (stored_at, rows), least recently used first
+_rollups = OrderedDict() # key -> (built_at, OrderedDict(day -> [open, low, high, close, samples]))
+_lock = threading.Lock()
+_ingest_generation = 0 # Bumped by every ingest; results read across one aren't stored
+
+
+def _lru_put(store, key, value, max_entries):
+    store[key] = value
+    store.move_to_end(key)
+    while len(store) > max_entries:
+        store.popitem(last=False)
+
+
+def _query_rows(supabase, origin_iata, destination_iata, departure_date):
+    with profiling.span('supabase', table='price_history'):
+        results = supabase.table('price_history')\
+            .select('collected_at, price, currency')\
+            .eq('origin_iata', origin_iata)\
+            .eq('destination_iata', destination_iata)\
+            .eq('departure_date', departure_date)\
+            .order('collected_at', desc=False)\
+            .execute()
+    return results.data or []
+
+
+def price_rows(supabase, origin_iata, destination_iata, departure_date):
+    """The collected prices for one route and departure date ('YYYY-MM-DD'), oldest first."""
+    key = (origin_iata, destination_iata, departure_date)
+    with _lock:
+        cached = _rows.get(key)
+        if cached is not None and time.monotonic() - cached[0] < HISTORY_CACHE_TTL_SECONDS:
+            _rows.move_to_end(key)
+            metrics.HISTORY_CACHE_REQUESTS.inc(kind='rows', result='hit')
+            return cached[1]
+        generation = _ingest_generation
+    metrics.HISTORY_CACHE_REQUESTS.inc(kind='rows', result='miss')
+    rows = _query_rows(supabase, origin_iata, destination_iata, departure_date)
+    with _lock:
+        if generation == _ingest_generation:
+            _lru_put(_rows, key, (time.monotonic(), rows), HISTORY_CACHE_MAX_ENTRIES)
+    return rows
+
+
+def _add_to_day(days, day, price):
+    bar = days.get(day)
+    if bar is None:
+        days[day] = [price, price, price, price, 1]
+    else:
+        bar[1] = min(bar[1], price)
+        bar[2] = max(bar[2], price)
+        bar[3] = price
+        bar[4] += 1
+
+
+def _build_rollup(rows):
+    days = OrderedDict()
+    canonical = fx.convert_records(rows, ('price',), fx.CANONICAL_CURRENCY)
+    for row in canonical:
+        if row.get('price') is not None and row.get('collected_at'):
+            _add_to_day(days, str(row['collected_at'])[:10], row['price'])
+    return days
+
+
+def daily_rollup(supabase, origin_iata, destination_iata, departure_date):
+    """
+    Per collection day OHLC prices for one route and departure date:
+    [{'day', 'open', 'low', 'high', 'close', 'samples', 'currency'}], oldest first.
+    """
+    key = (origin_iata, destination_iata, departure_date)
+    with _lock:
+        cached = _rollups.get(key)
+        days = None
+        if cached is not None and time.monotonic() - cached[0] < HISTORY_CACHE_TTL_SECONDS:
+            days = cached[1]
+            _rollups.move_to_end(key)
+            bars = [(day, list(bar)) for day, bar in days.items()] # Ingests update bars in place
+        generation = _ingest_generation
+    if days is None:
+        metrics.HISTORY_CACHE_REQUESTS.inc(kind='rollup', result='miss')
+        built_at = time.monotonic()
+        days = _build_rollup(price_rows(supabase, origin_iata, destination_iata, departure_date))
+        bars = list(days.items())
+        with _lock:
+            if generation == _ingest_generation:
+                _lru_put(_rollups, key, (built_at, days), HISTORY_ROLLUP_MAX_ENTRIES)
+    else:
+        metrics.HISTORY_CACHE_REQUESTS.inc(kind='rollup', result='hit')
+    return [{'day': day, 'open': bar[0], 'low': bar[1], 'high': bar[2], 'close': bar[3], 'samples': bar[4],
+             'currency': fx.CANONICAL_CURRENCY} for day, bar in bars]
+
+
+def record_ingest(records, collected_at=None):
+    """
+    Called after price_history rows are inserted: drops their cached raw
+    series and adds the prices to rollups that are already built.
+    """
+    global _ingest_generation
+    day = (collected_at or datetime.now(timezone.utc)).date().isoformat() # collected_at is the DB's UTC default
+    canonical = fx.convert_records(records, ('price',), fx.CANONICAL_CURRENCY)
+    with _lock:
+        _ingest_generation += 1
+        for record in canonical:
+            key = (record['origin_iata'], record['destination_iata'], record['departure_date'])
+            _rows.pop(key, None)
+            cached = _rollups.get(key)
+            if cached is not None and record.get('price') is not None:
+                _add_to_day(cached[1], day, record['price'])
+
+
+def clear():
+    with _lock:
+        _rows.clear()
+        _rollups.clear()
@@ -0,0 +1,164 @@
+"""
+Open-jaw and two-stop itinerary search over one-way cheapestPerDay fares.
+
+Every leg the search could use (home -> stop, stop -> stop, stop -> home) is
+fetched up front in one parallel batch through the fare client, giving a
+time-indexed graph: nodes are (airport, day) and edges are priced one-way
+flights. Itineraries are then found with a best-first search:
+
+    open jaw:  A -> B, (surface) C -> A      with B != C
+    two stop:  A -> B, B -> C, C -> A        with B != C
+
+Partial itineraries are ordered by cost plus a lower bound of the remaining
+legs, so complete itineraries come off the heap cheapest first and the search
+stops after top_n. Partials that can't beat the current n-th best complete
+itinerary are pruned.
+"""
+import heapq
+import itertools
+import os
+from datetime import timedelta
+
+import airports
+import fare_search
+
+ITINERARY_TYPES = ('open_jaw', 'two_stop')
+# Two-stop search fetches every stop -> stop route, so this bounds the batch size
+ITINERARY_MAX_AIRPORTS = int(os.environ.get('ITINERARY_MAX_AIRPORTS', 20))
+MAX_EXPANSIONS = int(os.environ.get('ITINERARY_MAX_EXPANSIONS', 200000)) # Safety net per search
+
+
+def required_routes(home_iata, stop_iatas, itinerary_types):
+    """Returns (outbound_routes, onward_routes): legs leaving home, and legs that can fly after the first stop."""
+    outbound_routes = [(home_iata, stop) for stop in stop_iatas]
+    onward_routes = [(stop, home_iata) for stop in stop_iatas]
+    if 'two_stop' in itinerary_types:
+        onward_routes += [(a, b) for a in stop_iatas for b in stop_iatas if a != b]
+    # Skip routes the airport index knows aren't flown
+    return ([route for route in outbound_routes if airports.serves(*route)],
+            [route for route in onward_routes if airports.serves(*route)])
+
+
+def fetch_legs(home_iata, stop_iatas, months, itinerary_types, currency):
+    """
+    Fetches all legs for the search in one parallel batch. Outbound legs cover
+    the given months, onward legs one extra month for trips crossing its end.
+    Returns ({(origin, destination): {date: price}}, {(origin, destination): error}).
+    """
+    outbound_routes, onward_routes = required_routes(home_iata, stop_iatas, itinerary_types)
+    y, m = months[-1]
+    onward_months = months + fare_search.months_from(y, m, 2)[1:]
+    route_months = [(origin, destination, ym) for origin, destination in outbound_routes for ym in months]
+    route_months += [(origin, destination, ym) for origin, destination in onward_routes for ym in onward_months]
+    return fare_search.fetch_daily_fares(route_months, currency)
+
+
+def _cheapest(prices_by_date):
+    return min(prices_by_date.values()) if prices_by_date else float('inf')
+
+
+def solve(legs, home_iata, stop_iatas, itinerary_types=ITINERARY_TYPES, stay_from=2, stay_to=7,
+          max_trip_days=14, top_n=10):
+    """
+    Finds the top_n cheapest itineraries. legs is {(origin, destination): {date: price}}.
+    stay_from/stay_to bound the days spent at each stop (for open jaw, between
+    landing at B and flying home from C); max_trip_days bounds the whole trip.
+    Returns a list of {'type', 'total_price', 'legs': [(origin, destination, date, price)]}.
+    """
+    stops = [stop for stop in stop_iatas if stop != home_iata]
+    open_jaw = 'open_jaw' in itinerary_types
+    two_stop = 'two_stop' in itinerary_types
+
+    # Lower bounds for the remaining cost from each stop
+    cheapest_home = {stop: _cheapest(legs.get((stop, home_iata), {})) for stop in stops}
+    cheapest_home_except = {
+        stop: min((cheapest_home[other] for other in stops if other != stop), default=float('inf'))
+        for stop in stops
+    }
+    cheapest_hop_home = {
+        stop: min((_cheapest(legs.get((stop, other), {})) + cheapest_home[other] for other in stops if other != stop),
+                  default=float('inf'))
+        for stop in stops
+    }
+
+    def remaining_bound(stop, visited):
+        if len(visited) == 2:
+            return cheapest_home[stop]
+        bounds = []
+        if open_jaw:
+            bounds.append(cheapest_home_except[stop])
+        if two_stop:
+            bounds.append(cheapest_hop_home[stop])
+        return min(bounds, default=float('inf'))
+
+    def departures(route, first_day, last_day):
+        prices = legs.get(route)
+        if not prices:
+            return
+        for offset in range((last_day - first_day).days + 1):
+            day = first_day + timedelta(days=offset)
+            price = prices.get(day)
+            if price is not None:
+                yield day, price
+
+    results = []
+    best_complete = [] # Max-heap (negated) of the top_n cheapest complete costs pushed so far
+    counter = itertools.count() # Tie breaker so heap entries never compare their payloads
+    heap = []
+
+    def bound():
+        return -best_complete[0] if len(best_complete) >= top_n else float('inf')
+
+    def push(cost, estimate, state):
+        if estimate >= bound():
+            return # Can't make the top_n
+        if state[0] == 'done':
+            heapq.heappush(best_complete, -cost)
+            if len(best_complete) > top_n:
+                heapq.heappop(best_complete)
+        heapq.heappush(heap, (estimate, next(counter), cost, state))
+
+    # Seed with every outbound leg
+    for stop in stops:
+        for day, price in legs.get((home_iata, stop), {}).items():
+            visited = (stop,)
+            push(price, price + remaining_bound(stop, visited),
+                 ('at_stop', stop, day, visited, ((home_iata, stop, day, price),)))
+
+    expansions = 0
+    while heap and len(results) < top_n and expansions < MAX_EXPANSIONS:
+        _, _, cost, state = heapq.heappop(heap)
+        expansions += 1
+        if state[0] == 'done':
+            _, itinerary_type, trip_legs = state
+            results.append({'type': itinerary_type, 'total_price': round(cost, 2), 'legs': list(trip_legs)})
+            continue
+
+        _, stop, day, visited, trip_legs = state
+        trip_start = trip_legs[0][2]
+        first_day = day + timedelta(days=stay_from)
+        last_day = min(day + timedelta(days=stay_to), trip_start + timedelta(days=max_trip_days))
+        if first_day > last_day:
+            continue
+
+        if len(visited) == 2:
+            for return_day, price in departures((stop, home_iata), first_day, last_day):
+                push(cost + price, cost + price,
+                     ('done', 'two_stop', trip_legs + ((stop, home_iata, return_day, price),)))
+            continue
+
+        for other in stops:
+            if other == stop:
+                continue
+            if open_jaw:
+                for return_day, price in departures((other, home_iata), first_day, last_day):
+                    push(cost + price, cost + price,
+                         ('done', 'open_jaw', trip_legs + ((other, home_iata, return_day, price),)))
+            if two_stop:
+                for hop_day, price in departures((stop, other), first_day, last_day):
+                    next_visited = visited + (other,)
+                    push(cost + price, cost + price + remaining_bound(other, next_visited),
+                         ('at_stop', other, hop_day, next_visited, trip_legs + ((stop, other, hop_day, price),)))
+
+    print(f"Itinerary search: {len(results)} itineraries after {expansions} expansions.")
+    return results
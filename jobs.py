@@ -0,0 +1,141 @@
+"""
+In-process background job queue for long-running searches.
+
+Searches too large to finish within a request timeout are submitted here and
+run on a small pool of worker threads; the request returns a job ID right
+away and the client polls for the result. Jobs are keyed by their normalized
+parameters: submitting an identical search while one is queued, running, or
+finished within the retention TTL returns the existing job instead of
+starting a new one.
+
+Jobs live in the worker process's memory, so polling must reach the same
+process (the default single gunicorn worker, or sticky sessions).
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+import metrics
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_RESULT_TTL_SECONDS = float(os.environ.get('JOB_RESULT_TTL_SECONDS', 600)) # Finished jobs are reused/kept this long
+JOB_MAX_RETAINED = int(os.environ.get('JOB_MAX_RETAINED', 200)) # Oldest finished jobs are dropped beyond this
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+
+
+class Job:
+    def __init__(self, kind, key, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, ttl_seconds=JOB_RESULT_TTL_SECONDS, max_retained=JOB_MAX_RETAINED):
+        self.workers = workers
+        self.ttl_seconds = ttl_seconds
+        self.max_retained = max_retained
+        self._queue = queue.Queue()
+        self._jobs = {} # job id -> Job, in submission order
+        self._by_key = {} # normalized parameters -> job id
+        self._lock = threading.Lock()
+        self._threads = []
+        self._sequence = itertools.count(1)
+
+    def _start_workers(self):
+        # Started on first submit so importing the app doesn't spawn threads
+        if self._threads:
+            return
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'search-job-{next(self._sequence)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, key, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) unless an equivalent job is pending or fresh. Returns (job, reused)."""
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(self._by_key.get((kind, key)))
+            if existing is not None and existing.status != FAILED:
+                metrics.SEARCH_JOBS.inc(kind=kind, event='reused')
+                return existing, True
+            job = Job(kind, key, func, args, kwargs)
+            self._jobs[job.id] = job
+            self._by_key[(kind, key)] = job.id
+            self._start_workers()
+        self._queue.put(job)
+        metrics.SEARCH_JOBS.inc(kind=kind, event='submitted')
+        metrics.SEARCH_JOB_QUEUE_DEPTH.set(self._queue.qsize())
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        """Drops finished jobs past their TTL, then the oldest finished ones over the retention cap."""
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.ttl_seconds]
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished and job_id not in expired]
+        expired += finished[:max(0, len(finished) - self.max_retained)]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get((job.kind, job.key)) == job_id:
+                del self._by_key[(job.kind, job.key)]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            metrics.SEARCH_JOB_QUEUE_DEPTH.set(self._queue.qsize())
+            job.status = RUNNING
+            job.started_at = time.time()
+            outcome = 'error'
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                job.status = SUCCEEDED
+                outcome = 'success'
+            except Exception as e:
+                print(f"Search job {job.id} ({job.kind}) failed: {e}")
+                traceback.print_exc()
+                job.error = str(e) or e.__class__.__name__
+                job.status = FAILED
+            finally:
+                job.finished_at = time.time()
+                job.func = job.args = job.kwargs = None # Don't keep the inputs alive for the TTL
+                metrics.SEARCH_JOB_DURATION.observe(job.finished_at - job.started_at, kind=job.kind, outcome=outcome)
+                metrics.SEARCH_JOBS.inc(kind=job.kind, event='succeeded' if outcome == 'success' else 'failed')
+                self._queue.task_done()
+
+
+search_jobs = JobQueue()
@@ -0,0 +1,150 @@
+"""
+Multi-origin "meet-up" search: the cheapest common destination for several origins.
+
+All travellers fly out on the same day and home on the same day. For each
+destination the per-origin round trip prices come from the vectorized price
+matrix (one-way cheapestPerDay fares, see price_matrix.py); stacking them over
+origins and reducing with sum (group total) or max (worst-off traveller)
+gives the objective for every (departure day, stay length).
+
+Outbound legs are fetched for the whole grid first. The cheapest common
+outbound day gives a lower bound per destination, so destinations are
+evaluated best-bound first and return legs are only fetched until no
+remaining destination can make the top results.
+"""
+import heapq
+import math
+from datetime import date, timedelta
+
+import numpy as np
+
+import airports
+import fare_client
+import fare_search
+import price_matrix
+
+OBJECTIVES = {
+    'sum': np.sum, # Cheapest for the group as a whole
+    'max': np.max, # Cheapest for the most expensive traveller
+}
+
+
+def _lower_bound(outbound_prices, objective):
+    """
+    Bound from outbound legs only: everyone must fly out on the same day and
+    return legs can't cost less than zero.
+    """
+    common_days = set.intersection(*(set(prices) for prices in outbound_prices))
+    if not common_days:
+        return float('inf')
+    aggregate = sum if objective == 'sum' else max
+    return min(aggregate(prices[day] for prices in outbound_prices) for day in common_days)
+
+
+def evaluate_destination(destination, origins, outbound, inbound, start_date, num_days,
+                         duration_from, duration_to, objective):
+    """
+    Returns the best meet-up for one destination, or None if no common dates exist.
+    outbound/inbound map origin -> {date: price} for this destination.
+    """
+    matrices = []
+    for origin in origins:
+        out_array = price_matrix.prices_to_array(outbound[origin], start_date, num_days)
+        in_array = price_matrix.prices_to_array(inbound[origin], start_date, num_days + duration_to)
+        matrix, durations = price_matrix.build_matrix(out_array, in_array, duration_from, duration_to)
+        matrices.append(matrix)
+    stacked = np.stack(matrices) # (origins, departure days, durations)
+    combined = OBJECTIVES[objective](stacked, axis=0) # NaN wherever any origin has no fare
+    filled = np.where(np.isnan(combined), np.inf, combined)
+    if not np.isfinite(filled).any():
+        return None
+
+    day_index, duration_index = np.unravel_index(np.argmin(filled), filled.shape)
+    out_date = start_date + timedelta(days=int(day_index))
+    duration = int(durations[duration_index])
+    in_date = out_date + timedelta(days=duration)
+    per_origin = [{
+        'origin_iata': origin,
+        'out_price': outbound[origin][out_date],
+        'in_price': inbound[origin][in_date],
+        'price': round(float(stacked[i, day_index, duration_index]), 2),
+    } for i, origin in enumerate(origins)]
+    return {
+        'destination_iata': destination,
+        'objective_price': round(float(filled[day_index, duration_index]), 2),
+        'total_price': round(sum(traveller['price'] for traveller in per_origin), 2),
+        'max_price': max(traveller['price'] for traveller in per_origin),
+        'out_date': out_date,
+        'in_date': in_date,
+        'duration': duration,
+        'travellers': per_origin,
+    }
+
+
+def find_meetups(origins, destinations, months, duration_from, duration_to, objective='sum',
+                 currency='EUR', top_n=5):
+    """
+    Returns (meetups, stats, errors): the top_n destinations by objective
+    (cheapest first), counters showing how much of the grid was fetched, and
+    fetch errors as {(origin, destination): error}.
+    """
+    destinations = [d for d in destinations if d not in origins]
+    y, m = months[-1]
+    inbound_months = months + fare_search.months_from(y, m, 2)[1:]
+    start_date = date(*months[0], 1)
+    num_days = (date(*inbound_months[-1], 1) - start_date).days
+
+    # Destinations some origin can't fly to can never host the meet-up
+    destinations = [d for d in destinations if all(airports.serves(origin, d) for origin in origins)]
+
+    # --- Phase 1: outbound legs for the whole grid --- #
+    outbound, errors = fare_search.fetch_daily_fares(
+        [(origin, destination, ym) for destination in destinations for origin in origins for ym in months], currency)
+
+    candidates = []
+    for destination in destinations:
+        bound = _lower_bound([outbound[(origin, destination)] for origin in origins], objective)
+        if bound != float('inf'):
+            candidates.append((bound, destination))
+    candidates.sort()
+
+    # --- Phase 2: return legs, best bound first, until bounds rule out the rest --- #
+    # Enough destinations per round to keep the fetch pool busy
+    batch_size = max(1, math.ceil(fare_client.FARE_FETCH_WORKERS / (len(origins) * len(inbound_months))))
+    best = [] # Max-heap (negated) of the top_n objective prices
+    meetups = []
+    evaluated = 0
+    position = 0
+    while position < len(candidates):
+        if len(best) >= top_n and candidates[position][0] >= -best[0]:
+            break # Every remaining destination's bound is already beaten
+        batch = [destination for _, destination in candidates[position:position + batch_size]]
+        position += len(batch)
+        inbound, inbound_errors = fare_search.fetch_daily_fares(
+            [(destination, origin, ym) for destination in batch for origin in origins for ym in inbound_months],
+            currency)
+        errors.update(inbound_errors)
+
+        for destination in batch:
+            evaluated += 1
+            meetup = evaluate_destination(
+                destination, origins,
+                {origin: outbound[(origin, destination)] for origin in origins},
+                {origin: inbound[(destination, origin)] for origin in origins},
+                start_date, num_days, duration_from, duration_to, objective)
+            if meetup is None:
+                continue
+            meetups.append(meetup)
+            heapq.heappush(best, -meetup['objective_price'])
+            if len(best) > top_n:
+                heapq.heappop(best)
+
+    meetups.sort(key=lambda meetup: meetup['objective_price'])
+    stats = {
+        'destinations': len(destinations),
+        'candidates': len(candidates), # Destinations every origin can fly to
+        'evaluated': evaluated,
+        'skipped': len(candidates) - evaluated,
+    }
+    print(f"Meet-up search ({objective}): evaluated {evaluated} of {len(candidates)} reachable destinations.")
+    return meetups[:top_n], stats, errors
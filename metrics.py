@@ -0,0 +1,246 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are kept in memory per worker process and
+rendered by the /metrics route. No external client library is required.
+"""
+import threading
+import time
+import functools
+from contextlib import contextmanager
+
+# Latency buckets in seconds (upstream calls can take tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REGISTRY = [] # All metrics, in registration order
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _sample_lines(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._sample_lines())
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _sample_lines(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback # Optional function computing an unlabelled value at render time
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _sample_lines(self):
+        if self._callback is not None:
+            return [f"{self.name} {_format_value(self._callback())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts, sum, count]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager observing the wall-clock duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _sample_lines(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, extra=[('le', _format_value(upper_bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render_prometheus():
+    """Returns all registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === Application Metrics ===
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Flask request latency per route.',
+    labelnames=('endpoint', 'method', 'status'))
+
+UPSTREAM_REQUEST_DURATION = Histogram(
+    'upstream_request_duration_seconds', 'Ryanair API call latency per URL template.',
+    labelnames=('template', 'status'))
+
+UPSTREAM_PARSE_DURATION = Histogram(
+    'upstream_json_parse_seconds', 'Time spent decoding Ryanair API JSON responses.',
+    labelnames=('template',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+UPSTREAM_FARES_PER_RESPONSE = Histogram(
+    'upstream_fares_per_response', 'Number of fares contained in each Ryanair API response.',
+    labelnames=('template',),
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+
+FARE_CACHE_REQUESTS = Counter(
+    'fare_cache_requests_total', 'Fare cache lookups by result (hit or miss; bypass for fetches that skip the cache).',
+    labelnames=('result',))
+
+
+def _fare_cache_hit_ratio():
+    hits = FARE_CACHE_REQUESTS.value(result='hit')
+    total = hits + FARE_CACHE_REQUESTS.value(result='miss')
+    return hits / total if total else 0
+
+
+FARE_CACHE_HIT_RATIO = Gauge(
+    'fare_cache_hit_ratio', 'Share of fare lookups served from the cache since worker start.',
+    callback=_fare_cache_hit_ratio)
+
+SCHEDULER_JOB_DURATION = Histogram(
+    'scheduler_job_duration_seconds', 'Background scheduler job run time.',
+    labelnames=('job', 'outcome'))
+
+
+def track_job_duration(func):
+    """Decorator recording a scheduler job's duration and outcome."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = func(*args, **kwargs)
+            outcome = 'success'
+            return result
+        finally:
+            SCHEDULER_JOB_DURATION.observe(time.perf_counter() - start, job=func.__name__, outcome=outcome)
+    return wrapper
+
+SEARCH_JOBS = Counter(
+    'search_jobs_total', 'Background search jobs by event (submitted, reused, succeeded, failed).',
+    labelnames=('kind', 'event'))
+
+SEARCH_JOB_DURATION = Histogram(
+    'search_job_duration_seconds', 'Background search job run time, from start to finish.',
+    labelnames=('kind', 'outcome'))
+
+SEARCH_JOB_QUEUE_DEPTH = Gauge(
+    'search_job_queue_depth', 'Background search jobs waiting for a worker.')
+
+PAGE_CACHE_REQUESTS = Counter(
+    'page_cache_requests_total', 'Rendered-page cache lookups by result (hit, miss or bypass).',
+    labelnames=('endpoint', 'result'))
+
+PAGE_CACHE_INVALIDATIONS = Counter(
+    'page_cache_invalidations_total', 'Cached pages dropped because the fare data behind them changed.')
+
+PRICE_REFRESHES = Counter(
+    'price_history_refreshes_total', 'Route-months refreshed by the price history collector.',
+    labelnames=('result',))
+PRICE_REFRESH_OVERDUE = Gauge(
+    'price_history_refresh_overdue', 'Route-months due for a refresh but left for a later run by the per-run budget.')
+
+HISTORY_CACHE_REQUESTS = Counter(
+    'price_history_cache_requests_total', 'Price history reads by store (raw rows or daily rollup) and result.',
+    labelnames=('kind', 'result'))
+
+BUDGET_EXHAUSTED = Counter(
+    'fare_budget_exhausted_total', 'Requests, jobs or single responses that hit their fare or payload budget.',
+    labelnames=('scope', 'resource'))
+
+RULE_SNAPSHOT_DIFFS = Counter(
+    'rule_snapshot_diffs_total', 'Upstream responses offered to the alert rule matcher by diff result (new, unchanged or changed).',
+    labelnames=('result',))
+RULE_FARES_EVALUATED = Counter(
+    'rule_fares_evaluated_total', 'Round trip fares matched against the alert rule index (new or changed fares only).')
@@ -0,0 +1,150 @@
+"""
+Rendered-page cache for the fare result pages.
+
+A cached page is the gzip-compressed HTML of a view, keyed on the endpoint
+and the normalized query (form and query string values, IATA codes
+uppercased and whitespace collapsed). While rendering, the fare client
+records every upstream response the page was built from together with its
+cache version (see fare_client.track_dependencies()). A cached page is only
+served while all of those responses are still in the fare cache with the same
+version, so it drops out as soon as the fare cache refreshes or expires them,
+or when the FX rate table it converted prices with is replaced.
+
+Pages that show flash messages (errors, warnings) are never cached, and a
+request with pending flashes always renders fresh so the messages show up.
+"""
+import functools
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import get_flashed_messages, make_response, request, session
+
+import fare_client
+import fx
+import metrics
+
+PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 256))
+PAGE_CACHE_GZIP_LEVEL = int(os.environ.get('PAGE_CACHE_GZIP_LEVEL', 6))
+
+_pages = OrderedDict() # key -> entry dict, least recently used first
+_pages_lock = threading.Lock()
+
+
+def _normalize_value(name, value):
+    value = ' '.join(value.split())
+    return value.upper() if 'iata' in name else value
+
+
+def page_key():
+    """Cache key for the current request: endpoint plus its sorted, normalized parameters."""
+    params = [(name, _normalize_value(name, value))
+              for source in (request.args, request.form)
+              for name, values in source.lists()
+              for value in values]
+    return request.endpoint, tuple(sorted(params))
+
+
+def _is_current(entry):
+    return entry['rates'] is fx.get_table() and all(
+        fare_client.cache_version(api_url) == version for api_url, version in entry['dependencies'].items())
+
+
+def get(key):
+    with _pages_lock:
+        entry = _pages.get(key)
+    if entry is None:
+        return None
+    if not _is_current(entry):
+        with _pages_lock:
+            if _pages.get(key) is entry:
+                del _pages[key]
+        metrics.PAGE_CACHE_INVALIDATIONS.inc()
+        return None
+    with _pages_lock:
+        if key in _pages:
+            _pages.move_to_end(key)
+    return entry
+
+
+def put(key, body, mimetype, dependencies):
+    """Stores a rendered page. Returns the entry, or None if it depends on uncached data."""
+    if not dependencies or None in dependencies.values():
+        return None
+    entry = {
+        'body_gz': gzip.compress(body, compresslevel=PAGE_CACHE_GZIP_LEVEL),
+        'size': len(body),
+        'mimetype': mimetype,
+        'dependencies': dict(dependencies),
+        'rates': fx.get_table(), # Converted prices go stale when another worker refreshes the rates
+        'created_at': time.time(),
+    }
+    with _pages_lock:
+        _pages[key] = entry
+        _pages.move_to_end(key)
+        while len(_pages) > PAGE_CACHE_MAX_ENTRIES:
+            _pages.popitem(last=False)
+    return entry
+
+
+def clear():
+    with _pages_lock:
+        _pages.clear()
+
+
+def _accepts_gzip():
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+
+def _entry_response(entry):
+    if _accepts_gzip():
+        response = make_response(entry['body_gz'])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(gzip.decompress(entry['body_gz']))
+    response.mimetype = entry['mimetype']
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _has_flashes():
+    # Pending flashes are checked first so get_flashed_messages() never consumes them unseen
+    return bool(session.get('_flashes')) or bool(get_flashed_messages())
+
+
+def cached_page(view):
+    """
+    Decorator serving a view's HTML from the page cache while the fare data
+    behind it is unchanged. Only plain 200 HTML responses without flash
+    messages are stored.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PAGE_CACHE_ENABLED or session.get('_flashes'):
+            metrics.PAGE_CACHE_REQUESTS.inc(endpoint=request.endpoint, result='bypass')
+            return view(*args, **kwargs)
+
+        key = page_key()
+        entry = get(key)
+        if entry is not None:
+            metrics.PAGE_CACHE_REQUESTS.inc(endpoint=request.endpoint, result='hit')
+            return _entry_response(entry)
+        metrics.PAGE_CACHE_REQUESTS.inc(endpoint=request.endpoint, result='miss')
+
+        with fare_client.track_dependencies() as dependencies:
+            response = make_response(view(*args, **kwargs))
+        if (response.status_code != 200 or response.mimetype != 'text/html'
+                or response.is_streamed or _has_flashes()):
+            return response
+        entry = put(key, response.get_data(), response.mimetype, dependencies)
+        return _entry_response(entry) if entry is not None else response
+    return wrapper
+
+
+def prerender(flask_app, view, path):
+    """Renders path through the (cached) view outside a request, so the next visitor gets the stored page."""
+    with flask_app.test_request_context(path):
+        view()
@@ -0,0 +1,80 @@
+"""
+Vectorized round trip price matrix built from one-way cheapestPerDay fares.
+
+Daily outbound and inbound prices are loaded into NumPy arrays indexed by day
+offset from the start of the horizon. The combined price of every
+(departure day, stay length) cell is then a single broadcast addition:
+
+    matrix[i, j] = outbound[i] + inbound[i + durations[j]]
+
+Missing days are NaN and propagate, so unavailable combinations drop out.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+
+def prices_to_array(prices_by_date, start_date, num_days):
+    """Returns a float array of length num_days (NaN where no fare) from {date: price}."""
+    prices = np.full(num_days, np.nan)
+    for departure_date, price in prices_by_date.items():
+        offset = (departure_date - start_date).days
+        if 0 <= offset < num_days and price is not None:
+            prices[offset] = price
+    return prices
+
+
+def build_matrix(outbound, inbound, duration_from, duration_to):
+    """
+    Returns (matrix, durations) where matrix has shape (len(outbound), len(durations)).
+    inbound may be shorter than len(outbound) + duration_to; missing days count as NaN.
+    """
+    durations = np.arange(duration_from, duration_to + 1)
+    needed = len(outbound) + duration_to
+    if len(inbound) < needed:
+        inbound = np.concatenate([inbound, np.full(needed - len(inbound), np.nan)])
+    return_index = np.arange(len(outbound))[:, None] + durations[None, :]
+    return outbound[:, None] + inbound[return_index], durations
+
+
+def _nan_to_none(values):
+    return [None if np.isnan(v) else round(float(v), 2) for v in values]
+
+
+def summarize(matrix, durations, start_date):
+    """
+    Reduces a price matrix to template-friendly results:
+      best         - overall cheapest cell (or None)
+      by_duration  - cheapest cell for each stay length
+      rows         - per departure day: date, combined prices per duration, cheapest duration
+    """
+    filled = np.where(np.isnan(matrix), np.inf, matrix)
+
+    def _cell(i, j):
+        if not np.isfinite(filled[i, j]):
+            return None
+        out_date = start_date + timedelta(days=int(i))
+        return {
+            'price': round(float(filled[i, j]), 2),
+            'duration': int(durations[j]),
+            'out_date': out_date,
+            'in_date': out_date + timedelta(days=int(durations[j])),
+        }
+
+    best = None
+    if filled.size:
+        i, j = np.unravel_index(np.argmin(filled), filled.shape)
+        best = _cell(i, j)
+
+    best_day_per_duration = np.argmin(filled, axis=0) if filled.size else []
+    by_duration = [cell for cell in (_cell(i, j) for j, i in enumerate(best_day_per_duration)) if cell]
+
+    row_best = np.argmin(filled, axis=1) if filled.size else []
+    row_has_fare = np.isfinite(filled).any(axis=1) if filled.size else []
+    rows = [{
+        'date': start_date + timedelta(days=i),
+        'prices': _nan_to_none(matrix[i]),
+        'best_duration': int(durations[row_best[i]]) if row_has_fare[i] else None,
+    } for i in range(matrix.shape[0])]
+
+    return {'best': best, 'by_duration': by_duration, 'rows': rows}
@@ -0,0 +1,169 @@
+"""
+Incremental per-(route, departure date) fare statistics for price-drop alerts.
+
+Every daily fare collect_price_history() ingests updates the running stats
+for its (origin, destination, departure_date) in O(1): count, mean and
+variance (Welford's algorithm), minimum, and an exponentially weighted moving
+average. Each entry also remembers its baselines from before the latest
+observation, so the newest price can be compared against history that doesn't
+already include it.
+
+Price-drop rules are then evaluated from these stats alone; the
+price_history table is never re-queried.
+"""
+import math
+import os
+import threading
+from datetime import date, timedelta
+
+PRICE_STATS_EWMA_ALPHA = float(os.environ.get('PRICE_STATS_EWMA_ALPHA', 0.3)) # Weight of the newest price
+PRICE_DROP_MIN_SAMPLES = int(os.environ.get('PRICE_DROP_MIN_SAMPLES', 5)) # Observations needed before a drop can fire
+
+BASELINES = ('mean', 'min', 'ewma')
+
+
+class FareStats:
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'ewma', 'last_price', 'previous')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of squared differences from the mean
+        self.minimum = None
+        self.ewma = None
+        self.last_price = None
+        self.previous = None # {'mean', 'min', 'ewma'} before the latest observation
+
+    def update(self, price, alpha=PRICE_STATS_EWMA_ALPHA):
+        self.previous = self.baselines() if self.count else None
+        self.count += 1
+        delta = price - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (price - self.mean)
+        self.minimum = price if self.minimum is None else min(self.minimum, price)
+        self.ewma = price if self.ewma is None else alpha * price + (1 - alpha) * self.ewma
+        self.last_price = price
+
+    def baselines(self):
+        return {'mean': self.mean, 'min': self.minimum, 'ewma': self.ewma}
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    def to_list(self):
+        previous = self.previous or {}
+        return [self.count, self.mean, self.m2, self.minimum, self.ewma, self.last_price,
+                previous.get('mean'), previous.get('min'), previous.get('ewma')]
+
+    @classmethod
+    def from_list(cls, values):
+        stats = cls()
+        (stats.count, stats.mean, stats.m2, stats.minimum, stats.ewma, stats.last_price,
+         prev_mean, prev_min, prev_ewma) = values
+        if prev_mean is not None:
+            stats.previous = {'mean': prev_mean, 'min': prev_min, 'ewma': prev_ewma}
+        return stats
+
+
+class PriceStatsStore:
+    def __init__(self):
+        self._stats = {} # (origin, destination, departure_date) -> FareStats
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def observe(self, origin_iata, destination_iata, departure_date, price):
+        if price is None:
+            return
+        key = (origin_iata, destination_iata, departure_date)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = FareStats()
+            stats.update(float(price))
+
+    def get(self, origin_iata, destination_iata, departure_date):
+        return self._stats.get((origin_iata, destination_iata, departure_date))
+
+    def prune(self, today=None):
+        """Drops stats for departure dates that have passed. Returns how many were removed."""
+        today = today or date.today()
+        with self._lock:
+            expired = [key for key in self._stats if key[2] < today]
+            for key in expired:
+                del self._stats[key]
+        return len(expired)
+
+    def export(self):
+        """Returns [[origin, destination, 'YYYY-MM-DD', *stats]] for the state snapshot."""
+        with self._lock:
+            items = list(self._stats.items())
+        return [[origin, destination, departure_date.isoformat()] + stats.to_list()
+                for (origin, destination, departure_date), stats in items]
+
+    def restore(self, rows):
+        """Loads exported rows, keeping entries already observed since startup. Returns the number restored."""
+        restored = 0
+        today = date.today()
+        with self._lock:
+            for row in rows:
+                try:
+                    key = (row[0], row[1], date.fromisoformat(row[2]))
+                    stats = FareStats.from_list(row[3:])
+                except (ValueError, TypeError, IndexError):
+                    continue
+                if key[2] >= today and key not in self._stats:
+                    self._stats[key] = stats
+                    restored += 1
+        return restored
+
+
+def _dropped(stats_list, baseline, drop_percent, min_samples):
+    """(price, baseline_price) if the summed latest prices are drop_percent below the summed baselines, else None."""
+    if any(stats is None or stats.previous is None or stats.count < min_samples for stats in stats_list):
+        return None
+    price = sum(stats.last_price for stats in stats_list)
+    baseline_price = sum(stats.previous[baseline] for stats in stats_list)
+    if price <= baseline_price * (1 - drop_percent / 100.0):
+        return price, baseline_price
+    return None
+
+
+def find_price_drops(store, origin_iata, destination_iata, year, month, duration_from, duration_to,
+                     drop_percent, baseline='mean', min_samples=PRICE_DROP_MIN_SAMPLES):
+    """
+    Round trips departing in year/month whose latest combined price is at least
+    drop_percent below the combined baseline of both legs. Returns dicts with
+    out_date, in_date, price and baseline_price, biggest drop first.
+    """
+    drops = []
+    day = date(year, month, 1)
+    while day.month == month:
+        outbound = store.get(origin_iata, destination_iata, day)
+        if outbound is not None:
+            for duration in range(duration_from, duration_to + 1):
+                in_date = day + timedelta(days=duration)
+                result = _dropped([outbound, store.get(destination_iata, origin_iata, in_date)],
+                                  baseline, drop_percent, min_samples)
+                if result is not None:
+                    price, baseline_price = result
+                    drops.append({
+                        'out_date': day,
+                        'in_date': in_date,
+                        'price': round(price, 2),
+                        'baseline_price': round(baseline_price, 2),
+                        'drop_percent': round(100.0 * (1 - price / baseline_price), 1) if baseline_price else 0.0,
+                    })
+        day += timedelta(days=1)
+    drops.sort(key=lambda drop: -drop['drop_percent'])
+    return drops
+
+
+# Process-wide store fed by the price history collector
+route_stats = PriceStatsStore()
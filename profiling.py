@@ -0,0 +1,291 @@
+"""
+Opt-in profiling: per-request traces, slow-request logs and a sampling profiler.
+
+Traces
+    A traced request or scheduler job records a span for every upstream call
+    ('upstream'), JSON parse ('parse'), template render ('render') and
+    Supabase query ('supabase') it makes, including those run on the fare
+    client's worker threads. Requests are traced when they send an
+    "X-Trace: 1" header or are picked by PROFILE_TRACE_SAMPLE_RATE (0-1,
+    also applied to scheduler jobs). Traced responses carry a Server-Timing
+    header (shown in the browser dev tools) and an X-Trace-Id; the last
+    PROFILE_KEEP_TRACES traces are kept for /admin/traces.
+
+Slow requests
+    Requests slower than SLOW_REQUEST_SECONDS and jobs slower than
+    SLOW_JOB_SECONDS are logged, with their span breakdown when traced.
+
+Sampling profiler
+    capture_profile() samples the stacks of every thread in the worker every
+    few milliseconds for a few seconds in a background thread, and keeps the
+    aggregated result (top functions, or folded stacks for flame graph
+    tools) for /admin/profile.
+"""
+import collections
+import contextlib
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+PROFILE_TRACE_SAMPLE_RATE = float(os.environ.get('PROFILE_TRACE_SAMPLE_RATE', 0)) # Share of requests/jobs traced without a header
+PROFILE_KEEP_TRACES = int(os.environ.get('PROFILE_KEEP_TRACES', 50))
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 2.0))
+SLOW_JOB_SECONDS = float(os.environ.get('SLOW_JOB_SECONDS', 30.0))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+
+TRACE_HEADER = 'X-Trace'
+
+_current = contextvars.ContextVar('profiling_trace', default=None)
+_recent_traces = collections.deque(maxlen=PROFILE_KEEP_TRACES)
+
+
+class Trace:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = [] # (name, start offset s, duration s, attrs)
+        self.counts = collections.Counter() # Events too cheap for a span, e.g. fare cache hits
+        self._start = time.perf_counter()
+        self._render_starts = [] # Open template renders (they nest for included templates)
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, attrs=None):
+        with self._lock:
+            self.spans.append((name, start - self._start, end - start, attrs or {}))
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        return self
+
+    def totals(self):
+        """{span name: (count, total seconds)}; spans run in parallel add up beyond the wall time."""
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for name, _, duration, _ in spans:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + duration)
+        return totals
+
+    def server_timing(self):
+        """Server-Timing header value: one entry per span kind plus the total."""
+        entries = [f'{name};dur={total * 1000:.1f};desc="{count}x"' for name, (count, total) in self.totals().items()]
+        if self.duration is not None:
+            entries.append(f'total;dur={self.duration * 1000:.1f}')
+        return ', '.join(entries)
+
+    def summary(self):
+        parts = [f"{name} {count}x {total * 1000:.0f}ms" for name, (count, total) in self.totals().items()]
+        parts += [f"{name} {count}x" for name, count in self.counts.items()]
+        return ', '.join(parts) or 'no spans'
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+            counts = dict(self.counts)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 1) if self.duration is not None else None,
+            'totals_ms': {name: round(total * 1000, 1) for name, (_, total) in self.totals().items()},
+            'counts': counts,
+            'spans': [{'name': name, 'start_ms': round(start * 1000, 1), 'duration_ms': round(duration * 1000, 1), **attrs}
+                      for name, start, duration, attrs in sorted(spans, key=lambda span: span[1])],
+        }
+
+
+def should_trace(header_value=None):
+    if header_value and header_value.strip().lower() not in ('0', 'false', 'no'):
+        return True
+    return PROFILE_TRACE_SAMPLE_RATE > 0 and random.random() < PROFILE_TRACE_SAMPLE_RATE
+
+
+def current():
+    return _current.get()
+
+
+def start_trace(name):
+    """Makes a new trace current. Returns the token for finish_trace()."""
+    return _current.set(Trace(name))
+
+
+def finish_trace(token):
+    """Ends the trace started with token, keeps it for /admin/traces and returns it."""
+    trace = _current.get().finish()
+    _current.reset(token)
+    _recent_traces.append(trace)
+    return trace
+
+
+def recent_traces():
+    return [trace.to_dict() for trace in reversed(_recent_traces)]
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Records a span on the current trace; a no-op when nothing is traced."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), attrs)
+
+
+def count(name):
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name)
+
+
+def log_if_slow(kind, name, duration, trace=None):
+    threshold = SLOW_JOB_SECONDS if kind == 'job' else SLOW_REQUEST_SECONDS
+    if duration >= threshold:
+        breakdown = trace.summary() if trace is not None else f"not traced; send '{TRACE_HEADER}: 1' for a breakdown"
+        print(f"SLOW {kind}: {name} took {duration:.2f}s ({breakdown})")
+
+
+@contextlib.contextmanager
+def job_trace(name):
+    """Traces a scheduler job if sampled and logs it when slow."""
+    token = start_trace(f"job {name}") if should_trace() else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = finish_trace(token) if token is not None else None
+        log_if_slow('job', name, time.perf_counter() - start, trace)
+
+
+# --- Template Render Spans --- #
+
+def _before_render(sender, template, context, **extra):
+    trace = _current.get()
+    if trace is not None:
+        trace._render_starts.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    trace = _current.get()
+    if trace is not None and trace._render_starts:
+        trace.add_span('render', trace._render_starts.pop(), time.perf_counter(), {'template': template.name})
+
+
+def connect_template_signals(flask_app):
+    """Records a 'render' span for each render_template() of a traced request."""
+    from flask import before_render_template, template_rendered
+    before_render_template.connect(_before_render, flask_app)
+    template_rendered.connect(_after_render, flask_app)
+
+
+# === Sampling Profiler ===
+
+_profile_lock = threading.Lock()
+_profile_state = {'running': False, 'result': None}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _sample(seconds, interval):
+    own_ident = threading.get_ident()
+    thread_names = {}
+    stacks = collections.Counter() # (thread name, frame labels root first) -> samples
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if len(thread_names) != threading.active_count():
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[(thread_names.get(ident, str(ident)), tuple(reversed(labels)))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def _run_capture(seconds, interval):
+    started_at = time.time()
+    try:
+        stacks, samples = _sample(seconds, interval)
+        result = {'started_at': started_at, 'seconds': seconds, 'interval_ms': interval * 1000,
+                  'samples': samples, 'stacks': stacks}
+    except Exception as e:
+        result = {'started_at': started_at, 'error': str(e)}
+    with _profile_lock:
+        _profile_state['running'] = False
+        _profile_state['result'] = result
+    print(f"Sampling profile finished: {result.get('samples', 0)} samples over {seconds}s.")
+
+
+def capture_profile(seconds=5.0, interval_ms=10.0):
+    """
+    Starts sampling every thread's stack in the background. Returns False if a
+    capture is already running. The result is read with profile_report().
+    """
+    seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+    interval = max(float(interval_ms), 1.0) / 1000
+    with _profile_lock:
+        if _profile_state['running']:
+            return False
+        _profile_state['running'] = True
+    threading.Thread(target=_run_capture, args=(seconds, interval), name='sampling-profiler', daemon=True).start()
+    return True
+
+
+def profile_running():
+    return _profile_state['running']
+
+
+def profile_report(fmt='text', top=40):
+    """
+    The last capture as text: 'text' lists the functions with the most samples
+    (self = on top of the stack, total = anywhere in it); 'folded' is one
+    'thread;frame;frame count' line per stack for flamegraph.pl or speedscope.
+    Returns None if nothing was captured yet.
+    """
+    with _profile_lock:
+        result = _profile_state['result']
+    if result is None:
+        return None
+    if 'error' in result:
+        return f"Profile capture failed: {result['error']}\n"
+    stacks = result['stacks']
+    if fmt == 'folded':
+        return ''.join(f"{';'.join((thread,) + labels)} {samples}\n" for (thread, labels), samples in stacks.most_common())
+
+    self_samples = collections.Counter()
+    total_samples = collections.Counter()
+    for (_, labels), samples in stacks.items():
+        if labels:
+            self_samples[labels[-1]] += samples
+        for label in set(labels):
+            total_samples[label] += samples
+    thread_samples = result['samples'] or 1
+    lines = [f"Sampling profile: {result['samples']} samples every {result['interval_ms']:.0f}ms over {result['seconds']}s "
+             f"(% of samples; several threads in the same function add up beyond 100)", "",
+             f"{'self %':>8} {'total %':>8}  function"]
+    for label, samples in total_samples.most_common(top):
+        lines.append(f"{100 * self_samples[label] / thread_samples:8.1f} {100 * samples / thread_samples:8.1f}  {label}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+"""
+Refresh scheduling for the price history collector.
+
+Every tracked (origin, destination, month) has its own refresh interval
+instead of one fixed cadence for all of them:
+  - Proximity: months departing soon refresh every REFRESH_MIN_INTERVAL_SECONDS;
+    the interval grows linearly with the days to the first departure still
+    ahead in the month (REFRESH_PROXIMITY_DAYS per step), up to
+    REFRESH_MAX_INTERVAL_SECONDS.
+  - Volatility: each refresh compares the daily prices with the previous ones
+    and keeps an EWMA of the share that changed. Volatile months refresh up
+    to (1 + REFRESH_VOLATILITY_WEIGHT) times more often.
+
+Items wait in a heap ordered by due time. Each collector run takes at most
+REFRESH_BUDGET_PER_RUN due items, the longest overdue first (never fetched
+items first, nearest months first), so a fixed upstream budget goes to the
+data most likely to have changed. Anything over budget stays due for the
+next run.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import date
+
+import metrics
+
+REFRESH_HORIZON_MONTHS = int(os.environ.get('REFRESH_HORIZON_MONTHS', 6)) # Months tracked, starting with the current one
+REFRESH_BUDGET_PER_RUN = int(os.environ.get('REFRESH_BUDGET_PER_RUN', 8)) # Upstream calls per collector run
+REFRESH_MIN_INTERVAL_SECONDS = float(os.environ.get('REFRESH_MIN_INTERVAL_SECONDS', 120))
+REFRESH_MAX_INTERVAL_SECONDS = float(os.environ.get('REFRESH_MAX_INTERVAL_SECONDS', 6 * 3600))
+REFRESH_PROXIMITY_DAYS = float(os.environ.get('REFRESH_PROXIMITY_DAYS', 7)) # Days out per interval step
+REFRESH_VOLATILITY_WEIGHT = float(os.environ.get('REFRESH_VOLATILITY_WEIGHT', 4))
+REFRESH_VOLATILITY_ALPHA = 0.3 # Weight of the latest change rate in the volatility EWMA
+
+
+def days_to_departure(month_dt, today=None):
+    """Days until the first departure day of month_dt that hasn't passed (0 for the current month)."""
+    today = today or date.today()
+    return max(0, (month_dt - today).days)
+
+
+def refresh_interval(days_out, volatility):
+    """Seconds between refreshes for a month days_out away whose prices change at the given rate (0-1)."""
+    interval = REFRESH_MIN_INTERVAL_SECONDS * max(1.0, days_out / REFRESH_PROXIMITY_DAYS)
+    interval /= 1.0 + REFRESH_VOLATILITY_WEIGHT * volatility
+    return min(REFRESH_MAX_INTERVAL_SECONDS, max(REFRESH_MIN_INTERVAL_SECONDS, interval))
+
+
+class _ItemState:
+    __slots__ = ('due_at', 'volatility', 'prices', 'refreshed_at')
+
+    def __init__(self, due_at):
+        self.due_at = due_at
+        self.volatility = None # EWMA of the share of daily prices that changed per refresh
+        self.prices = None # {date: price} seen on the last refresh
+        self.refreshed_at = None
+
+
+class RefreshScheduler:
+    """Priority queue of (origin, destination, month_date) items keyed by when they are next due."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {} # item -> _ItemState
+        self._heap = [] # (due_at, days_out, item); stale entries are skipped when popped
+
+    def __len__(self):
+        return len(self._items)
+
+    def sync(self, items, today=None):
+        """
+        Makes items (an iterable of (origin, destination, month_date)) the tracked
+        set: new items are due immediately, items no longer listed are dropped.
+        """
+        today = today or date.today()
+        items = set(items)
+        now = time.time()
+        with self._lock:
+            for item in [item for item in self._items if item not in items]:
+                del self._items[item]
+            for item in items - self._items.keys():
+                self._items[item] = _ItemState(now)
+                heapq.heappush(self._heap, (now, days_to_departure(item[2], today), item))
+
+    def due(self, budget=REFRESH_BUDGET_PER_RUN, now=None):
+        """
+        Returns up to budget items whose refresh is due, most overdue first.
+        Each should be passed back to record_refresh() once fetched.
+        """
+        now = now or time.time()
+        selected = []
+        with self._lock:
+            while self._heap and len(selected) < budget and self._heap[0][0] <= now:
+                due_at, _, item = heapq.heappop(self._heap)
+                state = self._items.get(item)
+                if state is not None and state.due_at == due_at:
+                    selected.append(item)
+                    # Retried after the minimum interval unless record_refresh() reschedules it
+                    state.due_at = now + REFRESH_MIN_INTERVAL_SECONDS
+                    heapq.heappush(self._heap, (state.due_at, days_to_departure(item[2]), item))
+            overdue = sum(1 for state in self._items.values() if state.due_at <= now) - len(selected)
+        metrics.PRICE_REFRESH_OVERDUE.set(overdue)
+        return selected
+
+    def record_refresh(self, item, prices, today=None):
+        """
+        Records a refresh of item with its {date: price} (None if the fetch failed)
+        and schedules the next one. Returns the new interval in seconds.
+        """
+        today = today or date.today()
+        now = time.time()
+        days_out = days_to_departure(item[2], today)
+        with self._lock:
+            state = self._items.get(item)
+            if state is None:
+                return None
+            if prices:
+                if state.prices:
+                    common = state.prices.keys() & prices.keys()
+                    changed = sum(1 for day in common if state.prices[day] != prices[day])
+                    rate = changed / len(common) if common else 0.0
+                    state.volatility = rate if state.volatility is None else (
+                        REFRESH_VOLATILITY_ALPHA * rate + (1 - REFRESH_VOLATILITY_ALPHA) * state.volatility)
+                state.prices = prices
+                state.refreshed_at = now
+            # Failed fetches retry on the proximity schedule alone
+            interval = refresh_interval(days_out, state.volatility or 0.0)
+            state.due_at = now + interval
+            heapq.heappush(self._heap, (state.due_at, days_out, item))
+        metrics.PRICE_REFRESHES.inc(result='ok' if prices else 'empty')
+        return interval
+
+    def status(self):
+        """[(item, due_at, volatility, refreshed_at)] ordered by due time, for logging."""
+        with self._lock:
+            rows = [(item, state.due_at, state.volatility, state.refreshed_at) for item, state in self._items.items()]
+        return sorted(rows, key=lambda row: row[1])
+
+
+# Process-wide scheduler used by collect_price_history()
+history_refresh = RefreshScheduler()
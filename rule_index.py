@@ -0,0 +1,313 @@
+"""
+Threshold rule index: matches every fare the app fetches against the alert rules.
+
+Threshold rules are indexed by (origin, destination, (year, month)) with their
+thresholds (converted to the canonical fetch currency) in sorted order, so a
+fare finds every rule it satisfies (price < threshold) with one binary search
+plus a duration/currency check on the matches.
+
+The matcher listens to the fare client, so every fresh upstream response can
+trigger alerts without extra API calls, wherever it was fetched from: the
+scheduler's rule polls, user searches or the price history collector.
+  - roundTripFares responses are matched fare by fare.
+  - cheapestPerDay (one-way) responses are buffered per route for a while;
+    round trips are composed from an outbound day and a return day once both
+    directions of an indexed route are known.
+
+Round trip responses are diffed against the last one seen for the same query
+(api_url) under the same rule set: a byte-identical payload (same fare client
+digest) is skipped without being looked at, otherwise only fares whose
+fingerprint (route, dates, price, currency) is new are matched. Work then
+follows how much the market moved, not rules times fares. Any change to the
+index (rules saved, FX rates moved) starts the diffs over.
+
+Matches are queued as pending deals per rule; check_notification_rules()
+drains and emails them. Deals left pending longer than
+RULE_MATCH_PENDING_MAX_AGE_SECONDS are dropped.
+"""
+import bisect
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+
+import fare_client
+import fx
+import metrics
+from fare_client import ONE_WAY_MONTH_API_TEMPLATE, ROUND_TRIP_API_TEMPLATE
+
+# One-way daily fares older than this aren't combined into round trips
+RULE_MATCH_DAILY_FARE_MAX_AGE_SECONDS = float(os.environ.get('RULE_MATCH_DAILY_FARE_MAX_AGE_SECONDS', 1800))
+RULE_MATCH_MAX_PENDING = int(os.environ.get('RULE_MATCH_MAX_PENDING', 500)) # Pending deals kept per rule
+# Pending deals not drained within this long are dropped (their fares are likely gone by then)
+RULE_MATCH_PENDING_MAX_AGE_SECONDS = float(os.environ.get('RULE_MATCH_PENDING_MAX_AGE_SECONDS', 3600))
+RULE_MATCH_MAX_SNAPSHOTS = int(os.environ.get('RULE_MATCH_MAX_SNAPSHOTS', 2000)) # Queries whose last fares are kept for diffing
+
+_ONE_WAY_URL_PATTERN = re.compile(r'/oneWayFares/([A-Za-z]{3})/([A-Za-z]{3})/cheapestPerDay\?outboundMonthOfDate=(\d{4})-(\d{2})')
+
+
+def deal_id(rule_id, deal):
+    """Identifier used to avoid notifying the same deal for a rule twice."""
+    return f"{rule_id}-{deal['destination_iata']}-{deal['total_price']}-{deal['outbound_dep_time']}"
+
+
+def fare_fingerprint(deal):
+    """Identifies a fare as offered: the same trip at a new price is a new fare."""
+    return (deal['origin_iata'], deal['destination_iata'], deal['outbound_dep_time'], deal['inbound_dep_time'],
+            deal['total_price'], deal.get('currency'))
+
+
+def _fare_date(value):
+    try:
+        return date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def round_trip_deals(data):
+    """Flat trip dicts (with parsed out/in dates) for every fare of a roundTripFares response."""
+    deals = []
+    for fare in (data.get('fares') or []) if isinstance(data, dict) else []:
+        try:
+            outbound = fare.get('outbound') or {}
+            inbound = fare.get('inbound') or {}
+            price = fare.get('summary', {}).get('price', {})
+            deal = {
+                'origin_iata': outbound.get('departureAirport', {}).get('iataCode'),
+                'destination_iata': outbound.get('arrivalAirport', {}).get('iataCode'),
+                'total_price': price.get('value'),
+                'currency': price.get('currencyCode'),
+                'outbound_dep_time': outbound.get('departureDate'),
+                'inbound_dep_time': inbound.get('departureDate'),
+            }
+        except (AttributeError, TypeError):
+            continue
+        out_date, in_date = _fare_date(deal['outbound_dep_time']), _fare_date(deal['inbound_dep_time'])
+        if deal['origin_iata'] and deal['destination_iata'] and deal['total_price'] is not None and out_date and in_date:
+            deals.append((out_date, in_date, deal))
+    return deals
+
+
+class RuleMatcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {} # (origin, destination, (year, month)) -> (sorted thresholds, rules in the same order)
+        self._routes = set() # (origin, destination) with at least one indexed rule
+        self._daily = {} # (origin, destination) -> {date: (price, currency, fetched_at)}
+        self._pending = {} # rule_id -> {deal_id: (deal, queued_at)}
+        self._rules_version = 0 # Bumped whenever the index changes
+        self._snapshots = {} # api_url -> (digest, rules_version, fare fingerprints), insertion ordered
+
+    def load_rules(self, rules):
+        """
+        Rebuilds the index from the rule list (only threshold rules are indexed).
+        Call again after FX rates change so converted thresholds follow.
+        """
+        grouped = {}
+        for rule in rules:
+            if rule.get('type', 'threshold') != 'threshold':
+                continue
+            try:
+                year, month = map(int, rule['search_month'].split('-'))
+                entry = {
+                    'id': rule['id'],
+                    # Fares arrive in the canonical currency, so thresholds are indexed in it too
+                    'threshold': fx.convert(float(rule['threshold']), fx.CANONICAL_CURRENCY,
+                                            rule.get('currency') or fx.CANONICAL_CURRENCY),
+                    'duration_from': int(rule['duration_from']),
+                    'duration_to': int(rule['duration_to']),
+                    'currency': fx.CANONICAL_CURRENCY,
+                }
+                key = (rule['origin_iata'].upper(), rule['destination_iata'].upper(), (year, month))
+            except (KeyError, ValueError, TypeError, AttributeError):
+                continue
+            grouped.setdefault(key, []).append(entry)
+
+        index = {}
+        for key, entries in grouped.items():
+            entries.sort(key=lambda entry: entry['threshold'])
+            index[key] = ([entry['threshold'] for entry in entries], entries)
+        rule_ids = {entry['id'] for _, entries in index.values() for entry in entries}
+        with self._lock:
+            if index != self._index:
+                self._rules_version += 1 # Fares seen under the old rules may match the new ones
+            self._index = index
+            self._routes = {(origin, destination) for origin, destination, _ in index}
+            self._pending = {rule_id: deals for rule_id, deals in self._pending.items() if rule_id in rule_ids}
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self._index.values())
+
+    def matching_rules(self, origin_iata, destination_iata, out_date, in_date, price, currency):
+        """Every indexed rule a round trip satisfies: O(log n) to find the thresholds above price."""
+        entry = self._index.get((origin_iata, destination_iata, (out_date.year, out_date.month)))
+        if entry is None:
+            return []
+        thresholds, rules = entry
+        duration = (in_date - out_date).days
+        start = bisect.bisect_right(thresholds, price) # rules[start:] all have price < threshold
+        return [rule for rule in rules[start:]
+                if rule['duration_from'] <= duration <= rule['duration_to']
+                and (not currency or rule['currency'] == currency)]
+
+    @staticmethod
+    def _drop_stale_pending(deals, now):
+        cutoff = now - RULE_MATCH_PENDING_MAX_AGE_SECONDS
+        for key in [key for key, (_, queued_at) in deals.items() if queued_at < cutoff]:
+            del deals[key]
+
+    def _add_pending(self, rule_id, deal):
+        now = time.monotonic()
+        with self._lock:
+            deals = self._pending.setdefault(rule_id, {})
+            if len(deals) >= RULE_MATCH_MAX_PENDING:
+                self._drop_stale_pending(deals, now) # Old deals don't crowd out new ones
+            if len(deals) < RULE_MATCH_MAX_PENDING:
+                deals[deal_id(rule_id, deal)] = (deal, now)
+
+    def offer_round_trip(self, out_date, in_date, deal):
+        """Matches one round trip deal; returns the number of rules it satisfied."""
+        rules = self.matching_rules(deal['origin_iata'], deal['destination_iata'], out_date, in_date,
+                                    deal['total_price'], deal.get('currency'))
+        for rule in rules:
+            self._add_pending(rule['id'], deal)
+        return len(rules)
+
+    def offer_round_trip_response(self, data, api_url=None):
+        """
+        Matches the fares of a roundTripFares response. With the api_url it was
+        fetched from, only the fares that changed since the last response for that
+        query are matched (none if the payload is byte-identical).
+        """
+        if not self._index:
+            return 0
+        if api_url is None:
+            return sum(self.offer_round_trip(out_date, in_date, deal) for out_date, in_date, deal in round_trip_deals(data))
+
+        digest = fare_client.response_digest(api_url)
+        with self._lock:
+            rules_version = self._rules_version
+            snapshot = self._snapshots.get(api_url)
+        if snapshot is None or snapshot[1] != rules_version:
+            result, seen = 'new', frozenset()
+        elif digest is not None and snapshot[0] == digest:
+            metrics.RULE_SNAPSHOT_DIFFS.inc(result='unchanged')
+            return 0
+        else:
+            result, seen = 'changed', snapshot[2]
+
+        fingerprints = set()
+        matched = evaluated = 0
+        for out_date, in_date, deal in round_trip_deals(data):
+            fingerprint = fare_fingerprint(deal)
+            fingerprints.add(fingerprint)
+            if fingerprint not in seen:
+                evaluated += 1
+                matched += self.offer_round_trip(out_date, in_date, deal)
+        with self._lock:
+            self._snapshots.pop(api_url, None)
+            self._snapshots[api_url] = (digest, rules_version, fingerprints)
+            while len(self._snapshots) > RULE_MATCH_MAX_SNAPSHOTS:
+                del self._snapshots[next(iter(self._snapshots))]
+        metrics.RULE_SNAPSHOT_DIFFS.inc(result=result)
+        metrics.RULE_FARES_EVALUATED.inc(evaluated)
+        return matched
+
+    def forget_snapshots(self):
+        """Makes the next response for every query match in full, e.g. to retry deals whose email failed."""
+        with self._lock:
+            self._snapshots.clear()
+
+    def offer_daily_fares(self, origin_iata, destination_iata, prices):
+        """
+        Buffers one-way fares ({date: (price, currency)}) for an indexed route and
+        matches the round trips they complete, in both directions.
+        """
+        route = (origin_iata, destination_iata)
+        reverse = (destination_iata, origin_iata)
+        if route not in self._routes and reverse not in self._routes:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            buffered = self._daily.setdefault(route, {})
+            for day, (price, currency) in prices.items():
+                buffered[day] = (price, currency, now)
+        matched = 0
+        if route in self._routes:
+            matched += self._match_daily(route, prices.keys(), outbound_days=True)
+        if reverse in self._routes:
+            matched += self._match_daily(reverse, prices.keys(), outbound_days=False)
+        return matched
+
+    def _fresh_daily(self, route):
+        cutoff = time.monotonic() - RULE_MATCH_DAILY_FARE_MAX_AGE_SECONDS
+        with self._lock:
+            buffered = self._daily.get(route, {})
+            for day in [day for day, (_, _, fetched_at) in buffered.items() if fetched_at < cutoff]:
+                del buffered[day]
+            return {day: (price, currency) for day, (price, currency, _) in buffered.items()}
+
+    def _match_daily(self, route, days, outbound_days):
+        """Combines new outbound days with buffered return days (or new return days with buffered outbound days)."""
+        origin_iata, destination_iata = route
+        outbound = self._fresh_daily(route)
+        inbound = self._fresh_daily((destination_iata, origin_iata))
+        if not outbound or not inbound:
+            return 0
+        # Taken under the lock: load_rules() may have dropped the route's rules since it was offered
+        with self._lock:
+            durations = [(rule['duration_from'], rule['duration_to'])
+                         for (o, d, _), (_, rules) in self._index.items() if (o, d) == route for rule in rules]
+        if not durations:
+            return 0
+        shortest, longest = min(low for low, _ in durations), max(high for _, high in durations)
+
+        pairs = set()
+        for day in days:
+            for duration in range(shortest, longest + 1):
+                pairs.add((day, day + timedelta(days=duration)) if outbound_days
+                          else (day - timedelta(days=duration), day))
+        matched = 0
+        for out_date, in_date in sorted(pairs):
+            if out_date not in outbound or in_date not in inbound:
+                continue
+            (out_price, currency), (in_price, _) = outbound[out_date], inbound[in_date]
+            deal = {
+                'origin_iata': origin_iata,
+                'destination_iata': destination_iata,
+                'total_price': round(out_price + in_price, 2),
+                'currency': currency,
+                'outbound_dep_time': out_date.isoformat(),
+                'inbound_dep_time': in_date.isoformat(),
+            }
+            matched += self.offer_round_trip(out_date, in_date, deal)
+        return matched
+
+    def on_response(self, template, api_url, data):
+        """fare_client response listener: feeds every fresh upstream response to the matcher."""
+        if template == ROUND_TRIP_API_TEMPLATE:
+            self.offer_round_trip_response(data, api_url)
+        elif template == ONE_WAY_MONTH_API_TEMPLATE:
+            match = _ONE_WAY_URL_PATTERN.search(api_url)
+            if match is None:
+                return
+            origin_iata, destination_iata, year, month = match.groups()
+            month_dt = date(int(year), int(month), 1)
+            prices = {departure_date: (price, currency)
+                      for departure_date, price, currency in fare_client.iter_daily_fares(data, month_dt)}
+            if prices:
+                self.offer_daily_fares(origin_iata.upper(), destination_iata.upper(), prices)
+
+    def pop_pending(self):
+        """Returns and clears the pending deals as {rule_id: [deal, ...]}, minus those past RULE_MATCH_PENDING_MAX_AGE_SECONDS."""
+        now = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for deals in pending.values():
+            self._drop_stale_pending(deals, now)
+        return {rule_id: [deal for deal, _ in deals.values()] for rule_id, deals in pending.items() if deals}
+
+
+# Process-wide matcher, registered with the fare client by the app
+matcher = RuleMatcher()
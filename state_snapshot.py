@@ -0,0 +1,130 @@
+"""
+Warm-start persistence for in-memory state.
+
+The fare cache, the background deal findings and the per-route price
+statistics are written to a compact snapshot (zlib-compressed JSON)
+periodically and on shutdown, and restored in the background when a worker
+starts, so a fresh deploy serves cached fares immediately, doesn't re-send
+alerts it already sent, and keeps its price-drop baselines.
+"""
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import fare_client
+import price_stats
+
+SNAPSHOT_FORMAT_VERSION = 1
+STATE_SNAPSHOT_PATH = os.environ.get('STATE_SNAPSHOT_PATH', os.path.join('state', 'snapshot.json.z'))
+# Fare data older than this is never restored
+STATE_SNAPSHOT_MAX_AGE_SECONDS = float(os.environ.get('STATE_SNAPSHOT_MAX_AGE_SECONDS', 1800))
+# Restored fares stay servable for at least this long after startup
+STATE_SNAPSHOT_GRACE_SECONDS = float(os.environ.get('STATE_SNAPSHOT_GRACE_SECONDS', 60))
+
+_save_lock = threading.Lock()
+
+
+def _encode_deal_findings(deal_findings, lock):
+    # The alert checker adds to notified_deals on another thread, so copy it under its lock
+    with lock:
+        last_checked = deal_findings.get("last_checked")
+        deals = list(deal_findings.get("deals_under_25", []))
+        notified = set(deal_findings.get("notified_deals", set()))
+    return {
+        "last_checked": last_checked.isoformat() if last_checked else None,
+        "deals_under_25": deals,
+        "notified_deals": sorted(notified),
+    }
+
+
+def save_snapshot(deal_findings, path=None, lock=None):
+    """
+    Writes the current state atomically. Returns the number of fare cache entries saved.
+    lock guards deal_findings against the thread updating it.
+    """
+    path = path or STATE_SNAPSHOT_PATH
+    lock = lock or contextlib.nullcontext()
+    fare_entries = fare_client.export_cache()
+    stats_rows = price_stats.route_stats.export()
+    findings = _encode_deal_findings(deal_findings, lock)
+    if not fare_entries and not findings["notified_deals"] and not stats_rows:
+        return 0 # Nothing worth keeping; don't clobber an older, still useful snapshot
+    payload = {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "saved_at": time.time(),
+        "fare_cache": fare_entries,
+        "deal_findings": findings,
+        "price_stats": stats_rows,
+    }
+    blob = zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 6)
+
+    with _save_lock:
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return len(fare_entries)
+
+
+def restore_snapshot(deal_findings, path=None, lock=None):
+    """
+    Loads a snapshot into the fare cache and deal_findings (merged under lock,
+    never replacing newer in-memory data). Returns the number of fare entries restored.
+    """
+    path = path or STATE_SNAPSHOT_PATH
+    lock = lock or contextlib.nullcontext()
+    try:
+        with open(path, 'rb') as f:
+            payload = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, zlib.error) as e:
+        print(f"Warning: Ignoring unreadable state snapshot {path}: {e}")
+        return 0
+
+    if payload.get("version") != SNAPSHOT_FORMAT_VERSION:
+        print(f"Warning: Ignoring state snapshot with unsupported version {payload.get('version')}.")
+        return 0
+
+    restored = fare_client.import_cache(payload.get("fare_cache", []),
+                                        max_age_seconds=STATE_SNAPSHOT_MAX_AGE_SECONDS,
+                                        grace_seconds=STATE_SNAPSHOT_GRACE_SECONDS)
+
+    price_stats.route_stats.restore(payload.get("price_stats", []))
+
+    findings = payload.get("deal_findings") or {}
+    with lock:
+        deal_findings["notified_deals"].update(findings.get("notified_deals", []))
+        if not deal_findings.get("deals_under_25"):
+            deal_findings["deals_under_25"] = findings.get("deals_under_25", [])
+        if deal_findings.get("last_checked") is None and findings.get("last_checked"):
+            deal_findings["last_checked"] = datetime.fromisoformat(findings["last_checked"])
+    return restored
+
+
+def restore_in_background(deal_findings, path=None, lock=None):
+    """Restores the snapshot on a daemon thread so worker startup isn't blocked."""
+    def _restore():
+        started = time.perf_counter()
+        try:
+            restored = restore_snapshot(deal_findings, path, lock)
+            print(f"State snapshot restored: {restored} fare cache entries in {time.perf_counter() - started:.2f}s.")
+        except Exception as e:
+            print(f"Error restoring state snapshot: {e}")
+
+    thread = threading.Thread(target=_restore, name='state-snapshot-restore', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,49 @@
+// Airport autocomplete for IATA inputs marked with data-airport-autocomplete.
+// Suggestions come from /api/airports and fill the shared #airport-options datalist;
+// the option value is the IATA code so forms keep submitting plain codes.
+(() => {
+  'use strict'
+
+  const script = document.currentScript
+  const endpoint = script ? script.dataset.endpoint : '/api/airports'
+  const datalist = document.getElementById('airport-options')
+  if (!datalist) return
+
+  let timer = null
+  let controller = null
+  const cache = new Map()
+
+  function render(airports) {
+    datalist.replaceChildren(...airports.map(airport => {
+      const option = document.createElement('option')
+      option.value = airport.iata
+      option.label = `${airport.name} (${airport.city}, ${airport.country})`
+      return option
+    }))
+  }
+
+  function lookup(query) {
+    if (cache.has(query)) {
+      render(cache.get(query))
+      return
+    }
+    if (controller) controller.abort() // Drop responses for stale keystrokes
+    controller = new AbortController()
+    fetch(`${endpoint}?q=${encodeURIComponent(query)}`, { signal: controller.signal })
+      .then(response => response.ok ? response.json() : [])
+      .then(airports => {
+        cache.set(query, airports)
+        render(airports)
+      })
+      .catch(() => {})
+  }
+
+  document.querySelectorAll('[data-airport-autocomplete]').forEach(input => {
+    input.addEventListener('input', () => {
+      const query = input.value.trim()
+      clearTimeout(timer)
+      if (!query) return
+      timer = setTimeout(() => lookup(query.toLowerCase()), 150)
+    })
+  })
+})()
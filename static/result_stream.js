@@ -0,0 +1,64 @@
+// Progressive search results over Server-Sent Events.
+// startResultStream() opens an EventSource on a /.../stream endpoint, drives the shared
+// progress widget (#stream-progress) and hands each running top list to renderTop().
+// Closing the stream (Stop button, new search, leaving the page) makes the server
+// cancel the upstream calls it hasn't started yet.
+(() => {
+  'use strict'
+
+  let source = null
+
+  function element(tag, value, className) {
+    const el = document.createElement(tag)
+    if (value !== undefined && value !== null) el.textContent = value
+    if (className) el.className = className
+    return el
+  }
+
+  function startResultStream(url, { renderTop, unit = 'results' }) {
+    const progress = document.getElementById('stream-progress')
+    const bar = document.getElementById('stream-progress-bar')
+    const text = document.getElementById('stream-progress-text')
+    const errors = document.getElementById('stream-errors')
+    const stop = document.getElementById('stream-stop')
+
+    const finish = message => {
+      if (source) source.close()
+      source = null
+      bar.classList.remove('progress-bar-animated')
+      stop.classList.add('d-none')
+      if (message) text.textContent = message
+    }
+
+    if (source) source.close()
+    document.querySelectorAll('.flash-messages .alert').forEach(el => el.remove())
+    renderTop([])
+    errors.replaceChildren()
+    bar.style.width = '0%'
+    bar.classList.add('progress-bar-animated')
+    stop.classList.remove('d-none')
+    stop.onclick = () => finish('Stopped.')
+    progress.classList.remove('d-none')
+    text.textContent = 'Searching...'
+
+    source = new EventSource(url)
+    source.addEventListener('result', e => {
+      const result = JSON.parse(e.data)
+      bar.style.width = `${Math.round(100 * result.completed / Math.max(result.total, 1))}%`
+      text.textContent = `${result.completed} / ${result.total} ${unit}`
+      if (result.error) errors.appendChild(element('div', result.error))
+      renderTop(result.top)
+    })
+    source.addEventListener('done', e => {
+      const done = JSON.parse(e.data)
+      bar.style.width = '100%'
+      if (done.message) errors.appendChild(element('div', done.message)) // Stopped by the fare budget
+      finish(done.top.length ? `Done in ${(done.elapsed_ms / 1000).toFixed(1)}s` : 'No round trips found.')
+    })
+    source.onerror = () => { if (source) finish('Search interrupted.') }
+  }
+
+  window.addEventListener('pagehide', () => { if (source) source.close() })
+  window.startResultStream = startResultStream
+  window.streamElement = element
+})()
@@ -0,0 +1,29 @@
+"""
+Shared test setup: the repository root is importable and the fare client
+points at the local farfnd stand-in (benchmarks/mock_farfnd.py), never at
+Ryanair.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import mock_farfnd
+
+MOCK_PORT = mock_farfnd.find_free_port()
+# Read when fare_client and app are imported, so set before any test module imports them
+os.environ['RYANAIR_API_BASE'] = f"http://127.0.0.1:{MOCK_PORT}{mock_farfnd.API_PREFIX}"
+os.environ['SCHEDULER_ENABLED'] = 'false'
+os.environ['STATE_SNAPSHOT_ENABLED'] = 'false'
+
+
+@pytest.fixture(scope='session')
+def mock_upstream():
+    """The running stand-in server's MockConfig (request_count counts upstream calls)."""
+    config = mock_farfnd.MockConfig()
+    server, _ = mock_farfnd.start_in_background(config, port=MOCK_PORT)
+    yield config
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,51 @@
+import pytest
+
+import budget
+
+
+def test_charge_exhausts_on_fares_then_check_raises():
+    fare_budget = budget.Budget('request', max_fares=10, max_bytes=1000)
+    assert fare_budget.charge(fares=10, size=100)
+    assert not fare_budget.exhausted
+    assert not fare_budget.charge(fares=1)
+    assert fare_budget.exhausted_by == 'fares'
+    with pytest.raises(budget.BudgetExceeded):
+        fare_budget.check()
+
+
+def test_charge_exhausts_on_bytes():
+    fare_budget = budget.Budget('job', max_fares=10, max_bytes=1000)
+    assert not fare_budget.charge(fares=1, size=1001)
+    assert fare_budget.exhausted_by == 'bytes'
+
+
+def test_charges_after_exhaustion_keep_counting():
+    fare_budget = budget.Budget('request', max_fares=1, max_bytes=1000)
+    fare_budget.charge(fares=2)
+    assert not fare_budget.charge(fares=3, size=5)
+    assert (fare_budget.fares, fare_budget.bytes, fare_budget.exhausted_by) == (5, 5, 'fares')
+
+
+def test_limit_sets_and_restores_the_current_budget():
+    outer, inner = budget.request_budget(), budget.job_budget()
+    assert budget.current() is None
+    with budget.limit(outer):
+        with budget.limit(inner):
+            assert budget.current() is inner
+        assert budget.current() is outer
+    assert budget.current() is None
+    assert not budget.exhausted()
+
+
+def test_decorators_run_under_a_fresh_budget():
+    @budget.with_request_budget
+    def view():
+        return budget.current()
+
+    @budget.with_job_budget
+    def job():
+        return budget.current()
+
+    first, second = view(), view()
+    assert first is not second and first.scope == 'request'
+    assert job().scope == 'job'
@@ -0,0 +1,71 @@
+import copy
+import os
+
+import pytest
+
+import fare_client
+import fare_search
+import history_store
+import price_stats
+import refresh_scheduler
+from benchmarks.run import InMemorySupabase
+from fare_client import ONE_WAY_MONTH_API_TEMPLATE
+
+STALE_PRICE = 1.23
+
+
+def _stale_copy(data):
+    """The same cheapestPerDay response with every price replaced by STALE_PRICE."""
+    stale = copy.deepcopy(data)
+    for day_fare in stale['outbound']['fares']:
+        if day_fare.get('price'):
+            day_fare['price']['value'] = STALE_PRICE
+    return stale
+
+
+def test_fetch_json_use_cache_false_asks_upstream(mock_upstream):
+    api_url = fare_search.one_way_month_url('SOF', 'VAR', 2027, 1, 'EUR')
+    fresh = fare_client.fetch_json(ONE_WAY_MONTH_API_TEMPLATE, api_url)
+    fare_client._cache_put(api_url, _stale_copy(fresh))
+    assert fare_client.fetch_json(ONE_WAY_MONTH_API_TEMPLATE, api_url) != fresh # Served from the cache
+
+    before = mock_upstream.request_count
+    assert fare_client.fetch_json(ONE_WAY_MONTH_API_TEMPLATE, api_url, use_cache=False) == fresh
+    assert mock_upstream.request_count == before + 1
+    assert fare_client.fetch_json(ONE_WAY_MONTH_API_TEMPLATE, api_url) == fresh # And refreshed the cache
+
+
+@pytest.fixture
+def collector(monkeypatch, tmp_path):
+    """(app module, its in-memory Supabase) with fresh refresh and stats state."""
+    import app
+    supabase = InMemorySupabase()
+    monkeypatch.setattr(app, 'get_supabase', lambda: supabase)
+    monkeypatch.setattr(app, 'NOTIFICATION_RULES_FILE', os.path.join(tmp_path, 'notification_rules.json'))
+    monkeypatch.setattr(refresh_scheduler, 'history_refresh', refresh_scheduler.RefreshScheduler())
+    monkeypatch.setattr(price_stats, 'route_stats', price_stats.PriceStatsStore())
+    yield app, supabase
+    history_store.clear()
+
+
+def test_collector_never_stores_cached_fares(collector, mock_upstream, monkeypatch):
+    # Regression: the collector read through the fare cache, so fares up to
+    # FARE_CACHE_TTL_SECONDS old were inserted as new price_history rows.
+    app, supabase = collector
+    app.collect_price_history()
+    collected = len(supabase.rows['price_history'])
+    items = [item for item, _, _, refreshed_at in refresh_scheduler.history_refresh.status() if refreshed_at]
+    assert collected and items
+
+    # Everything the collector fetched is now cached; make those entries stale
+    for origin, destination, month_dt in items:
+        api_url = fare_search.one_way_month_url(origin, destination, month_dt.year, month_dt.month, 'EUR')
+        fare_client._cache_put(api_url, _stale_copy(fare_client._cache_get(api_url)))
+    monkeypatch.setattr(refresh_scheduler, 'history_refresh', refresh_scheduler.RefreshScheduler()) # All due again
+
+    before = mock_upstream.request_count
+    app.collect_price_history()
+    new_rows = supabase.rows['price_history'][collected:]
+    assert mock_upstream.request_count - before == len(items)
+    assert new_rows and all(row['price'] != STALE_PRICE for row in new_rows)
+    assert STALE_PRICE not in {stats.minimum for stats in price_stats.route_stats._stats.values()}
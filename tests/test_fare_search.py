@@ -0,0 +1,27 @@
+import pytest
+
+import fare_search
+
+
+def test_month_range_defaults_to_a_single_month():
+    assert fare_search.month_range('2026-11') == [(2026, 11)]
+
+
+def test_month_range_crosses_the_year():
+    assert fare_search.month_range('2026-11', '2027-02') == [(2026, 11), (2026, 12), (2027, 1), (2027, 2)]
+
+
+def test_month_range_allows_exactly_max_months():
+    assert len(fare_search.month_range('2026-01', '2026-03', max_months=3)) == 3
+
+
+@pytest.mark.parametrize('start, end', [('2026-05', '2026-04'), ('2026-01', '2026-04')])
+def test_month_range_rejects_reversed_or_too_long_ranges(start, end):
+    with pytest.raises(ValueError):
+        fare_search.month_range(start, end, max_months=3)
+
+
+@pytest.mark.parametrize('value', ['2026-13', '2026', 'soon', '2026-00'])
+def test_month_range_rejects_bad_months(value):
+    with pytest.raises(ValueError):
+        fare_search.month_range(value)
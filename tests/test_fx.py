@@ -0,0 +1,96 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import fx
+
+
+@pytest.fixture
+def rates(monkeypatch, tmp_path):
+    """A state file with known rates; returns a function rewriting it."""
+    state_path = tmp_path / 'fx_rates.json'
+    monkeypatch.setattr(fx, 'FX_RATES_STATE_PATH', str(state_path))
+    monkeypatch.setattr(fx, '_table', None)
+    monkeypatch.setattr(fx, '_table_mtime', None)
+
+    def write(rates, as_of='2026-10-16', mtime=None):
+        state_path.write_text(json.dumps({'base': 'EUR', 'date': as_of, 'rates': rates}))
+        if mtime is not None:
+            os.utime(state_path, (mtime, mtime))
+
+    write({'GBP': 0.8, 'BGN': 2.0, 'USD': 1.25}, mtime=1_000_000)
+    return write
+
+
+def test_convert_records_converts_nested_fields_without_touching_the_source(rates):
+    records = [{'total_price': 100.0, 'outbound': {'price': 60.0}, 'inbound': {'price': 40.0}, 'currency': 'EUR'}]
+    converted = fx.convert_records(records, ('total_price', 'outbound.price', 'inbound.price'), 'GBP')
+    assert converted == [{'total_price': 80.0, 'outbound': {'price': 48.0}, 'inbound': {'price': 32.0},
+                          'currency': 'GBP'}]
+    assert records[0] == {'total_price': 100.0, 'outbound': {'price': 60.0}, 'inbound': {'price': 40.0},
+                          'currency': 'EUR'}
+
+
+@pytest.mark.parametrize('record, from_currency, expected', [
+    ({'price': 10.0, 'currency': 'GBP'}, None, 25.0), # Each record's own currency
+    ({'price': 10.0, 'currency': 'USD'}, None, 16.0),
+    ({'price': 10.0}, None, 20.0), # No currency: canonical EUR
+    ({'price': 10.0, 'currency': 'XYZ'}, None, 20.0), # Unknown currency: treated as EUR
+    ({'price': 10.0, 'currency': 'GBP'}, 'EUR', 20.0), # from_currency overrides the record's
+    ({'price': 10.0, 'currency': 'EUR'}, 'XYZ', 20.0),
+])
+def test_convert_records_source_currency_and_missing_currency_fallback(rates, record, from_currency, expected):
+    assert fx.convert_records([record], ('price',), 'BGN', from_currency) == [{'price': expected, 'currency': 'BGN'}]
+
+
+def test_convert_records_leaves_missing_prices_empty(rates):
+    records = [{'price': None, 'outbound': None}, {'price': 5.0, 'outbound': {'price': 1.0}}]
+    converted = fx.convert_records(records, ('price', 'outbound.price'), 'GBP')
+    assert converted == [{'price': None, 'outbound': None, 'currency': 'GBP'},
+                         {'price': 4.0, 'outbound': {'price': 0.8}, 'currency': 'GBP'}]
+    assert fx.convert_records([], ('price',), 'GBP') == []
+
+
+def test_convert_keeps_nan_and_rounds_to_cents(rates):
+    converted = fx.convert([1.0, np.nan, 3.333], 'USD')
+    assert converted[0] == 1.25 and np.isnan(converted[1]) and converted[2] == 4.17
+    assert fx.convert(12.5, 'EUR') == 12.5
+
+
+def test_requested_currency_falls_back_for_unknown_codes(rates, monkeypatch):
+    monkeypatch.setattr(fx, 'FX_DEFAULT_CURRENCY', 'GBP')
+    assert fx.requested_currency(' usd ') == 'USD'
+    assert fx.requested_currency('XYZ') == 'GBP'
+    assert fx.requested_currency(None) == 'GBP'
+
+
+def test_get_table_reloads_when_another_worker_refreshes_the_state_file(rates):
+    assert fx.get_table().factor('EUR', 'GBP') == pytest.approx(0.8)
+    first = fx.get_table()
+    assert fx.get_table() is first # Unchanged file: no reload
+
+    rates({'GBP': 0.9}, as_of='2026-10-17', mtime=1_000_060)
+    table = fx.get_table()
+    assert table.as_of == '2026-10-17'
+    assert table.factor('EUR', 'GBP') == pytest.approx(0.9)
+    assert 'BGN' not in table
+
+
+def test_get_table_falls_back_to_the_bundled_rates_without_a_state_file(rates, monkeypatch, tmp_path):
+    bundled = tmp_path / 'bundled.json'
+    bundled.write_text(json.dumps({'date': 'bundled', 'rates': {'GBP': 0.5}}))
+    monkeypatch.setattr(fx, 'FX_RATES_PATH', str(bundled))
+    os.remove(fx.FX_RATES_STATE_PATH)
+    assert fx.get_table().as_of == 'bundled'
+
+
+def test_refresh_rates_writes_the_state_file_and_swaps_the_table(rates, monkeypatch):
+    monkeypatch.setattr(fx, 'fetch_ecb_rates', lambda: ('2026-10-18', {'GBP': 0.85, 'JPY': 160.0}))
+    assert fx.refresh_rates() == 2
+    with open(fx.FX_RATES_STATE_PATH, encoding='utf-8') as f:
+        assert json.load(f)['rates'] == {'GBP': 0.85, 'JPY': 160.0}
+    table = fx.get_table()
+    assert table.as_of == '2026-10-18' and 'JPY' in table
+    assert fx.get_table() is table # Its own write doesn't trigger a reload
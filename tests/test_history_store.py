@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import history_store
+from benchmarks.run import InMemorySupabase
+
+ROUTE = ('SOF', 'BCN', '2027-01-15')
+
+
+class CountingSupabase(InMemorySupabase):
+    """Counts the price_history reads that reach the database."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def table(self, name):
+        self.reads += 1
+        return super().table(name)
+
+
+def _row(collected_at, price):
+    return {'origin_iata': ROUTE[0], 'destination_iata': ROUTE[1], 'departure_date': ROUTE[2],
+            'collected_at': collected_at, 'price': price, 'currency': 'EUR'}
+
+
+@pytest.fixture
+def supabase():
+    history_store.clear()
+    supabase = CountingSupabase()
+    supabase.rows['price_history'] = [
+        _row('2026-10-01T06:00:00+00:00', 50.0),
+        _row('2026-10-01T18:00:00+00:00', 40.0),
+        _row('2026-10-02T06:00:00+00:00', 45.0),
+    ]
+    yield supabase
+    history_store.clear()
+
+
+def test_price_rows_are_cached(supabase):
+    first = history_store.price_rows(supabase, *ROUTE)
+    assert [row['price'] for row in first] == [50.0, 40.0, 45.0]
+    assert history_store.price_rows(supabase, *ROUTE) is first
+    assert supabase.reads == 1
+
+
+def test_daily_rollup_builds_ohlc_bars(supabase):
+    bars = history_store.daily_rollup(supabase, *ROUTE)
+    assert [(bar['day'], bar['open'], bar['low'], bar['high'], bar['close'], bar['samples']) for bar in bars] == [
+        ('2026-10-01', 50.0, 40.0, 50.0, 40.0, 2),
+        ('2026-10-02', 45.0, 45.0, 45.0, 45.0, 1),
+    ]
+
+
+def test_ingest_updates_a_built_rollup_without_reading_the_database(supabase):
+    history_store.daily_rollup(supabase, *ROUTE)
+    reads = supabase.reads
+    collected_at = datetime(2026, 10, 2, 18, tzinfo=timezone.utc)
+    history_store.record_ingest([dict(_row(None, 60.0), collected_at=None)], collected_at)
+
+    bars = history_store.daily_rollup(supabase, *ROUTE)
+    assert supabase.reads == reads
+    assert (bars[-1]['day'], bars[-1]['high'], bars[-1]['close'], bars[-1]['samples']) == ('2026-10-02', 60.0, 60.0, 2)
+
+
+def test_ingest_starts_a_new_day_bar(supabase):
+    history_store.daily_rollup(supabase, *ROUTE)
+    history_store.record_ingest([_row(None, 30.0)], datetime(2026, 10, 3, 6, tzinfo=timezone.utc))
+    bars = history_store.daily_rollup(supabase, *ROUTE)
+    assert [bar['day'] for bar in bars] == ['2026-10-01', '2026-10-02', '2026-10-03']
+    assert bars[-1]['open'] == bars[-1]['close'] == 30.0
+
+
+def test_ingest_drops_the_cached_rows(supabase):
+    history_store.price_rows(supabase, *ROUTE)
+    supabase.rows['price_history'].append(_row('2026-10-03T06:00:00+00:00', 30.0))
+    history_store.record_ingest([_row(None, 30.0)])
+    assert len(history_store.price_rows(supabase, *ROUTE)) == 4
+    assert supabase.reads == 2
+
+
+def test_ingest_leaves_rollups_of_other_routes_alone(supabase):
+    history_store.record_ingest([dict(_row(None, 30.0), destination_iata='MAD')])
+    assert len(history_store.daily_rollup(supabase, *ROUTE)) == 2
+
+
+def test_rollups_are_rebuilt_after_the_ttl(supabase, monkeypatch):
+    # Rows written by another worker or collector never pass through this process's record_ingest()
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(history_store, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    history_store.daily_rollup(supabase, *ROUTE)
+    supabase.rows['price_history'].append(_row('2026-10-03T06:00:00+00:00', 30.0))
+    assert len(history_store.daily_rollup(supabase, *ROUTE)) == 2
+
+    clock.now += history_store.HISTORY_CACHE_TTL_SECONDS
+    bars = history_store.daily_rollup(supabase, *ROUTE)
+    assert [bar['day'] for bar in bars] == ['2026-10-01', '2026-10-02', '2026-10-03']
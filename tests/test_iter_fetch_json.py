@@ -0,0 +1,54 @@
+import threading
+import weakref
+
+import fare_client
+
+
+class Payload(dict):
+    """A parsed response that can be weakly referenced."""
+
+
+def test_yields_every_request_once(monkeypatch):
+    monkeypatch.setattr(fare_client, 'fetch_json', lambda template, api_url, timeout=30: Payload(url=api_url))
+    results = {key: (data['url'], error) for key, data, error in
+               fare_client.iter_fetch_json((i, 'template', f'url-{i}') for i in range(100))}
+    assert results == {i: (f'url-{i}', None) for i in range(100)}
+
+
+def test_errors_are_yielded_not_raised(monkeypatch):
+    def fetch(template, api_url, timeout=30):
+        raise ValueError(api_url)
+    monkeypatch.setattr(fare_client, 'fetch_json', fetch)
+    [(key, data, error)] = fare_client.iter_fetch_json([('k', 'template', 'bad')])
+    assert (key, data, str(error)) == ('k', None, 'bad')
+
+
+def test_yielded_responses_can_be_freed(monkeypatch):
+    # Regression: every completed future (and its response) was kept until the generator finished
+    alive = []
+
+    def fetch(template, api_url, timeout=30):
+        payload = Payload()
+        alive.append(weakref.ref(payload))
+        return payload
+    monkeypatch.setattr(fare_client, 'fetch_json', fetch)
+    most_alive = 0
+    for _, data, _ in fare_client.iter_fetch_json((i, 'template', f'url-{i}') for i in range(300)):
+        del data # Payloads hold no cycles, so dropping the last reference frees them
+        most_alive = max(most_alive, sum(ref() is not None for ref in alive))
+    assert most_alive <= 2 * fare_client.ITER_FETCH_WINDOW
+
+
+def test_closing_early_stops_submitting(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def fetch(template, api_url, timeout=30):
+        with lock:
+            calls.append(api_url)
+        return Payload()
+    monkeypatch.setattr(fare_client, 'fetch_json', fetch)
+    responses = fare_client.iter_fetch_json((i, 'template', f'url-{i}') for i in range(1000))
+    next(responses)
+    responses.close()
+    assert len(calls) <= 2 * fare_client.ITER_FETCH_WINDOW
@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+
+import pytest
+
+import itinerary_solver
+
+START = date(2027, 6, 1)
+
+
+def day(offset):
+    return START + timedelta(days=offset)
+
+
+# Home MAD with three stops; every leg departs on a fixed day offset
+LEGS = {
+    ('MAD', 'BCN'): {day(0): 30.0},
+    ('MAD', 'LIS'): {day(0): 20.0},
+    ('MAD', 'OPO'): {day(0): 50.0},
+    ('BCN', 'MAD'): {day(3): 40.0, day(5): 8.0},
+    ('LIS', 'MAD'): {day(3): 60.0, day(6): 60.0},
+    ('OPO', 'MAD'): {day(3): 10.0, day(6): 12.0},
+    ('LIS', 'BCN'): {day(2): 5.0},
+    ('BCN', 'LIS'): {day(2): 50.0},
+    ('LIS', 'OPO'): {day(3): 25.0},
+    ('OPO', 'LIS'): {day(2): 30.0},
+    ('BCN', 'OPO'): {day(3): 16.0},
+}
+STOPS = ['BCN', 'LIS', 'OPO']
+
+
+def route(itinerary):
+    return [(origin, destination) for origin, destination, _, _ in itinerary['legs']]
+
+
+# (itinerary types, expected top three as (type, total, (origin, destination) per leg))
+BEST_ORDER_CASES = [
+    (('open_jaw',), [
+        ('open_jaw', 30.0, [('MAD', 'LIS'), ('OPO', 'MAD')]),
+        ('open_jaw', 40.0, [('MAD', 'BCN'), ('OPO', 'MAD')]),
+        ('open_jaw', 60.0, [('MAD', 'LIS'), ('BCN', 'MAD')]),
+    ]),
+    (('two_stop',), [
+        ('two_stop', 33.0, [('MAD', 'LIS'), ('LIS', 'BCN'), ('BCN', 'MAD')]),
+        ('two_stop', 57.0, [('MAD', 'LIS'), ('LIS', 'OPO'), ('OPO', 'MAD')]),
+        ('two_stop', 58.0, [('MAD', 'BCN'), ('BCN', 'OPO'), ('OPO', 'MAD')]),
+    ]),
+    (('open_jaw', 'two_stop'), [
+        ('open_jaw', 30.0, [('MAD', 'LIS'), ('OPO', 'MAD')]),
+        ('two_stop', 33.0, [('MAD', 'LIS'), ('LIS', 'BCN'), ('BCN', 'MAD')]),
+        ('open_jaw', 40.0, [('MAD', 'BCN'), ('OPO', 'MAD')]),
+    ]),
+]
+
+
+@pytest.mark.parametrize('itinerary_types, expected', BEST_ORDER_CASES)
+def test_solve_returns_itineraries_cheapest_first(itinerary_types, expected):
+    results = itinerary_solver.solve(LEGS, 'MAD', STOPS, itinerary_types, stay_from=2, stay_to=4, top_n=3)
+    assert [(r['type'], r['total_price'], route(r)) for r in results] == expected
+
+
+def test_solve_respects_the_stay_bounds():
+    # Landing at BCN on day 2 leaves too little time for the day 3 flight home
+    results = itinerary_solver.solve(LEGS, 'MAD', STOPS, ('two_stop',), stay_from=2, stay_to=4, top_n=10)
+    for itinerary in results:
+        days = [leg[2] for leg in itinerary['legs']]
+        stays = [(later - earlier).days for earlier, later in zip(days, days[1:])]
+        assert all(2 <= stay <= 4 for stay in stays)
+
+
+def test_solve_caps_the_whole_trip_length():
+    results = itinerary_solver.solve(LEGS, 'MAD', STOPS, ('two_stop',), stay_from=2, stay_to=4,
+                                     max_trip_days=5, top_n=10)
+    assert [(r['total_price'], route(r)) for r in results] == [
+        (33.0, [('MAD', 'LIS'), ('LIS', 'BCN'), ('BCN', 'MAD')])]
+
+
+def test_solve_ignores_the_home_airport_as_a_stop():
+    results = itinerary_solver.solve(LEGS, 'MAD', STOPS + ['MAD'], ('open_jaw',), stay_from=2, stay_to=4, top_n=3)
+    assert results and all(route(r)[0][1] != 'MAD' for r in results)
@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import pytest
+
+import meetup_search
+
+START = date(2027, 7, 1)
+
+
+def day(offset):
+    return START + timedelta(days=offset)
+
+
+# Two travellers, one destination, two possible departure days with a two night stay:
+#   day 0: DUB 100 + STN 20  -> sum 120, max 100
+#   day 1: DUB 60  + STN 70  -> sum 130, max 70
+OUTBOUND = {'DUB': {day(0): 80.0, day(1): 30.0}, 'STN': {day(0): 10.0, day(1): 50.0}}
+INBOUND = {'DUB': {day(2): 20.0, day(3): 30.0}, 'STN': {day(2): 10.0, day(3): 20.0}}
+
+
+@pytest.mark.parametrize('objective, out_offset, objective_price, total_price, max_price', [
+    ('sum', 0, 120.0, 120.0, 100.0),
+    ('max', 1, 70.0, 130.0, 70.0),
+])
+def test_evaluate_destination_picks_the_day_the_objective_prefers(objective, out_offset, objective_price,
+                                                                  total_price, max_price):
+    meetup = meetup_search.evaluate_destination('BCN', ['DUB', 'STN'], OUTBOUND, INBOUND, START, 2, 2, 2, objective)
+    assert meetup['out_date'] == day(out_offset)
+    assert meetup['in_date'] == day(out_offset + 2)
+    assert meetup['objective_price'] == objective_price
+    assert meetup['total_price'] == total_price
+    assert meetup['max_price'] == max_price
+    assert [t['origin_iata'] for t in meetup['travellers']] == ['DUB', 'STN']
+
+
+def test_evaluate_destination_needs_a_common_day():
+    outbound = {'DUB': {day(0): 10.0}, 'STN': {day(1): 10.0}}
+    assert meetup_search.evaluate_destination('BCN', ['DUB', 'STN'], outbound, INBOUND, START, 2, 2, 2, 'sum') is None
+
+
+@pytest.mark.parametrize('objective, expected', [('sum', 45.0), ('max', 40.0)])
+def test_lower_bound_uses_only_common_outbound_days(objective, expected):
+    outbound = [{day(0): 10.0, day(1): 40.0, day(2): 1.0}, {day(0): 50.0, day(1): 5.0}]
+    assert meetup_search._lower_bound(outbound, objective) == expected
+
+
+# Per destination, the (DUB, STN) round trip prices on the only departure day
+DESTINATIONS = {'BCN': (100.0, 20.0), 'FCO': (60.0, 70.0), 'LIS': (90.0, 90.0)}
+
+
+@pytest.fixture
+def fares(monkeypatch):
+    daily = {}
+    for destination, prices in DESTINATIONS.items():
+        for origin, price in zip(['DUB', 'STN'], prices):
+            daily[(origin, destination)] = {day(0): price - 10.0}
+            daily[(destination, origin)] = {day(2): 10.0}
+
+    def fetch_daily_fares(route_months, currency):
+        return {(origin, destination): daily.get((origin, destination), {})
+                for origin, destination, _ in route_months}, {}
+
+    monkeypatch.setattr(meetup_search.fare_search, 'fetch_daily_fares', fetch_daily_fares)
+    monkeypatch.setattr(meetup_search.airports, 'serves', lambda origin, destination: True)
+
+
+@pytest.mark.parametrize('objective, expected', [
+    ('sum', [('BCN', 120.0), ('FCO', 130.0), ('LIS', 180.0)]),
+    ('max', [('FCO', 70.0), ('LIS', 90.0), ('BCN', 100.0)]),
+])
+def test_find_meetups_ranks_destinations_by_objective(fares, objective, expected):
+    meetups, stats, errors = meetup_search.find_meetups(['DUB', 'STN'], list(DESTINATIONS), [(2027, 7)], 2, 2,
+                                                        objective=objective)
+    assert [(m['destination_iata'], m['objective_price']) for m in meetups] == expected
+    assert stats['candidates'] == 3 and errors == {}
+
+
+def test_find_meetups_skips_destinations_whose_bound_is_beaten(fares, monkeypatch):
+    # One destination per round: FCO (max 70) beats the LIS (80) and BCN (90) outbound bounds
+    monkeypatch.setattr(meetup_search.fare_client, 'FARE_FETCH_WORKERS', 1)
+    meetups, stats, _ = meetup_search.find_meetups(['DUB', 'STN'], list(DESTINATIONS), [(2027, 7)], 2, 2,
+                                                   objective='max', top_n=1)
+    assert [m['destination_iata'] for m in meetups] == ['FCO']
+    assert (stats['evaluated'], stats['skipped']) == (1, 2)
@@ -0,0 +1,135 @@
+import json
+import os
+import re
+
+import pytest
+
+RULE_FORM = {'origin_iata': 'SOF', 'destination_iata': 'BCN', 'outbound_month': '2027-03',
+             'duration_from': '2', 'duration_to': '7', 'threshold': '70'}
+TOKEN_PATTERN = re.compile(r'Your access token is ([\w-]+)\.')
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    import app
+    monkeypatch.setattr(app, 'NOTIFICATION_RULES_FILE', os.path.join(tmp_path, 'notification_rules.json'))
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'admin-secret')
+    monkeypatch.setattr(app.rule_index, 'matcher', app.rule_index.RuleMatcher())
+    return app
+
+
+def _add_rule(client, **fields):
+    response = client.post('/configure_notifications', data=dict(RULE_FORM, **fields))
+    page = client.get('/configure_notifications').get_data(as_text=True)
+    return response, page
+
+
+def _listed_ids(client):
+    return re.findall(r'name="rule_id" value="([^"]+)"', client.get('/configure_notifications').get_data(as_text=True))
+
+
+def test_first_rule_issues_a_token_outside_the_url(app_module):
+    client = app_module.app.test_client()
+    response, page = _add_rule(client, recipient='ann@example.com')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/configure_notifications' # No owner or token in the URL
+    token = TOKEN_PATTERN.search(page).group(1)
+    [rule] = app_module.load_notification_rules()
+    assert rule['owner'] == 'ann@example.com'
+    assert rule['owner_token_hash'] == app_module.owner_token_hash(token) and token not in json.dumps(rule)
+    assert _listed_ids(client) == [rule['id']] # This browser stays unlocked
+
+
+def test_more_rules_for_an_owner_need_its_token(app_module):
+    ann = app_module.app.test_client()
+    _, page = _add_rule(ann, owner='ann')
+    token = TOKEN_PATTERN.search(page).group(1)
+
+    other = app_module.app.test_client()
+    response = other.post('/configure_notifications', data=dict(RULE_FORM, owner='ann', token='wrong'))
+    assert response.status_code == 200 and 'already has rules' in response.get_data(as_text=True)
+    assert len(app_module.load_notification_rules()) == 1
+
+    assert other.post('/configure_notifications', data=dict(RULE_FORM, owner='ann', token=token)).status_code == 302
+    assert ann.post('/configure_notifications', data=dict(RULE_FORM, owner='ann')).status_code == 302 # Unlocked session
+    assert len(app_module.load_notification_rules()) == 3
+
+
+def test_rule_list_is_scoped_to_unlocked_owners(app_module):
+    ann, bob, visitor = (app_module.app.test_client() for _ in range(3))
+    _, page = _add_rule(ann, owner='ann', recipient='ann@example.com')
+    ann_token = TOKEN_PATTERN.search(page).group(1)
+    _add_rule(bob, owner='bob', recipient='bob@example.com')
+
+    assert _listed_ids(visitor) == []
+    assert 'bob@example.com' not in ann.get('/configure_notifications').get_data(as_text=True)
+    visitor.post('/notification_rules/unlock', data={'owner': 'ann', 'token': 'wrong'})
+    assert _listed_ids(visitor) == []
+    visitor.post('/notification_rules/unlock', data={'owner': 'ann', 'token': ann_token})
+    assert len(_listed_ids(visitor)) == 1
+    visitor.post('/notification_rules/lock')
+    assert _listed_ids(visitor) == []
+
+    visitor.post('/notification_rules/unlock', data={'token': 'admin-secret'})
+    assert len(_listed_ids(visitor)) == 2
+
+
+def test_only_the_owner_or_admin_deletes_a_rule(app_module):
+    ann, bob, admin = (app_module.app.test_client() for _ in range(3))
+    _add_rule(ann, owner='ann')
+    _add_rule(bob, owner='bob')
+    ann_rule, bob_rule = (rule['id'] for rule in app_module.load_notification_rules())
+
+    response = bob.post('/delete_notification_rule', data={'rule_id': ann_rule})
+    assert response.headers['Location'] == '/configure_notifications'
+    assert len(app_module.load_notification_rules()) == 2
+
+    ann.post('/delete_notification_rule', data={'rule_id': ann_rule})
+    assert [rule['id'] for rule in app_module.load_notification_rules()] == [bob_rule]
+
+    admin.post('/notification_rules/unlock', data={'token': 'admin-secret'})
+    admin.post('/delete_notification_rule', data={'rule_id': bob_rule})
+    assert app_module.load_notification_rules() == []
+
+
+def test_admin_assigns_legacy_rules_to_owners(app_module):
+    legacy = dict(RULE_FORM, id='legacy', search_month='2027-03', threshold=70.0, recipient='carl@example.com')
+    with open(app_module.NOTIFICATION_RULES_FILE, 'w') as f:
+        json.dump([legacy], f)
+    visitor, admin = app_module.app.test_client(), app_module.app.test_client()
+    assert _listed_ids(visitor) == []
+    assert visitor.post('/notification_rules/claim', data={'rule_id': 'legacy'}).status_code == 302
+    assert 'owner_token_hash' not in app_module.load_notification_rules()[0]
+
+    admin.post('/notification_rules/unlock', data={'token': 'admin-secret'})
+    assert 'unclaimed' in admin.get('/configure_notifications').get_data(as_text=True)
+    admin.post('/notification_rules/claim', data={'rule_id': 'legacy'}) # Defaults to the recipient
+    token = re.search(r'Access token for carl@example.com: ([\w-]+)\.',
+                      admin.get('/configure_notifications').get_data(as_text=True)).group(1)
+
+    carl = app_module.app.test_client()
+    carl.post('/notification_rules/unlock', data={'owner': 'carl@example.com', 'token': token})
+    assert _listed_ids(carl) == ['legacy']
+
+
+def test_check_offers_fresh_responses_to_the_matcher_only_once(app_module, mock_upstream, monkeypatch):
+    # Regression: fresh responses were offered by the fare client listener and again by the check,
+    # so every fetched query also counted as an 'unchanged' snapshot diff.
+    matcher = app_module.rule_index.matcher
+    monkeypatch.setattr(app_module.fare_client, '_response_listeners', [matcher.on_response])
+    monkeypatch.setattr(app_module, 'send_rule_alerts', lambda alerts: True)
+    rule = {'id': 'rule-fresh-offer', 'type': 'threshold', 'origin_iata': 'SOF', 'destination_iata': 'BCN',
+            'search_month': '2027-04', 'duration_from': 2, 'duration_to': 7, 'threshold': 10000, 'currency': 'EUR'}
+    app_module.save_notification_rules([rule])
+    api_url = app_module.fare_search.round_trip_url('SOF', 'BCN', 2027, 4, 2, 7, 'EUR')
+    with app_module.fare_client._fare_cache_lock:
+        app_module.fare_client._fare_cache.pop(api_url, None)
+    diffs = app_module.metrics.RULE_SNAPSHOT_DIFFS
+    before = {result: diffs.value(result=result) for result in ('new', 'unchanged')}
+
+    app_module.check_notification_rules() # Fetched upstream: offered by the listener only
+    assert diffs.value(result='new') == before['new'] + 1
+    assert diffs.value(result='unchanged') == before['unchanged']
+
+    app_module.check_notification_rules() # Served from the cache: offered by the check
+    assert diffs.value(result='unchanged') == before['unchanged'] + 1
@@ -0,0 +1,128 @@
+import gzip
+
+import pytest
+from flask import Flask, flash, request
+
+import fare_client
+import fx
+import page_cache
+
+API_URL = 'https://farfnd.test/cheapestPerDay?departureAirportIataCode=SOF&arrivalAirportIataCode=BGY'
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(page_cache, 'PAGE_CACHE_ENABLED', True)
+    flask_app = Flask(__name__)
+    flask_app.secret_key = 'test'
+    renders = []
+
+    @flask_app.route('/deals', methods=['GET', 'POST'])
+    @page_cache.cached_page
+    def deals():
+        fare = fare_client.fetch_json('cheapestPerDay', API_URL)
+        renders.append(fare['price'])
+        if request.args.get('warn'):
+            flash('Unknown airport code')
+        return f"<p>{fare['price']}</p>"
+
+    @flask_app.route('/flash-next')
+    def flash_next():
+        flash('Saved')
+        return 'ok'
+
+    fare_client._cache_put(API_URL, {'price': 10})
+    flask_app.renders = renders
+    yield flask_app
+    page_cache.clear()
+    with fare_client._fare_cache_lock:
+        fare_client._fare_cache.pop(API_URL, None)
+
+
+def test_page_key_normalizes_iata_codes_whitespace_and_order(app):
+    with app.test_request_context('/deals?destination_iata=%20bgy%20&origin_iata=sof&note=a%20%20b'):
+        key = page_cache.page_key()
+    with app.test_request_context('/deals', method='POST',
+                                  data={'origin_iata': 'SOF', 'note': 'a b', 'destination_iata': 'BGY'}):
+        assert page_cache.page_key() == key
+    assert key == ('deals', (('destination_iata', 'BGY'), ('note', 'a b'), ('origin_iata', 'SOF')))
+
+
+def test_page_key_keeps_non_iata_case(app):
+    with app.test_request_context('/deals?note=Hello'):
+        assert page_cache.page_key()[1] == (('note', 'Hello'),)
+
+
+def test_repeat_requests_are_served_from_the_cache(app):
+    client = app.test_client()
+    assert client.get('/deals?origin_iata=sof').data == b'<p>10</p>'
+    assert client.get('/deals?origin_iata=SOF').data == b'<p>10</p>'
+    assert app.renders == [10]
+
+
+def test_fare_cache_version_bump_invalidates_the_page(app):
+    client = app.test_client()
+    client.get('/deals')
+    fare_client._cache_put(API_URL, {'price': 12}, stored_at=fare_client.cache_version(API_URL) + 1)
+    assert client.get('/deals').data == b'<p>12</p>'
+    assert app.renders == [10, 12]
+
+
+def test_expired_fare_data_invalidates_the_page(app):
+    client = app.test_client()
+    client.get('/deals')
+    with fare_client._fare_cache_lock:
+        del fare_client._fare_cache[API_URL]
+    fare_client._cache_put(API_URL, {'price': 11})
+    client.get('/deals')
+    assert app.renders == [10, 11]
+
+
+def test_replaced_rate_table_invalidates_the_page(app, monkeypatch):
+    client = app.test_client()
+    client.get('/deals')
+    fx.get_table()
+    monkeypatch.setattr(fx, '_table', fx.RateTable({'GBP': 0.9})) # As reloaded after another worker's refresh
+    client.get('/deals')
+    assert app.renders == [10, 10]
+
+
+@pytest.mark.parametrize('accept_encoding, gzipped', [('gzip, deflate', True), ('GZIP', True), ('', False),
+                                                      ('identity', False)])
+def test_pages_are_gzipped_only_for_clients_that_accept_it(app, accept_encoding, gzipped):
+    client = app.test_client()
+    for _ in range(2): # Miss, then hit
+        response = client.get('/deals', headers={'Accept-Encoding': accept_encoding})
+        assert 'Accept-Encoding' in response.vary
+        assert response.mimetype == 'text/html'
+        if gzipped:
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert gzip.decompress(response.data) == b'<p>10</p>'
+        else:
+            assert 'Content-Encoding' not in response.headers
+            assert response.data == b'<p>10</p>'
+
+
+def test_pages_that_flash_are_never_cached(app):
+    # Separate clients, so the second request has no pending flash to bypass the cache with
+    app.test_client().get('/deals?warn=1')
+    app.test_client().get('/deals?warn=1')
+    assert app.renders == [10, 10]
+    assert page_cache.get(('deals', (('warn', '1'),))) is None
+
+
+def test_pending_flashes_bypass_a_cached_page(app):
+    client = app.test_client()
+    client.get('/deals')
+    client.get('/flash-next')
+    response = client.get('/deals')
+    assert app.renders == [10, 10]
+    assert response.status_code == 200
+    with client.session_transaction() as session:
+        assert session.get('_flashes') # Left for the page that renders them
+
+
+def test_pages_built_from_uncached_responses_are_not_stored(app):
+    with app.test_request_context('/deals'):
+        assert page_cache.put(page_cache.page_key(), b'<p>10</p>', 'text/html', {API_URL: None}) is None
+        assert page_cache.put(page_cache.page_key(), b'<p>10</p>', 'text/html', {}) is None
@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import price_matrix
+
+START = date(2027, 5, 1)
+
+
+def day(offset):
+    return START + timedelta(days=offset)
+
+
+def test_prices_to_array_places_fares_by_day_offset():
+    prices = price_matrix.prices_to_array({day(0): 10.0, day(2): 12.5, day(9): 5.0, day(1): None}, START, 4)
+    assert prices[0] == 10.0 and prices[2] == 12.5
+    assert np.isnan(prices[1]) and np.isnan(prices[3])
+
+
+def test_build_matrix_adds_outbound_and_return_day_prices():
+    outbound = np.array([10.0, 20.0])
+    inbound = np.array([1.0, 2.0, 3.0, 4.0])
+    matrix, durations = price_matrix.build_matrix(outbound, inbound, 1, 3)
+    assert durations.tolist() == [1, 2, 3]
+    # Day 1 + 3 nights needs inbound day 4, which is past the array and so NaN
+    assert matrix[0].tolist() == [12.0, 13.0, 14.0]
+    assert matrix[1, :2].tolist() == [23.0, 24.0] and np.isnan(matrix[1, 2])
+
+
+# (outbound {offset: price}, inbound {offset: price}, duration range, expected best (out offset, duration, price))
+CHEAPEST_CELL_CASES = [
+    ({0: 50, 1: 40}, {2: 30, 3: 30, 4: 30}, (2, 3), (1, 2, 70.0)),
+    ({0: 50, 1: 40}, {2: 5, 3: 30, 4: 30}, (2, 3), (0, 2, 55.0)),
+    ({0: 50, 2: 20}, {1: 100, 5: 10}, (1, 3), (2, 3, 30.0)),
+    ({0: 19.99}, {7: 20.01}, (7, 7), (0, 7, 40.0)),
+    ({0: 50}, {9: 10}, (2, 3), None),
+]
+
+
+@pytest.mark.parametrize('outbound, inbound, durations, expected', CHEAPEST_CELL_CASES)
+def test_summarize_finds_the_cheapest_departure_and_stay(outbound, inbound, durations, expected):
+    duration_from, duration_to = durations
+    num_days = 3
+    out_array = price_matrix.prices_to_array({day(k): v for k, v in outbound.items()}, START, num_days)
+    in_array = price_matrix.prices_to_array({day(k): v for k, v in inbound.items()}, START, num_days + duration_to)
+    matrix, stay_lengths = price_matrix.build_matrix(out_array, in_array, duration_from, duration_to)
+    summary = price_matrix.summarize(matrix, stay_lengths, START)
+    if expected is None:
+        assert summary['best'] is None
+        assert summary['by_duration'] == []
+        assert all(row['best_duration'] is None for row in summary['rows'])
+        return
+    out_offset, duration, price = expected
+    assert summary['best'] == {
+        'price': price,
+        'duration': duration,
+        'out_date': day(out_offset),
+        'in_date': day(out_offset + duration),
+    }
+
+
+def test_summarize_reports_the_cheapest_cell_per_stay_length_and_day():
+    out_array = price_matrix.prices_to_array({day(0): 50.0, day(1): 40.0}, START, 2)
+    in_array = price_matrix.prices_to_array({day(2): 5.0, day(3): 30.0, day(4): 30.0}, START, 5)
+    matrix, durations = price_matrix.build_matrix(out_array, in_array, 2, 3)
+    summary = price_matrix.summarize(matrix, durations, START)
+    assert [(cell['duration'], cell['out_date'], cell['price']) for cell in summary['by_duration']] == [
+        (2, day(0), 55.0), (3, day(1), 70.0)]
+    assert [row['prices'] for row in summary['rows']] == [[55.0, 80.0], [70.0, 70.0]]
+    assert [row['best_duration'] for row in summary['rows']] == [2, 2]
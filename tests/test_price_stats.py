@@ -0,0 +1,92 @@
+import statistics
+from datetime import date, timedelta
+
+import pytest
+
+import price_stats
+from price_stats import FareStats, PriceStatsStore
+
+PRICES = [42.0, 35.5, 60.25, 38.0, 44.75, 29.99]
+
+
+def test_welford_matches_the_batch_mean_and_variance():
+    stats = FareStats()
+    for price in PRICES:
+        stats.update(price)
+    assert stats.count == len(PRICES)
+    assert stats.mean == pytest.approx(statistics.mean(PRICES))
+    assert stats.variance == pytest.approx(statistics.variance(PRICES))
+    assert stats.stddev == pytest.approx(statistics.stdev(PRICES))
+    assert stats.minimum == min(PRICES)
+    assert stats.last_price == PRICES[-1]
+
+
+def test_ewma_weights_the_newest_price_by_alpha():
+    stats = FareStats()
+    expected = None
+    for price in PRICES:
+        stats.update(price, alpha=0.3)
+        expected = price if expected is None else 0.3 * price + 0.7 * expected
+    assert stats.ewma == pytest.approx(expected)
+
+
+def test_previous_baselines_exclude_the_latest_price():
+    stats = FareStats()
+    stats.update(100.0)
+    assert stats.previous is None
+    stats.update(50.0)
+    assert stats.previous == {'mean': 100.0, 'min': 100.0, 'ewma': 100.0}
+    assert stats.variance == pytest.approx(1250.0)
+
+
+def test_single_observation_has_zero_variance():
+    stats = FareStats()
+    stats.update(10.0)
+    assert stats.variance == 0.0
+
+
+def test_round_trips_through_to_list():
+    stats = FareStats()
+    for price in PRICES:
+        stats.update(price)
+    restored = FareStats.from_list(stats.to_list())
+    assert restored.to_list() == stats.to_list()
+    assert restored.previous == stats.previous
+
+
+def test_find_price_drops_compares_both_legs_with_their_previous_baseline():
+    store = PriceStatsStore()
+    out_date, in_date = date(2027, 3, 10), date(2027, 3, 13)
+    for _ in range(5):
+        store.observe('SOF', 'BCN', out_date, 50.0)
+        store.observe('BCN', 'SOF', in_date, 50.0)
+    store.observe('SOF', 'BCN', out_date, 30.0)
+    store.observe('BCN', 'SOF', in_date, 40.0)
+
+    [drop] = price_stats.find_price_drops(store, 'SOF', 'BCN', 2027, 3, 2, 5, drop_percent=25, baseline='mean')
+    assert (drop['out_date'], drop['in_date']) == (out_date, in_date)
+    assert drop['price'] == 70.0 and drop['baseline_price'] == 100.0 and drop['drop_percent'] == 30.0
+    assert price_stats.find_price_drops(store, 'SOF', 'BCN', 2027, 3, 2, 5, drop_percent=35) == []
+
+
+def test_find_price_drops_needs_min_samples():
+    store = PriceStatsStore()
+    out_date, in_date = date(2027, 3, 10), date(2027, 3, 12)
+    for price in (50.0, 50.0, 10.0):
+        store.observe('SOF', 'BCN', out_date, price)
+        store.observe('BCN', 'SOF', in_date, price)
+    assert price_stats.find_price_drops(store, 'SOF', 'BCN', 2027, 3, 2, 2, 10, min_samples=5) == []
+    assert len(price_stats.find_price_drops(store, 'SOF', 'BCN', 2027, 3, 2, 2, 10, min_samples=3)) == 1
+
+
+def test_prune_drops_departed_dates_and_restore_skips_them():
+    store = PriceStatsStore()
+    today = date.today()
+    store.observe('SOF', 'BCN', today - timedelta(days=1), 10.0)
+    store.observe('SOF', 'BCN', today, 10.0)
+    exported = store.export()
+    assert store.prune(today) == 1 and len(store) == 1
+
+    restored = PriceStatsStore()
+    assert restored.restore(exported) == 1
+    assert restored.get('SOF', 'BCN', today).count == 1
@@ -0,0 +1,80 @@
+import time
+from datetime import date
+
+import pytest
+
+import refresh_scheduler
+from refresh_scheduler import (REFRESH_MAX_INTERVAL_SECONDS, REFRESH_MIN_INTERVAL_SECONDS, REFRESH_PROXIMITY_DAYS,
+                               REFRESH_VOLATILITY_WEIGHT, RefreshScheduler, refresh_interval)
+
+TODAY = date(2026, 10, 19)
+
+
+def test_days_to_departure_is_zero_for_the_current_month():
+    assert refresh_scheduler.days_to_departure(date(2026, 10, 1), TODAY) == 0
+    assert refresh_scheduler.days_to_departure(date(2026, 11, 1), TODAY) == 13
+
+
+def test_refresh_interval_grows_with_days_out_between_the_bounds():
+    assert refresh_interval(0, 0.0) == REFRESH_MIN_INTERVAL_SECONDS
+    assert refresh_interval(2 * REFRESH_PROXIMITY_DAYS, 0.0) == pytest.approx(2 * REFRESH_MIN_INTERVAL_SECONDS)
+    assert refresh_interval(10000, 0.0) == REFRESH_MAX_INTERVAL_SECONDS
+
+
+def test_refresh_interval_shrinks_with_volatility_but_not_below_the_minimum():
+    days_out = 10 * REFRESH_PROXIMITY_DAYS
+    assert refresh_interval(days_out, 1.0) == pytest.approx(refresh_interval(days_out, 0.0) / (1 + REFRESH_VOLATILITY_WEIGHT))
+    assert refresh_interval(0, 1.0) == REFRESH_MIN_INTERVAL_SECONDS
+
+
+def test_due_takes_new_items_nearest_month_first_within_the_budget():
+    scheduler = RefreshScheduler()
+    items = [('SOF', 'BCN', date(2027, month, 1)) for month in (3, 1, 2)]
+    scheduler.sync(items, TODAY)
+    assert scheduler.due(budget=2) == [('SOF', 'BCN', date(2027, 1, 1)), ('SOF', 'BCN', date(2027, 2, 1))]
+    assert scheduler.due(budget=2) == [('SOF', 'BCN', date(2027, 3, 1))]
+    assert scheduler.due(budget=2) == [] # Handed out items wait REFRESH_MIN_INTERVAL_SECONDS
+
+
+def test_items_handed_out_are_retried_if_never_recorded():
+    scheduler = RefreshScheduler()
+    item = ('SOF', 'BCN', date(2027, 1, 1))
+    scheduler.sync([item], TODAY)
+    assert scheduler.due() == [item]
+    assert scheduler.due(now=time.time() + REFRESH_MIN_INTERVAL_SECONDS + 1) == [item]
+
+
+def test_record_refresh_tracks_volatility_and_reschedules():
+    scheduler = RefreshScheduler()
+    item = ('SOF', 'BCN', date(2027, 6, 1))
+    scheduler.sync([item], TODAY)
+    scheduler.due()
+    days_out = refresh_scheduler.days_to_departure(item[2], TODAY)
+
+    steady = scheduler.record_refresh(item, {'2027-06-01': 10.0, '2027-06-02': 20.0}, TODAY)
+    assert steady == refresh_interval(days_out, 0.0)
+    volatile = scheduler.record_refresh(item, {'2027-06-01': 11.0, '2027-06-02': 20.0}, TODAY)
+    assert volatile == refresh_interval(days_out, 0.5) < steady
+    [(_, due_at, volatility, refreshed_at)] = scheduler.status()
+    assert volatility == 0.5 and refreshed_at is not None
+    assert due_at == pytest.approx(time.time() + volatile, abs=5)
+
+
+def test_failed_refresh_keeps_the_last_prices():
+    scheduler = RefreshScheduler()
+    item = ('SOF', 'BCN', date(2027, 6, 1))
+    scheduler.sync([item], TODAY)
+    scheduler.record_refresh(item, {'2027-06-01': 10.0}, TODAY)
+    scheduler.record_refresh(item, None, TODAY)
+    scheduler.record_refresh(item, {'2027-06-01': 12.0}, TODAY)
+    assert scheduler.status()[0][2] == 1.0 # Compared with the last successful fetch
+
+
+def test_sync_drops_items_no_longer_tracked():
+    scheduler = RefreshScheduler()
+    kept, dropped = ('SOF', 'BCN', date(2027, 1, 1)), ('SOF', 'MAD', date(2027, 1, 1))
+    scheduler.sync([kept, dropped], TODAY)
+    scheduler.sync([kept], TODAY)
+    assert len(scheduler) == 1
+    assert scheduler.due() == [kept]
+    assert scheduler.record_refresh(dropped, {}, TODAY) is None
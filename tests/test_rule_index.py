@@ -0,0 +1,135 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import fare_client
+import rule_index
+from rule_index import RuleMatcher
+
+API_URL = 'https://example.invalid/roundTripFares?query=1'
+
+
+def _rule(rule_id, threshold, duration_from=2, duration_to=5, month='2027-03', destination='BCN'):
+    return {'id': rule_id, 'origin_iata': 'SOF', 'destination_iata': destination, 'search_month': month,
+            'duration_from': duration_from, 'duration_to': duration_to, 'threshold': threshold}
+
+
+def _fare(out_day, in_day, price):
+    return {
+        'outbound': {'departureAirport': {'iataCode': 'SOF'}, 'arrivalAirport': {'iataCode': 'BCN'},
+                     'departureDate': f'2027-03-{out_day:02d}T08:00:00'},
+        'inbound': {'departureAirport': {'iataCode': 'BCN'}, 'arrivalAirport': {'iataCode': 'SOF'},
+                    'departureDate': f'2027-03-{in_day:02d}T10:00:00'},
+        'summary': {'price': {'value': price, 'currencyCode': 'EUR'}},
+    }
+
+
+def _response(*fares):
+    return {'fares': list(fares)}
+
+
+@pytest.fixture
+def matcher(monkeypatch):
+    monkeypatch.setattr(fare_client, 'response_digest', lambda api_url: None)
+    matcher = RuleMatcher()
+    matcher.load_rules([_rule('cheap', 50), _rule('any', 200), _rule('short', 200, 1, 2)])
+    return matcher
+
+
+def test_matching_rules_finds_every_threshold_above_the_price(matcher):
+    rules = matcher.matching_rules('SOF', 'BCN', date(2027, 3, 10), date(2027, 3, 13), 40.0, 'EUR')
+    assert sorted(rule['id'] for rule in rules) == ['any', 'cheap']
+    rules = matcher.matching_rules('SOF', 'BCN', date(2027, 3, 10), date(2027, 3, 12), 60.0, 'EUR')
+    assert sorted(rule['id'] for rule in rules) == ['any', 'short']
+
+
+def test_matching_rules_is_strictly_below_the_threshold(matcher):
+    rules = matcher.matching_rules('SOF', 'BCN', date(2027, 3, 10), date(2027, 3, 13), 50.0, 'EUR')
+    assert [rule['id'] for rule in rules] == ['any']
+
+
+def test_matching_rules_ignores_other_routes_and_months(matcher):
+    assert matcher.matching_rules('SOF', 'MAD', date(2027, 3, 10), date(2027, 3, 13), 1.0, 'EUR') == []
+    assert matcher.matching_rules('SOF', 'BCN', date(2027, 4, 10), date(2027, 4, 13), 1.0, 'EUR') == []
+
+
+def test_non_threshold_rules_are_not_indexed():
+    matcher = RuleMatcher()
+    matcher.load_rules([_rule('t', 50), dict(_rule('d', 50), type='price_drop'), {'id': 'broken'}])
+    assert len(matcher) == 1
+
+
+def test_matches_are_queued_per_rule_until_popped(matcher):
+    assert matcher.offer_round_trip_response(_response(_fare(10, 13, 40.0), _fare(11, 14, 100.0))) == 3
+    pending = matcher.pop_pending()
+    assert {rule_id: len(deals) for rule_id, deals in pending.items()} == {'cheap': 1, 'any': 2}
+    assert matcher.pop_pending() == {}
+
+
+def test_snapshot_diff_only_matches_new_or_repriced_fares(matcher):
+    first = _response(_fare(10, 13, 40.0), _fare(11, 14, 100.0))
+    assert matcher.offer_round_trip_response(first, API_URL) == 3
+    assert matcher.offer_round_trip_response(first, API_URL) == 0 # Nothing new
+    repriced = _response(_fare(10, 13, 45.0), _fare(11, 14, 100.0))
+    assert matcher.offer_round_trip_response(repriced, API_URL) == 2 # Only the repriced fare
+    assert matcher.offer_round_trip_response(first, 'https://example.invalid/other') == 3 # Snapshots are per query
+
+
+def test_identical_digest_skips_the_payload(matcher, monkeypatch):
+    monkeypatch.setattr(fare_client, 'response_digest', lambda api_url: 'same')
+    assert matcher.offer_round_trip_response(_response(_fare(10, 13, 40.0)), API_URL) == 2
+    # A byte-identical payload isn't even parsed
+    assert matcher.offer_round_trip_response(_response(_fare(12, 14, 1.0)), API_URL) == 0
+
+
+def test_rule_changes_and_forget_snapshots_restart_the_diffs(matcher):
+    response = _response(_fare(10, 13, 40.0))
+    matcher.offer_round_trip_response(response, API_URL)
+    matcher.load_rules([_rule('cheap', 50), _rule('new', 45)])
+    assert matcher.offer_round_trip_response(response, API_URL) == 2
+    matcher.forget_snapshots()
+    assert matcher.offer_round_trip_response(response, API_URL) == 2
+
+
+def test_daily_fares_compose_round_trips_in_both_directions(matcher):
+    assert matcher.offer_daily_fares('SOF', 'BCN', {date(2027, 3, 10): (20.0, 'EUR')}) == 0 # No return days yet
+    matched = matcher.offer_daily_fares('BCN', 'SOF', {date(2027, 3, 12): (15.0, 'EUR'), date(2027, 3, 20): (1.0, 'EUR')})
+    assert matched == 3 # 10 -> 12 (2 days) for every rule; 10 -> 20 is too long
+    deals = matcher.pop_pending()['cheap']
+    assert [(deal['outbound_dep_time'], deal['inbound_dep_time'], deal['total_price']) for deal in deals] == [
+        ('2027-03-10', '2027-03-12', 35.0)]
+
+
+def test_match_daily_on_a_route_emptied_concurrently_matches_nothing(matcher):
+    # Regression: the durations were read from the index outside the lock, and
+    # min()/max() raised ValueError when load_rules() had just dropped the route.
+    matcher.offer_daily_fares('SOF', 'BCN', {date(2027, 3, 10): (20.0, 'EUR')})
+    matcher.offer_daily_fares('BCN', 'SOF', {date(2027, 3, 12): (15.0, 'EUR')})
+    matcher.pop_pending()
+    matcher.load_rules([_rule('elsewhere', 50, destination='MAD')])
+    assert matcher._match_daily(('SOF', 'BCN'), [date(2027, 3, 10)], outbound_days=True) == 0
+
+
+def test_pending_deals_expire(matcher, monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rule_index, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    matcher.offer_round_trip_response(_response(_fare(10, 13, 40.0)))
+    clock.now += rule_index.RULE_MATCH_PENDING_MAX_AGE_SECONDS + 1
+    matcher.offer_round_trip_response(_response(_fare(11, 14, 41.0)))
+    pending = matcher.pop_pending()
+    assert [deal['total_price'] for deal in pending['cheap']] == [41.0]
+
+
+def test_full_pending_queue_makes_room_by_dropping_expired_deals(matcher, monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rule_index, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(rule_index, 'RULE_MATCH_MAX_PENDING', 1)
+    matcher.offer_round_trip_response(_response(_fare(10, 13, 40.0)))
+    matcher.offer_round_trip_response(_response(_fare(11, 14, 41.0)))
+    assert [deal['total_price'] for deal in matcher.pop_pending()['cheap']] == [40.0] # Full, nothing expired
+
+    matcher.offer_round_trip_response(_response(_fare(10, 13, 40.0)))
+    clock.now += rule_index.RULE_MATCH_PENDING_MAX_AGE_SECONDS + 1
+    matcher.offer_round_trip_response(_response(_fare(11, 14, 41.0)))
+    assert [deal['total_price'] for deal in matcher.pop_pending()['cheap']] == [41.0]
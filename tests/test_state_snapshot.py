@@ -0,0 +1,39 @@
+import threading
+from datetime import datetime
+
+import fare_client
+import price_stats
+import state_snapshot
+
+lock = threading.Lock()
+
+
+class GuardedSet(set):
+    """A set that fails the test if it's iterated without the findings lock held."""
+
+    def __iter__(self):
+        assert lock.locked(), "notified_deals iterated outside the lock"
+        return super().__iter__()
+
+
+def test_snapshot_round_trips_deal_findings_copied_under_the_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(fare_client, 'export_cache', lambda: [])
+    monkeypatch.setattr(price_stats.route_stats, 'export', lambda: [])
+    path = str(tmp_path / 'snapshot.json.z')
+    findings = {'last_checked': datetime(2026, 10, 18, 9, 30), 'deals_under_25': [{'price': 19.99}],
+                'notified_deals': GuardedSet({'b-deal', 'a-deal'})}
+    state_snapshot.save_snapshot(findings, path, lock=lock)
+
+    restored = {'last_checked': None, 'deals_under_25': [], 'notified_deals': {'c-deal'}}
+    state_snapshot.restore_snapshot(restored, path, lock=lock)
+    assert restored == {'last_checked': datetime(2026, 10, 18, 9, 30), 'deals_under_25': [{'price': 19.99}],
+                        'notified_deals': {'a-deal', 'b-deal', 'c-deal'}}
+
+
+def test_nothing_worth_keeping_writes_no_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(fare_client, 'export_cache', lambda: [])
+    monkeypatch.setattr(price_stats.route_stats, 'export', lambda: [])
+    path = tmp_path / 'snapshot.json.z'
+    findings = {'last_checked': None, 'deals_under_25': [], 'notified_deals': set()}
+    assert state_snapshot.save_snapshot(findings, str(path), lock=lock) == 0
+    assert not path.exists()